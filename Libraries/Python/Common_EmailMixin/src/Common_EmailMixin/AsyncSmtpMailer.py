@@ -0,0 +1,622 @@
+# ----------------------------------------------------------------------
+# |
+# |  AsyncSmtpMailer.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-05 13:47:09
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Contains the AsyncSmtpMailer object"""
+
+import asyncio
+import base64
+import smtplib
+import socket
+import ssl
+import sys
+import weakref
+
+from dataclasses import dataclass, field
+from email.message import Message
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+
+from .SmtpDeadline import SmtpDeadline, SmtpTimeoutError
+from .SmtpMailer import SmtpMailer
+from .SmtpThrottle import SmtpThrottle
+from .SmtpTransactions import CreateEnvelopeCommands, CreateFailureResult, PrepareContent, ProcessRecipientReplies, SendResult, Transaction
+from .StreamingMessage import StreamingMessage
+
+
+# ----------------------------------------------------------------------
+@dataclass(frozen=True)
+class AsyncSmtpMailer(object):
+    """\
+    Uses SmtpMailer profiles to send messages without blocking the event loop.
+
+    The profile's rate and session limits, timeouts, and deadline are honored in the same way as
+    they are by SmtpMailer, except that messages aren't retried. The connect timeout applies to
+    establishing and authenticating a session as a whole, and the deadline applies to each message
+    (including the time spent waiting for a session).
+    """
+
+    # ----------------------------------------------------------------------
+    # |  Public Types
+    DEFAULT_MAX_CONCURRENT_SESSIONS         = 4
+
+    # ----------------------------------------------------------------------
+    # |  Public Data
+    mailer: SmtpMailer
+
+    # Note that the limit is shared by all AsyncSmtpMailer objects associated with the same
+    # connection key within an event loop; the first object to send a message establishes the
+    # limit.
+    max_concurrent_sessions: int            = field(kw_only=True, default=DEFAULT_MAX_CONCURRENT_SESSIONS)
+
+    # ----------------------------------------------------------------------
+    # |  Public Methods
+    @classmethod
+    def Load(
+        cls,
+        profile_name: str,
+        max_concurrent_sessions: int=DEFAULT_MAX_CONCURRENT_SESSIONS,
+    ) -> "AsyncSmtpMailer":
+        """Loads a profile previously saved by SmtpMailer"""
+
+        return cls(
+            SmtpMailer.Load(profile_name),
+            max_concurrent_sessions=max_concurrent_sessions,
+        )
+
+    # ----------------------------------------------------------------------
+    async def SendMessage(
+        self,
+        recipients: List[str],
+        subject: str,
+        message: Union[str, Path],
+        attachment_filenames: Optional[List[Path]]=None,
+        message_format: str="plain", # "html"
+        compress_attachments_threshold: Optional[int]=None,
+        *,
+        timeout: Optional[float]=None,
+    ) -> None:
+        """\
+        Sends an email message using the current profile; asyncio.TimeoutError is raised if the
+        message could not be sent within `timeout` seconds, and SmtpTimeoutError is raised if the
+        profile's timeouts or deadline expire.
+        """
+
+        transaction = Transaction.FromMessage(
+            self.mailer.CreateStreamingMessage(
+                recipients,
+                subject,
+                message,
+                attachment_filenames,
+                message_format,
+                compress_attachments_threshold,
+            ),
+        )
+
+        deadline = SmtpDeadline(self.mailer.deadline_seconds)
+        throttle = self.mailer._GetThrottle()  # pylint: disable=protected-access
+
+        # ----------------------------------------------------------------------
+        async def Impl() -> SendResult:
+            async with self._GetSemaphore():
+                session = await _Session.Create(self.mailer, throttle)
+
+                try:
+                    await _WaitForMessage(throttle)
+                    result = await session.Send(transaction)
+                except:
+                    session.Close()
+                    raise
+
+                await session.Quit()
+
+                return result
+
+        # ----------------------------------------------------------------------
+
+        result = await asyncio.wait_for(_WaitForDeadline(Impl(), deadline), timeout)
+
+        result.RaiseIfFailed()
+
+    # ----------------------------------------------------------------------
+    async def SendMessages(
+        self,
+        messages: Iterable[Union[Message, StreamingMessage]],
+        *,
+        timeout: Optional[float]=None,
+    ) -> List[SendResult]:
+        """\
+        Sends messages concurrently over as many as `max_concurrent_sessions` sessions, returning
+        the result of each message.
+
+        `timeout` (and the profile's deadline) applies to each message; a message that cannot be
+        sent within that time is reported as a failure and the session used to send it is discarded.
+        """
+
+        transactions = [Transaction.FromMessage(message) for message in messages]
+        results: List[Optional[SendResult]] = [None] * len(transactions)
+
+        # Workers pull indexes from this shared iterator until all messages have been sent
+        indexes = iter(range(len(transactions)))
+
+        throttle = self.mailer._GetThrottle()  # pylint: disable=protected-access
+
+        # ----------------------------------------------------------------------
+        async def Worker() -> None:
+            async with self._GetSemaphore():
+                session: Optional[_Session] = None
+
+                # ----------------------------------------------------------------------
+                async def Send(
+                    transaction: Transaction,
+                ) -> SendResult:
+                    nonlocal session
+
+                    if session is None:
+                        session = await _Session.Create(self.mailer, throttle)
+
+                    await _WaitForMessage(throttle)
+
+                    return await session.Send(transaction)
+
+                # ----------------------------------------------------------------------
+
+                try:
+                    for index in indexes:
+                        deadline = SmtpDeadline(self.mailer.deadline_seconds)
+
+                        try:
+                            results[index] = await asyncio.wait_for(
+                                _WaitForDeadline(Send(transactions[index]), deadline),
+                                timeout,
+                            )
+
+                        except (asyncio.TimeoutError, smtplib.SMTPException, OSError) as ex:
+                            results[index] = SendResult([], {}, -1, (str(ex) or type(ex).__name__).encode("utf-8"))
+
+                            if session is not None:
+                                session.Close()
+                                session = None
+
+                finally:
+                    if session is not None:
+                        await session.Quit()
+
+        # ----------------------------------------------------------------------
+
+        await asyncio.gather(
+            *(Worker() for _ in range(min(self.max_concurrent_sessions, len(transactions)))),
+        )
+
+        assert all(result is not None for result in results)
+        return results  # type: ignore
+
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    def _GetSemaphore(self) -> asyncio.Semaphore:
+        semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+
+        semaphore = semaphores.get(self.mailer.connection_key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrent_sessions)
+            semaphores[self.mailer.connection_key] = semaphore
+
+        return semaphore
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+ReturnT                                     = TypeVar("ReturnT")
+
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, asyncio.Semaphore]]"   = weakref.WeakKeyDictionary()
+
+_local_hostname: Optional[str]              = None
+
+# Amount of message content produced by a worker thread before it is written
+_content_batch_size                         = 1024 * 1024
+
+
+# ----------------------------------------------------------------------
+class _Session(object):
+    """Authenticated SMTP session that communicates via non-blocking streams"""
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    async def Create(
+        cls,
+        mailer: SmtpMailer,
+        throttle: SmtpThrottle,
+    ) -> "_Session":
+        """Creates a session once the throttle allows it; the session is released by the throttle when it is closed"""
+
+        release_func = await _AcquireSessionSlot(throttle)
+
+        try:
+            session = await _WaitFor(
+                cls._Connect(mailer),
+                mailer.connect_timeout_seconds,
+                "Unable to connect to '{}' within {} seconds.".format(mailer.host, mailer.connect_timeout_seconds),
+            )
+
+        except:
+            release_func()
+            raise
+
+        session._release_func = release_func  # pylint: disable=protected-access
+
+        return session
+
+    # ----------------------------------------------------------------------
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        command_timeout: Optional[float],
+    ):
+        self._reader                        = reader
+        self._writer                        = writer
+        self._command_timeout               = command_timeout
+
+        self._extensions: Dict[str, str]    = {}
+        self._release_func: Optional[Callable[[], None]]    = None
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    async def _Connect(
+        cls,
+        mailer: SmtpMailer,
+    ) -> "_Session":
+        if mailer.ssl:
+            reader, writer = await asyncio.open_connection(
+                mailer.host,
+                mailer.port or 465,
+                ssl=ssl.create_default_context(),
+            )
+        else:
+            reader, writer = await asyncio.open_connection(mailer.host, mailer.port or 26)
+
+        session = cls(reader, writer, mailer.command_timeout_seconds)
+
+        try:
+            code, response = await session._ReadReply()  # pylint: disable=protected-access
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, response)
+
+            await session._Ehlo()  # pylint: disable=protected-access
+
+            if not mailer.ssl:
+                await session._StartTls(mailer.host)  # pylint: disable=protected-access
+                await session._Ehlo()  # pylint: disable=protected-access
+
+            await session._Login(mailer.username, mailer.password)  # pylint: disable=protected-access
+
+        except:
+            session.Close()
+            raise
+
+        return session
+
+    # ----------------------------------------------------------------------
+    async def Send(
+        self,
+        transaction: Transaction,
+    ) -> SendResult:
+        commands = CreateEnvelopeCommands(transaction)
+        rcpt_replies: List[Tuple[int, bytes]] = []
+
+        if "pipelining" in self._extensions:
+            self._writer.write(b"".join(commands))
+            await self._Drain()
+
+            mail_code, mail_response = await self._ReadReply()
+            rcpt_replies = [await self._ReadReply() for _ in transaction.recipients]
+            data_code, data_response = await self._ReadReply()
+
+        else:
+            mail_code, mail_response = await self._Command(commands[0])
+
+            if mail_code == 250:
+                for command in commands[1:-1]:
+                    rcpt_replies.append(await self._Command(command))
+
+            if mail_code == 250 and any(code in (250, 251) for code, _ in rcpt_replies):
+                data_code, data_response = await self._Command(commands[-1])
+            else:
+                data_code, data_response = -1, b""
+
+        accepted, refused = ProcessRecipientReplies(transaction.recipients, rcpt_replies)
+
+        if mail_code == 250 and accepted and data_code == 354:
+            # The content is produced by a worker thread, as reading and encoding it (and waiting
+            # for compressed content) would otherwise block the event loop.
+            loop = asyncio.get_running_loop()
+            chunks = PrepareContent(transaction.content)
+
+            while True:
+                batch = await loop.run_in_executor(None, _ReadBatch, chunks)
+                if not batch:
+                    break
+
+                self._writer.writelines(batch)
+                await self._Drain()
+
+            self._writer.write(b".\r\n")
+            await self._Drain()
+
+            code, response = await self._ReadReply()
+
+            return SendResult(accepted, refused, code, response)
+
+        if data_code == 354:
+            await self._Command(b".\r\n")
+
+        await self._Command(b"RSET\r\n")
+
+        return CreateFailureResult(accepted, refused, mail_code, mail_response, data_code, data_response)
+
+    # ----------------------------------------------------------------------
+    async def Quit(self) -> None:
+        # The session is closed (and its slot released) even if the QUIT command is cancelled
+        try:
+            await self._Command(b"QUIT\r\n")
+        except (smtplib.SMTPException, OSError):
+            pass
+        finally:
+            self.Close()
+
+    # ----------------------------------------------------------------------
+    def Close(self) -> None:
+        self._writer.close()
+
+        if self._release_func is not None:
+            self._release_func()
+            self._release_func = None
+
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    async def _Command(
+        self,
+        command: bytes,
+    ) -> Tuple[int, bytes]:
+        self._writer.write(command)
+        await self._Drain()
+
+        return await self._ReadReply()
+
+    # ----------------------------------------------------------------------
+    async def _ReadReply(self) -> Tuple[int, bytes]:
+        lines: List[bytes] = []
+
+        while True:
+            line = await _WaitFor(
+                self._reader.readline(),
+                self._command_timeout,
+                "The SMTP server did not respond within {} seconds.".format(self._command_timeout),
+            )
+            if not line:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+            lines.append(line[4:].strip())
+
+            if line[3:4] != b"-":
+                break
+
+        try:
+            code = int(line[:3])
+        except ValueError:
+            code = -1
+
+        return code, b"\n".join(lines)
+
+    # ----------------------------------------------------------------------
+    async def _Drain(self) -> None:
+        await _WaitFor(
+            self._writer.drain(),
+            self._command_timeout,
+            "The SMTP server did not accept data within {} seconds.".format(self._command_timeout),
+        )
+
+    # ----------------------------------------------------------------------
+    async def _Ehlo(self) -> None:
+        global _local_hostname  # pylint: disable=global-statement
+
+        if _local_hostname is None:
+            _local_hostname = await asyncio.get_running_loop().run_in_executor(None, socket.getfqdn)
+
+        code, response = await self._Command("EHLO {}\r\n".format(_local_hostname).encode("ascii"))
+
+        if code != 250:
+            code, response = await self._Command("HELO {}\r\n".format(_local_hostname).encode("ascii"))
+            if code != 250:
+                raise smtplib.SMTPHeloError(code, response)
+
+            self._extensions = {}
+            return
+
+        extensions: Dict[str, str] = {}
+
+        # The first line is the server's greeting
+        for line in response.decode("latin-1").split("\n")[1:]:
+            name, _, params = line.partition(" ")
+            extensions[name.lower()] = params.strip()
+
+        self._extensions = extensions
+
+    # ----------------------------------------------------------------------
+    async def _StartTls(
+        self,
+        server_hostname: str,
+    ) -> None:
+        if "starttls" not in self._extensions:
+            raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+
+        code, response = await self._Command(b"STARTTLS\r\n")
+        if code != 220:
+            raise smtplib.SMTPResponseException(code, response)
+
+        context = ssl.create_default_context()
+
+        if sys.version_info >= (3, 11):
+            await self._writer.start_tls(context, server_hostname=server_hostname)
+        else:
+            loop = asyncio.get_running_loop()
+            protocol = self._writer.transport.get_protocol()
+
+            transport = await loop.start_tls(
+                self._writer.transport,
+                protocol,
+                context,
+                server_hostname=server_hostname,
+            )
+
+            self._writer = asyncio.StreamWriter(transport, protocol, self._reader, loop)  # type: ignore
+
+    # ----------------------------------------------------------------------
+    async def _Login(
+        self,
+        username: str,
+        password: str,
+    ) -> None:
+        mechanisms = self._extensions.get("auth", "").upper().split()
+
+        if "PLAIN" in mechanisms or "LOGIN" not in mechanisms:
+            code, response = await self._Command(
+                "AUTH PLAIN {}\r\n".format(_Base64("\0{}\0{}".format(username, password))).encode("ascii"),
+            )
+        else:
+            code, response = await self._Command("AUTH LOGIN {}\r\n".format(_Base64(username)).encode("ascii"))
+
+            if code == 334:
+                code, response = await self._Command("{}\r\n".format(_Base64(password)).encode("ascii"))
+
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, response)
+
+
+# ----------------------------------------------------------------------
+def _Base64(
+    value: str,
+) -> str:
+    return base64.b64encode(value.encode("utf-8")).decode("ascii")
+
+
+# ----------------------------------------------------------------------
+async def _WaitFor(
+    awaitable: Awaitable[ReturnT],
+    timeout: Optional[float],
+    error_message: str,
+) -> ReturnT:
+    """Raises SmtpTimeoutError with the provided message if `awaitable` doesn't complete within `timeout` seconds"""
+
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+
+    except SmtpTimeoutError:
+        raise
+
+    except asyncio.TimeoutError as ex:
+        raise SmtpTimeoutError(error_message) from ex
+
+
+# ----------------------------------------------------------------------
+async def _WaitForDeadline(
+    awaitable: Awaitable[ReturnT],
+    deadline: SmtpDeadline,
+) -> ReturnT:
+    return await _WaitFor(
+        awaitable,
+        deadline.GetRemainingSeconds(),
+        "The message could not be sent within {} seconds.".format(deadline.seconds),
+    )
+
+
+# ----------------------------------------------------------------------
+async def _AcquireSessionSlot(
+    throttle: SmtpThrottle,
+) -> Callable[[], None]:
+    """Waits until a session can be started, returning a function that ends it"""
+
+    if throttle.max_concurrent_sessions is None:
+        return lambda: None
+
+    loop = asyncio.get_running_loop()
+
+    # The throttle is polled (rather than waited upon in a worker thread) so that tasks waiting
+    # for a session don't occupy the threads needed by the tasks with active sessions. Each poll
+    # locks files, so it runs in a worker thread rather than on the event loop. The wait is
+    # limited by the deadline of the caller.
+    while True:
+        future = loop.run_in_executor(None, throttle.TryAcquireSession)
+
+        try:
+            release_func = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The session may be started after the wait is cancelled, in which case it is ended
+            future.add_done_callback(_ReleaseCancelledSession)
+            raise
+
+        if release_func is not None:
+            return release_func
+
+        await asyncio.sleep(SmtpThrottle.POLL_SECONDS)
+
+
+# ----------------------------------------------------------------------
+def _ReleaseCancelledSession(
+    future: "asyncio.Future[Optional[Callable[[], None]]]",
+) -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+
+    release_func = future.result()
+    if release_func is not None:
+        release_func()
+
+
+# ----------------------------------------------------------------------
+async def _WaitForMessage(
+    throttle: SmtpThrottle,
+) -> None:
+    if throttle.max_messages_per_second is None:
+        return
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+        # The throttle's state is stored in a locked file, so it is updated in a worker thread
+        delay = await loop.run_in_executor(None, throttle.TryAcquireMessage)
+        if not delay:
+            break
+
+        await asyncio.sleep(delay)
+
+
+# ----------------------------------------------------------------------
+def _ReadBatch(
+    chunks: Iterator[bytes],
+) -> List[bytes]:
+    batch: List[bytes] = []
+    batch_size = 0
+
+    for chunk in chunks:
+        batch.append(chunk)
+        batch_size += len(chunk)
+
+        if batch_size >= _content_batch_size:
+            break
+
+    return batch
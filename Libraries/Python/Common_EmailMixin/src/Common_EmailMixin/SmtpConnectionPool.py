@@ -0,0 +1,319 @@
+# ----------------------------------------------------------------------
+# |
+# |  SmtpConnectionPool.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-03 08:12:41
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Contains the SmtpConnectionPool object"""
+
+import atexit
+import smtplib
+import threading
+import time
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Tuple, TypeVar
+
+
+# ----------------------------------------------------------------------
+ReturnT                                     = TypeVar("ReturnT")
+
+# Acquires the resource held by a new connection, returning a function that releases it; returns None
+# if the resource isn't available yet (after waiting briefly), in which case the pool checks for an
+# idle connection before calling the function again.
+AcquireFuncType                             = Callable[[], Optional[Callable[[], None]]]
+
+
+# ----------------------------------------------------------------------
+class SmtpConnectionPool(object):
+    """\
+    Keeps authenticated SMTP connections alive so that they can be reused by
+    subsequent messages sent with the same profile.
+
+    When an `acquire_func` is provided, each new connection holds the resource that it acquires
+    (for example, a session slot of an SmtpThrottle) until the connection is closed, including
+    while it is idle; idle connections that hold a resource are closed once they expire even if
+    the pool isn't used again.
+    """
+
+    # ----------------------------------------------------------------------
+    # |  Public Types
+    DEFAULT_MAX_IDLE_SECONDS                = 60.0
+    DEFAULT_MAX_IDLE_CONNECTIONS_PER_KEY    = 4
+
+    # ----------------------------------------------------------------------
+    # |  Public Methods
+    def __init__(
+        self,
+        max_idle_seconds: float=DEFAULT_MAX_IDLE_SECONDS,
+        max_idle_connections_per_key: int=DEFAULT_MAX_IDLE_CONNECTIONS_PER_KEY,
+    ):
+        self.max_idle_seconds               = max_idle_seconds
+        self.max_idle_connections_per_key   = max_idle_connections_per_key
+
+        self._lock                          = threading.Lock()
+        self._idle_connections: Dict[Hashable, List[_IdleConnection]]     = {}
+
+        # Functions that release the resources held by connections
+        self._release_funcs: Dict[smtplib.SMTP, Callable[[], None]]      = {}
+
+        atexit.register(self.Close)
+
+    # ----------------------------------------------------------------------
+    @contextmanager
+    def Connection(
+        self,
+        key: Hashable,
+        create_func: Callable[[], smtplib.SMTP],
+        acquire_func: Optional[AcquireFuncType]=None,
+    ) -> Iterator[smtplib.SMTP]:
+        """Provides exclusive access to a connection; the connection is returned to the pool when it is still usable"""
+
+        smtp, _ = self._Acquire(key, create_func, acquire_func)
+
+        try:
+            yield smtp
+
+        except smtplib.SMTPServerDisconnected:
+            self._Close(smtp)
+            raise
+
+        except TimeoutError:
+            # The server may still respond to the command that timed out
+            self._Close(smtp, quit=False)
+            raise
+
+        except Exception:
+            self._ReleaseAfterError(key, smtp)
+            raise
+
+        self._Release(key, smtp)
+
+    # ----------------------------------------------------------------------
+    def Execute(
+        self,
+        key: Hashable,
+        create_func: Callable[[], smtplib.SMTP],
+        func: Callable[[smtplib.SMTP], ReturnT],
+        acquire_func: Optional[AcquireFuncType]=None,
+    ) -> ReturnT:
+        """\
+        Invokes `func` with a pooled connection. The operation is attempted again with a
+        new connection if a reused connection was disconnected by the server.
+        """
+
+        smtp, is_reused = self._Acquire(key, create_func, acquire_func)
+
+        while True:
+            try:
+                result = func(smtp)
+
+            except smtplib.SMTPServerDisconnected:
+                if not is_reused:
+                    self._Close(smtp)
+                    raise
+
+                # The new connection holds the resource held by the connection that it replaces
+                with self._lock:
+                    release_func = self._release_funcs.pop(smtp, None)
+
+                _CloseConnection(smtp)
+
+                smtp = self._Create(create_func, release_func)
+                is_reused = False
+
+                continue
+
+            except TimeoutError:
+                # The server may still respond to the command that timed out
+                self._Close(smtp, quit=False)
+                raise
+
+            except Exception:
+                self._ReleaseAfterError(key, smtp)
+                raise
+
+            self._Release(key, smtp)
+            return result
+
+    # ----------------------------------------------------------------------
+    def Close(self) -> None:
+        """Closes all idle connections"""
+
+        with self._lock:
+            idle_connections = self._idle_connections
+            self._idle_connections = {}
+
+        for connections in idle_connections.values():
+            for connection in connections:
+                self._Close(connection.smtp)
+
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    def _Acquire(
+        self,
+        key: Hashable,
+        create_func: Callable[[], smtplib.SMTP],
+        acquire_func: Optional[AcquireFuncType],
+    ) -> Tuple[smtplib.SMTP, bool]:
+        self._EvictExpired()
+
+        while True:
+            while True:
+                with self._lock:
+                    connections = self._idle_connections.get(key)
+                    connection = connections.pop() if connections else None
+
+                if connection is None:
+                    break
+
+                # Ensure that the server hasn't dropped the connection while it was idle
+                try:
+                    if connection.smtp.noop()[0] == 250:
+                        return connection.smtp, True
+                except (smtplib.SMTPException, OSError):
+                    pass
+
+                self._Close(connection.smtp)
+
+            if acquire_func is None:
+                return self._Create(create_func, None), False
+
+            # A connection may be returned to the pool while waiting for the resource, so idle
+            # connections are checked again when the resource isn't available.
+            release_func = acquire_func()
+            if release_func is not None:
+                return self._Create(create_func, release_func), False
+
+    # ----------------------------------------------------------------------
+    def _Create(
+        self,
+        create_func: Callable[[], smtplib.SMTP],
+        release_func: Optional[Callable[[], None]],
+    ) -> smtplib.SMTP:
+        try:
+            smtp = create_func()
+        except:
+            if release_func is not None:
+                release_func()
+
+            raise
+
+        if release_func is not None:
+            with self._lock:
+                self._release_funcs[smtp] = release_func
+
+        return smtp
+
+    # ----------------------------------------------------------------------
+    def _Close(
+        self,
+        smtp: smtplib.SMTP,
+        *,
+        quit: bool=True,  # pylint: disable=redefined-builtin
+    ) -> None:
+        """Closes the connection and releases the resource that it holds"""
+
+        try:
+            if quit:
+                _CloseConnection(smtp)
+            else:
+                smtp.close()
+
+        finally:
+            with self._lock:
+                release_func = self._release_funcs.pop(smtp, None)
+
+            if release_func is not None:
+                release_func()
+
+    # ----------------------------------------------------------------------
+    def _Release(
+        self,
+        key: Hashable,
+        smtp: smtplib.SMTP,
+    ) -> None:
+        to_close: Optional[smtplib.SMTP] = None
+
+        with self._lock:
+            connections = self._idle_connections.setdefault(key, [])
+
+            connections.append(_IdleConnection(smtp, time.monotonic()))
+
+            if len(connections) > self.max_idle_connections_per_key:
+                to_close = connections.pop(0).smtp
+
+            holds_resource = smtp in self._release_funcs
+
+        if to_close is not None:
+            self._Close(to_close)
+
+        if holds_resource:
+            # Other threads and processes may be waiting for the resource, so the connection is
+            # closed when it expires rather than when the pool is used again.
+            timer = threading.Timer(self.max_idle_seconds, self._EvictExpired)
+
+            timer.daemon = True
+            timer.start()
+
+    # ----------------------------------------------------------------------
+    def _ReleaseAfterError(
+        self,
+        key: Hashable,
+        smtp: smtplib.SMTP,
+    ) -> None:
+        # The connection may be in the middle of a transaction
+        try:
+            smtp.rset()
+        except (smtplib.SMTPException, OSError):
+            self._Close(smtp)
+            return
+
+        self._Release(key, smtp)
+
+    # ----------------------------------------------------------------------
+    def _EvictExpired(self) -> None:
+        expired: List[smtplib.SMTP] = []
+        expiration = time.monotonic() - self.max_idle_seconds
+
+        with self._lock:
+            for key, connections in list(self._idle_connections.items()):
+                # Connections are sorted from least- to most-recently used
+                while connections and connections[0].last_used < expiration:
+                    expired.append(connections.pop(0).smtp)
+
+                if not connections:
+                    del self._idle_connections[key]
+
+        for smtp in expired:
+            self._Close(smtp)
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+@dataclass(frozen=True)
+class _IdleConnection(object):
+    smtp: smtplib.SMTP
+    last_used: float
+
+
+# ----------------------------------------------------------------------
+def _CloseConnection(
+    smtp: smtplib.SMTP,
+) -> None:
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
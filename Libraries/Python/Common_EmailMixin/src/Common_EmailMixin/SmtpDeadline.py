@@ -0,0 +1,182 @@
+# ----------------------------------------------------------------------
+# |
+# |  SmtpDeadline.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-18 10:02:47
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Contains the SmtpDeadline and SmtpTimeoutError objects"""
+
+import smtplib
+import socket
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+# ----------------------------------------------------------------------
+class SmtpTimeoutError(TimeoutError):
+    """Raised when the SMTP server doesn't respond within a timeout or a message isn't sent before its deadline"""
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def IsTimeout(
+        ex: Exception,
+    ) -> bool:
+        """Returns True if the exception was caused by a socket timeout"""
+
+        if isinstance(ex, TimeoutError):
+            return True
+
+        # smtplib raises SMTPServerDisconnected when a timeout expires while reading a reply
+        return isinstance(ex, smtplib.SMTPServerDisconnected) and isinstance(ex.__context__, TimeoutError)
+
+
+# ----------------------------------------------------------------------
+class SmtpDeadline(object):
+    """\
+    Limits the total time spent sending a message.
+
+    Timeouts associated with individual operations are reduced to the time remaining before the
+    deadline, and a connection in use when the deadline expires is shut down so that operations
+    blocked on it end immediately.
+    """
+
+    # ----------------------------------------------------------------------
+    # |  Public Methods
+    def __init__(
+        self,
+        seconds: Optional[float],           # None indicates no deadline
+    ):
+        self.seconds                        = seconds
+
+        self._expiration                    = None if seconds is None else time.monotonic() + seconds
+
+    # ----------------------------------------------------------------------
+    def GetRemainingSeconds(self) -> Optional[float]:
+        """Returns the number of seconds remaining before the deadline, or None if there isn't a deadline"""
+
+        if self._expiration is None:
+            return None
+
+        return max(0.0, self._expiration - time.monotonic())
+
+    # ----------------------------------------------------------------------
+    def IsExpired(self) -> bool:
+        return self.GetRemainingSeconds() == 0.0
+
+    # ----------------------------------------------------------------------
+    def GetTimeout(
+        self,
+        timeout: Optional[float],
+    ) -> Optional[float]:
+        """Returns `timeout` limited to the time remaining before the deadline; SmtpTimeoutError is raised if the deadline has expired"""
+
+        remaining = self.GetRemainingSeconds()
+
+        if remaining is None:
+            return timeout
+
+        if remaining == 0.0:
+            raise self._CreateExpiredError()
+
+        return remaining if timeout is None else min(timeout, remaining)
+
+    # ----------------------------------------------------------------------
+    def Sleep(
+        self,
+        seconds: float,
+    ) -> None:
+        """Sleeps for the specified time; SmtpTimeoutError is raised (without sleeping) if the deadline would expire first"""
+
+        remaining = self.GetRemainingSeconds()
+
+        if remaining is not None and remaining <= seconds:
+            raise self._CreateExpiredError()
+
+        time.sleep(seconds)
+
+    # ----------------------------------------------------------------------
+    @contextmanager
+    def Watch(
+        self,
+        smtp: smtplib.SMTP,
+        timeout: Optional[float],
+    ) -> Iterator[None]:
+        """\
+        Limits each operation on the connection (including establishing it, if it hasn't been
+        connected yet) to `timeout` seconds and to the time remaining before the deadline while the
+        context is active; timeouts are raised as SmtpTimeoutError.
+        """
+
+        limited_timeout = self.GetTimeout(timeout)
+
+        # `timeout` is used when the connection is established
+        smtp.timeout = limited_timeout  # type: ignore
+
+        if smtp.sock is not None:
+            smtp.sock.settimeout(limited_timeout)
+
+        remaining = self.GetRemainingSeconds()
+
+        if remaining is None:
+            timer = None
+        else:
+            # The socket is replaced when TLS is started, so it is retrieved when the timer expires
+            timer = threading.Timer(remaining, lambda: _Shutdown(smtp.sock))
+
+            timer.daemon = True
+            timer.start()
+
+        try:
+            yield
+
+        except Exception as ex:
+            if self.IsExpired() and not isinstance(ex, smtplib.SMTPResponseException):
+                raise self._CreateExpiredError() from ex
+
+            if SmtpTimeoutError.IsTimeout(ex) and not isinstance(ex, SmtpTimeoutError):
+                raise SmtpTimeoutError("The SMTP server did not respond within {} seconds.".format(timeout)) from ex
+
+            raise
+
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+            # Remove the deadline's limit for subsequent uses of the connection
+            smtp.timeout = timeout  # type: ignore
+
+            if smtp.sock is not None:
+                smtp.sock.settimeout(timeout)
+
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    def _CreateExpiredError(self) -> SmtpTimeoutError:
+        return SmtpTimeoutError("The message could not be sent within {} seconds.".format(self.seconds))
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+def _Shutdown(
+    sock: Optional[socket.socket],
+) -> None:
+    if sock is None:
+        return
+
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
@@ -15,14 +15,22 @@
 # ----------------------------------------------------------------------
 """Contains the SmtpMailer object"""
 
+import dataclasses
+import hashlib
 import json
 import mimetypes
+import os
 import smtplib
 import ssl
-import textwrap
+import stat
+import threading
+import uuid
 
+from contextlib import contextmanager
 from dataclasses import dataclass, field
+from datetime import datetime
 from email import encoders
+from email.message import Message
 from email.mime.audio import MIMEAudio
 from email.mime.base import MIMEBase
 from email.mime.image import MIMEImage
@@ -30,20 +38,52 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 from pathlib import Path
-from typing import Generator, List, Optional
+from typing import Any, Callable, Dict, Generator, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
 
-from Common_Foundation.ContextlibEx import ExitStack
 from Common_Foundation.Shell.All import CurrentShell
 
+from . import SmtpTransactions
+from .SmtpConnectionPool import AcquireFuncType, SmtpConnectionPool
+from .SmtpDeadline import SmtpDeadline, SmtpTimeoutError
+from .SmtpRetryPolicy import SmtpRetryPolicy
+from .SmtpThrottle import LockFile, SmtpThrottle
+from .SmtpTransactions import SendResult, Transaction
+from .StreamingMessage import StreamingMessage
+
+
+# ----------------------------------------------------------------------
+@dataclass(frozen=True)
+class ProfileInfo(object):
+    """Information about a profile that is available without loading (and decrypting) the profile"""
+
+    name: str
+    settings: Dict[str, Any]                # All settings except for the password
+    last_verified: Optional[str]            # ISO 8601 timestamp of the last successful verification
+
+    # ----------------------------------------------------------------------
+    def ToString(self) -> str:
+        return _ProfileToString(self.settings, show_password=False)
+
 
 # ----------------------------------------------------------------------
 @dataclass(frozen=True)
 class SmtpMailer(object):
-    """Code that manages SMTP profiles and uses them to send messages"""
+    """\
+    Code that manages SMTP profiles and uses them to send messages.
+
+    Profiles are stored in a dedicated directory along with a manifest that contains the settings
+    of each profile (except for the password), so that profiles can be listed and displayed without
+    reading the profiles themselves.
+    """
 
     # ----------------------------------------------------------------------
     # |  Public Types
     PROFILE_EXTENSION                       = ".SmtpMailer"
+    PROFILE_DIRECTORY_NAME                  = "SmtpMailerProfiles"
+    MANIFEST_FILENAME                       = "manifest.json"
+
+    DEFAULT_CONNECT_TIMEOUT_SECONDS         = 30.0
+    DEFAULT_COMMAND_TIMEOUT_SECONDS         = 60.0
 
     # ----------------------------------------------------------------------
     # |  Public Data
@@ -57,6 +97,29 @@ class SmtpMailer(object):
 
     port: Optional[int]                     = field(default=None)
 
+    # Limits shared by all threads and processes on this machine that send messages with the same
+    # connection settings; messages are delayed rather than sent in bursts that the server may
+    # reject.
+    max_messages_per_second: Optional[float]    = field(kw_only=True, default=None)
+    max_concurrent_sessions: Optional[int]      = field(kw_only=True, default=None)
+
+    # Timeouts used when sending messages (None indicates no timeout); the deadline limits the total
+    # time spent sending a message, including retries.
+    connect_timeout_seconds: Optional[float]    = field(kw_only=True, default=DEFAULT_CONNECT_TIMEOUT_SECONDS)
+    command_timeout_seconds: Optional[float]    = field(kw_only=True, default=DEFAULT_COMMAND_TIMEOUT_SECONDS)
+    deadline_seconds: Optional[float]           = field(kw_only=True, default=None)
+
+    # ----------------------------------------------------------------------
+    # |  Public Properties
+    @property
+    def connection_key(self) -> Tuple[str, Optional[int], bool, str]:
+        """Identifies connections that can be shared across messages"""
+        return (self.host, self.port, self.ssl, self.username)
+
+    @property
+    def from_addr(self) -> str:
+        return "{} <{}>".format(self.from_name, self.from_email)
+
     # ----------------------------------------------------------------------
     # |  Public Methods
     def ToString(
@@ -64,25 +127,7 @@ class SmtpMailer(object):
         *,
         show_password: bool=False,
     ) -> str:
-        return textwrap.dedent(
-            """\
-            host        : {host}
-            username    : {username}
-            password    : {password}
-            from_name   : {from_name}
-            from_email  : {from_email}
-            ssl         : {ssl}
-            port        : {port}
-            """,
-        ).format(
-            host=self.host,
-            username=self.username,
-            password=self.password if show_password else "****",
-            from_name=self.from_name,
-            from_email=self.from_email,
-            ssl=self.ssl,
-            port=self.port,
-        )
+        return _ProfileToString(self.__dict__, show_password=show_password)
 
     # ----------------------------------------------------------------------
     def Save(
@@ -91,82 +136,297 @@ class SmtpMailer(object):
     ) -> None:
         """Saves a profile"""
 
-        content = json.dumps(self.__dict__)
+        # Create the directory (and import existing profiles) before the profile is written
+        self.__class__._GetManifest()  # pylint: disable=protected-access
 
-        if CurrentShell.family_name == "Windows":
-            import win32crypt
+        _WriteProfile(
+            self.__class__.GetProfileDirectory() / (profile_name + self.__class__.PROFILE_EXTENSION),
+            self.__dict__,
+        )
 
-            content = win32crypt.CryptProtectData(content.encode("utf-8"), "", None, None, None, 0)
+        # ----------------------------------------------------------------------
+        def Update(
+            profiles: Dict[str, Dict[str, Any]],
+        ) -> None:
+            # The settings may have changed, so the profile is no longer verified
+            profiles[profile_name] = {
+                "settings": {key: value for key, value in self.__dict__.items() if key != "password"},
+                "last_verified": None,
+            }
 
-        with (CurrentShell.user_directory / (profile_name + self.__class__.PROFILE_EXTENSION)).open("wb") as f:
-            f.write(content)
+        # ----------------------------------------------------------------------
+
+        self.__class__._UpdateManifest(Update)  # pylint: disable=protected-access
 
     # ----------------------------------------------------------------------
-    def SendMessage(
+    def CreateConnection(
+        self,
+        *,
+        connect_timeout_seconds: Optional[float]=None,
+        command_timeout_seconds: Optional[float]=None,
+        deadline: Optional[SmtpDeadline]=None,
+    ) -> smtplib.SMTP:
+        """\
+        Creates a new connection to the SMTP server that has been authenticated with the profile's credentials.
+
+        The connect timeout applies to each operation performed while establishing and
+        authenticating the connection, and the command timeout applies to each operation performed
+        after that; the profile's values are used when timeouts aren't provided. SmtpTimeoutError
+        is raised when a timeout or the deadline expires.
+        """
+
+        if connect_timeout_seconds is None:
+            connect_timeout_seconds = self.connect_timeout_seconds
+        if command_timeout_seconds is None:
+            command_timeout_seconds = self.command_timeout_seconds
+
+        # The connection is established explicitly (rather than by the constructor) so that it is
+        # limited by the timeout and deadline.
+        if self.ssl:
+            smtp = smtplib.SMTP_SSL(context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP()
+
+        # Used to verify the server's certificate; this is set by the constructor when it establishes
+        # the connection.
+        smtp._host = self.host  # type: ignore  # pylint: disable=protected-access
+
+        try:
+            with (deadline or SmtpDeadline(None)).Watch(smtp, connect_timeout_seconds):
+                smtp.connect(self.host, self.port or (465 if self.ssl else 26))
+
+                if not self.ssl:
+                    smtp.starttls()
+
+                smtp.login(self.username, self.password)
+
+            assert smtp.sock is not None
+            smtp.sock.settimeout(command_timeout_seconds)
+
+        except:
+            smtp.close()
+            raise
+
+        return smtp
+
+    # ----------------------------------------------------------------------
+    def CreateMessage(
         self,
         recipients: List[str],
         subject: str,
         message: str,
         attachment_filenames: Optional[List[Path]]=None,
         message_format: str="plain", # "html"
-    ) -> None:
-        """Sends an email message using the current profile"""
+    ) -> MIMEMultipart:
+        """Creates an email message sent from the current profile"""
 
-        if self.ssl:
-            port = self.port or 465
-            smtp = smtplib.SMTP_SSL(self.host, port, context=ssl.create_default_context())
+        if not attachment_filenames:
+            msg = MIMEMultipart("alternative")
         else:
-            port = self.port or 26
-            smtp = smtplib.SMTP(self.host, port)
+            msg = MIMEMultipart()
+
+        msg["Subject"] = subject
+        msg["From"] = self.from_addr
+        msg["To"] = ", ".join(recipients)
 
-        smtp.connect(self.host, port)
-        with ExitStack(smtp.close):
-            if not self.ssl:
-                smtp.starttls()
+        msg.attach(MIMEText(message, message_format))
 
-            smtp.login(self.username, self.password)
+        for attachment_filename in (attachment_filenames or []):
+            ctype, encoding = mimetypes.guess_type(attachment_filename)
 
-            from_addr = "{} <{}>".format(self.from_name, self.from_email)
+            if ctype is None or encoding is not None:
+                ctype = "application/octet-stream"
 
-            if not attachment_filenames:
-                msg = MIMEMultipart("alternative")
+            maintype, subtype = ctype.split("/", 1)
+
+            with attachment_filename.open("rb") as f:
+                content = f.read()
+
+            if maintype == "text":
+                attachment = MIMEText(content.decode("utf-8"), _subtype=subtype)
+            elif maintype == "image":
+                attachment = MIMEImage(content, _subtype=subtype)
+            elif maintype == "audio":
+                attachment = MIMEAudio(content, _subtype=subtype)
             else:
-                msg = MIMEMultipart()
+                attachment = MIMEBase(maintype, subtype)
 
-            msg["Subject"] = subject
-            msg["From"] = from_addr
-            msg["To"] = ", ".join(recipients)
+                attachment.set_payload(content)
+                encoders.encode_base64(attachment)
 
-            msg.attach(MIMEText(message, message_format))
+            attachment.add_header("Content-Disposition", "attachment", filename=attachment_filename.name)
 
-            for attachment_filename in (attachment_filenames or []):
-                ctype, encoding = mimetypes.guess_type(attachment_filename)
+            msg.attach(attachment)
 
-                if ctype is None or encoding is not None:
-                    ctype = "application/octet-stream"
+        return msg
 
-                maintype, subtype = ctype.split("/", 1)
+    # ----------------------------------------------------------------------
+    def CreateStreamingMessage(
+        self,
+        recipients: List[str],
+        subject: str,
+        message: Union[str, Path],
+        attachment_filenames: Optional[List[Path]]=None,
+        message_format: str="plain", # "html"
+        compress_attachments_threshold: Optional[int]=None,
+    ) -> StreamingMessage:
+        """Creates an email message sent from the current profile whose attachments (and body, if `message` is a Path) are read as the message is sent"""
+
+        return StreamingMessage(
+            self.from_addr,
+            recipients,
+            subject,
+            message,
+            attachment_filenames or [],
+            message_format,
+            compress_attachments_threshold,
+        )
 
-                with attachment_filename.open("rb") as f:
-                    content = f.read()
+    # ----------------------------------------------------------------------
+    def SendMessage(
+        self,
+        recipients: List[str],
+        subject: str,
+        message: Union[str, Path],
+        attachment_filenames: Optional[List[Path]]=None,
+        message_format: str="plain", # "html"
+        compress_attachments_threshold: Optional[int]=None,
+        retry_policy: Optional[SmtpRetryPolicy]=None,
+        *,
+        connect_timeout_seconds: Optional[float]=None,
+        command_timeout_seconds: Optional[float]=None,
+        deadline_seconds: Optional[float]=None,
+    ) -> None:
+        """\
+        Sends an email message using the current profile.
+
+        Text attachments at least `compress_attachments_threshold` bytes in size are sent as
+        gzip-compressed attachments.
+
+        When `message` is a Path, the message body is read from that utf-8 encoded file as the
+        message is sent rather than being loaded into memory.
+
+        Transient failures are retried according to `retry_policy` (or the default SmtpRetryPolicy);
+        use `SmtpRetryPolicy(max_attempts=1)` to make a single attempt.
+
+        The profile's timeouts are used when timeouts aren't provided. SmtpTimeoutError is raised
+        when a timeout expires (and the failure isn't retried) or the message can't be sent before
+        the deadline; no attempts are started once there isn't enough time remaining before the
+        deadline, in which case the error associated with the last attempt is raised.
+        """
+
+        transaction = Transaction.FromMessage(
+            self.CreateStreamingMessage(
+                recipients,
+                subject,
+                message,
+                attachment_filenames,
+                message_format,
+                compress_attachments_threshold,
+            ),
+        )
+
+        if connect_timeout_seconds is None:
+            connect_timeout_seconds = self.connect_timeout_seconds
+        if command_timeout_seconds is None:
+            command_timeout_seconds = self.command_timeout_seconds
+        if deadline_seconds is None:
+            deadline_seconds = self.deadline_seconds
+
+        deadline = SmtpDeadline(deadline_seconds)
+        throttle = self._GetThrottle()
+
+        # ----------------------------------------------------------------------
+        def CreateConnection() -> smtplib.SMTP:
+            return self.CreateConnection(
+                connect_timeout_seconds=connect_timeout_seconds,
+                command_timeout_seconds=command_timeout_seconds,
+                deadline=deadline,
+            )
+
+        # ----------------------------------------------------------------------
+        def Execute(
+            smtp: smtplib.SMTP,
+            transaction: Transaction,
+        ) -> SendResult:
+            with deadline.Watch(smtp, command_timeout_seconds):
+                return next(SmtpTransactions.Send(smtp, [transaction]))
+
+        # ----------------------------------------------------------------------
+        def Send(
+            transaction: Transaction,
+        ) -> SendResult:
+            throttle.WaitForMessage(deadline)
+
+            return _connection_pool.Execute(
+                self.connection_key,
+                CreateConnection,
+                lambda smtp: Execute(smtp, transaction),
+                _CreateAcquireSessionFunc(throttle, deadline),
+            )
+
+        # ----------------------------------------------------------------------
+
+        result = (retry_policy or SmtpRetryPolicy()).Send(transaction, Send, deadline)
+
+        result.RaiseIfFailed()
+
+    # ----------------------------------------------------------------------
+    def SendMessages(
+        self,
+        messages: Iterable[Union[Message, StreamingMessage]],
+    ) -> List[SendResult]:
+        """\
+        Sends multiple messages over a single session, returning the result of each message.
+
+        Messages are created via `CreateMessage` or `CreateStreamingMessage` (or are otherwise
+        fully built, with 'From' and recipient headers). Failures associated with individual
+        messages are reported in the results rather than raised.
+        """
+
+        return self.SendTransactions(Transaction.FromMessage(message) for message in messages)
+
+    # ----------------------------------------------------------------------
+    def SendTransactions(
+        self,
+        transactions: Iterable[Transaction],
+    ) -> List[SendResult]:
+        """\
+        Sends multiple transactions over a single session, returning the result of each transaction.
+
+        Failures associated with individual transactions are reported in the results rather than
+        raised.
+        """
 
-                if maintype == "text":
-                    attachment = MIMEText(content.decode("utf-8"), _subtype=subtype)
-                elif maintype == "image":
-                    attachment = MIMEImage(content, _subtype=subtype)
-                elif maintype == "audio":
-                    attachment = MIMEAudio(content, _subtype=subtype)
-                else:
-                    attachment = MIMEBase(maintype, subtype)
+        transactions = list(transactions)
+        results: List[SendResult] = []
 
-                    attachment.set_payload(content)
-                    encoders.encode_base64(attachment)
+        throttle = self._GetThrottle()
 
-                attachment.add_header("Content-Disposition", "attachment", filename=attachment_filename.name)
+        # ----------------------------------------------------------------------
+        def EnumTransactions() -> Iterator[Transaction]:
+            for transaction in transactions:
+                throttle.WaitForMessage()
+                yield transaction
 
-                msg.attach(attachment)
+        # ----------------------------------------------------------------------
 
-            smtp.sendmail(from_addr, recipients, msg.as_string())
+        try:
+            with _connection_pool.Connection(
+                self.connection_key,
+                self.CreateConnection,
+                _CreateAcquireSessionFunc(throttle, SmtpDeadline(None)),
+            ) as smtp:
+                with SmtpDeadline(None).Watch(smtp, self.command_timeout_seconds):
+                    results += SmtpTransactions.Send(smtp, EnumTransactions())
+
+        except (smtplib.SMTPServerDisconnected, SmtpTimeoutError) as ex:
+            # Report the failure for the transactions that were not sent
+            response = str(ex).encode("utf-8")
+
+            results += [SendResult([], {}, -1, response) for _ in transactions[len(results):]]
+
+        return results
 
     # ----------------------------------------------------------------------
     @classmethod
@@ -174,27 +434,359 @@ class SmtpMailer(object):
         cls,
         profile_name: str,
     ) -> "SmtpMailer":
-        """Loads a previously saved file"""
+        """Loads a previously saved file; the file is only read again when it has been modified"""
 
-        data_filename = CurrentShell.user_directory / (profile_name + cls.PROFILE_EXTENSION)
+        cls._GetManifest()
 
-        if not data_filename.is_file():
+        data = _profile_cache.GetData(
+            cls.GetProfileDirectory() / (profile_name + cls.PROFILE_EXTENSION),
+            _DecodeProfile,
+        )
+
+        if data is None:
             raise Exception("'{}' is not a recognized profile name.".format(profile_name))
 
-        with data_filename.open("rb") as f:
-            content = f.read()
+        return cls(**data)
 
-        if CurrentShell.family_name == "Windows":
-            import win32crypt
+    # ----------------------------------------------------------------------
+    @classmethod
+    def EnumProfiles(cls) -> Generator[str, None, None]:
+        yield from sorted(cls._GetManifest())
 
-            content = win32crypt.CryptUnprotectData(content, None, None, None, 0)
-            content = content[1].decode("utf-8")
+    # ----------------------------------------------------------------------
+    @classmethod
+    def EnumProfileInfo(cls) -> Generator[ProfileInfo, None, None]:
+        """Enumerates profiles using the manifest, without loading the profiles themselves"""
 
-        return cls(**json.loads(content))
+        for profile_name, info in sorted(cls._GetManifest().items()):
+            yield ProfileInfo(profile_name, info["settings"], info["last_verified"])
 
     # ----------------------------------------------------------------------
     @classmethod
-    def EnumProfiles(cls) -> Generator[str, None, None]:
-        for item in CurrentShell.user_directory.iterdir():
-            if item.suffix == cls.PROFILE_EXTENSION:
-                yield item.stem
+    def GetProfileInfo(
+        cls,
+        profile_name: str,
+    ) -> ProfileInfo:
+        """Returns information about a profile using the manifest, without loading the profile itself"""
+
+        info = cls._GetManifest().get(profile_name)
+        if info is None:
+            raise Exception("'{}' is not a recognized profile name.".format(profile_name))
+
+        return ProfileInfo(profile_name, info["settings"], info["last_verified"])
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    def SetVerified(
+        cls,
+        profile_name: str,
+    ) -> None:
+        """Records that a message was successfully sent with the profile"""
+
+        # ----------------------------------------------------------------------
+        def Update(
+            profiles: Dict[str, Dict[str, Any]],
+        ) -> None:
+            if profile_name not in profiles:
+                raise Exception("'{}' is not a recognized profile name.".format(profile_name))
+
+            profiles[profile_name]["last_verified"] = datetime.now().isoformat()
+
+        # ----------------------------------------------------------------------
+
+        cls._UpdateManifest(Update)
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    def GetProfileDirectory(cls) -> Path:
+        return CurrentShell.user_directory / cls.PROFILE_DIRECTORY_NAME
+
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    def _GetThrottle(self) -> SmtpThrottle:
+        if self.max_messages_per_second is None and self.max_concurrent_sessions is None:
+            return _unlimited_throttle
+
+        key = (self.connection_key, self.max_messages_per_second, self.max_concurrent_sessions)
+
+        with _throttles_lock:
+            throttle = _throttles.get(key)
+
+            if throttle is None:
+                throttle = SmtpThrottle(
+                    self.__class__.GetProfileDirectory() / "Throttle" / hashlib.sha1(
+                        json.dumps(self.connection_key).encode("utf-8"),
+                    ).hexdigest(),
+                    self.max_messages_per_second,
+                    self.max_concurrent_sessions,
+                )
+
+                _throttles[key] = throttle
+
+        return throttle
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    def _GetManifest(cls) -> Dict[str, Dict[str, Any]]:
+        """Returns the manifest, creating it if it doesn't exist"""
+
+        manifest_filename = cls.GetProfileDirectory() / cls.MANIFEST_FILENAME
+
+        manifest = _profile_cache.GetData(manifest_filename, _DecodeManifest)
+        if manifest is not None:
+            return manifest["profiles"]
+
+        manifest_filename.parent.mkdir(parents=True, exist_ok=True)
+
+        with _LockManifest(manifest_filename):
+            manifest = _profile_cache.GetData(manifest_filename, _DecodeManifest)
+            if manifest is not None:
+                return manifest["profiles"]
+
+            # Import the profiles saved in the user directory (where profiles were saved before
+            # they had a dedicated directory)
+            profiles: Dict[str, Dict[str, Any]] = {}
+
+            for item in CurrentShell.user_directory.iterdir():
+                if item.suffix != cls.PROFILE_EXTENSION or not item.is_file():
+                    continue
+
+                with item.open("rb") as f:
+                    data = _DecodeProfile(f.read())
+
+                _WriteProfile(manifest_filename.parent / item.name, data)
+
+                profiles[item.stem] = {
+                    "settings": {key: value for key, value in data.items() if key != "password"},
+                    "last_verified": None,
+                }
+
+            _WriteManifest(manifest_filename, profiles)
+
+            return profiles
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    def _UpdateManifest(
+        cls,
+        update_func: Callable[[Dict[str, Dict[str, Any]]], None],
+    ) -> None:
+        cls._GetManifest()
+
+        manifest_filename = cls.GetProfileDirectory() / cls.MANIFEST_FILENAME
+
+        with _LockManifest(manifest_filename):
+            # Read the file again, as cached data may not reflect a change made within the
+            # resolution of the file's modification time
+            with manifest_filename.open("rb") as f:
+                profiles = _DecodeManifest(f.read())["profiles"]
+
+            update_func(profiles)
+
+            _WriteManifest(manifest_filename, profiles)
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+_connection_pool                            = SmtpConnectionPool()
+
+
+# ----------------------------------------------------------------------
+class _ProfileCache(object):
+    """\
+    Data decoded from profile files (and the manifest) that is shared by all threads within the
+    process. The data is decoded again when its file is modified, so that repeated loads don't
+    read, decode, and decrypt the files again.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        self._lock                          = threading.Lock()
+
+        # filename -> ((modification time, size), data)
+        self._data: Dict[Path, Tuple[Tuple[int, int], Dict[str, Any]]]    = {}
+
+    # ----------------------------------------------------------------------
+    def GetData(
+        self,
+        filename: Path,
+        decode_func: Callable[[bytes], Dict[str, Any]],
+    ) -> Optional[Dict[str, Any]]:
+        """Returns the data decoded from the file, or None if the file doesn't exist"""
+
+        try:
+            file_stat = filename.stat()
+        except FileNotFoundError:
+            return None
+
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+
+        key = (file_stat.st_mtime_ns, file_stat.st_size)
+
+        with self._lock:
+            cached = self._data.get(filename)
+
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        with filename.open("rb") as f:
+            data = decode_func(f.read())
+
+        with self._lock:
+            self._data[filename] = (key, data)
+
+        return data
+
+    # ----------------------------------------------------------------------
+    def Invalidate(
+        self,
+        filename: Path,
+    ) -> None:
+        with self._lock:
+            self._data.pop(filename, None)
+
+
+# ----------------------------------------------------------------------
+_profile_cache                              = _ProfileCache()
+
+# Serializes updates to the manifest within the process (see `_LockManifest`)
+_manifest_lock                              = threading.RLock()
+
+_unlimited_throttle                         = SmtpThrottle(None, None, None)
+
+_throttles_lock                             = threading.Lock()
+_throttles: Dict[Tuple[Hashable, Optional[float], Optional[int]], SmtpThrottle]    = {}
+
+
+# ----------------------------------------------------------------------
+def _CreateAcquireSessionFunc(
+    throttle: SmtpThrottle,
+    deadline: SmtpDeadline,
+) -> Optional[AcquireFuncType]:
+    """Returns the function used by the connection pool to acquire a session for each new connection, so that idle connections count against the session limit"""
+
+    if throttle.max_concurrent_sessions is None:
+        return None
+
+    # ----------------------------------------------------------------------
+    def AcquireSession() -> Optional[Callable[[], None]]:
+        release_func = throttle.TryAcquireSession()
+
+        if release_func is None:
+            deadline.Sleep(SmtpThrottle.POLL_SECONDS)
+
+        return release_func
+
+    # ----------------------------------------------------------------------
+
+    return AcquireSession
+
+
+# ----------------------------------------------------------------------
+def _ProfileToString(
+    settings: Dict[str, Any],
+    *,
+    show_password: bool,
+) -> str:
+    lines: List[str] = []
+
+    field_infos = dataclasses.fields(SmtpMailer)
+    name_width = max(len(field_info.name) for field_info in field_infos)
+
+    for field_info in field_infos:
+        if field_info.name == "password" and not show_password:
+            value = "****"
+        else:
+            # Settings saved by earlier versions may not include newer fields
+            value = settings.get(field_info.name, field_info.default)
+
+        lines.append("{:<{}}: {}\n".format(field_info.name, name_width, value))
+
+    return "".join(lines)
+
+
+# ----------------------------------------------------------------------
+def _DecodeProfile(
+    content: bytes,
+) -> Dict[str, Any]:
+    if CurrentShell.family_name == "Windows":
+        import win32crypt
+
+        content = win32crypt.CryptUnprotectData(content, None, None, None, 0)[1]
+
+    return json.loads(content.decode("utf-8"))
+
+
+# ----------------------------------------------------------------------
+def _DecodeManifest(
+    content: bytes,
+) -> Dict[str, Any]:
+    return json.loads(content.decode("utf-8"))
+
+
+# ----------------------------------------------------------------------
+def _WriteProfile(
+    filename: Path,
+    data: Dict[str, Any],
+) -> None:
+    content = json.dumps(data).encode("utf-8")
+
+    if CurrentShell.family_name == "Windows":
+        import win32crypt
+
+        content = win32crypt.CryptProtectData(content, "", None, None, None, 0)
+
+    _WriteAtomically(filename, content)
+
+
+# ----------------------------------------------------------------------
+@contextmanager
+def _LockManifest(
+    manifest_filename: Path,
+) -> Iterator[None]:
+    """Prevents other threads and processes from updating the manifest while the context is active"""
+
+    # The file lock isn't reentrant, so the thread lock must be acquired first
+    with _manifest_lock:
+        with LockFile(manifest_filename.parent / "{}.lock".format(manifest_filename.name)):
+            yield
+
+
+# ----------------------------------------------------------------------
+def _WriteManifest(
+    filename: Path,
+    profiles: Dict[str, Dict[str, Any]],
+) -> None:
+    _WriteAtomically(
+        filename,
+        json.dumps({"profiles": profiles}, indent=2, sort_keys=True).encode("utf-8"),
+    )
+
+
+# ----------------------------------------------------------------------
+def _WriteAtomically(
+    filename: Path,
+    content: bytes,
+) -> None:
+    """Writes the content to a temporary file that replaces `filename` once it is complete"""
+
+    temp_filename = filename.parent / "{}.{}.tmp".format(filename.name, uuid.uuid4().hex)
+
+    try:
+        with temp_filename.open("wb") as f:
+            f.write(content)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_filename, filename)
+
+    except:
+        temp_filename.unlink(missing_ok=True)
+        raise
+
+    # The file may have been modified within the resolution of its modification time
+    _profile_cache.Invalidate(filename)
@@ -0,0 +1,514 @@
+# ----------------------------------------------------------------------
+# |
+# |  SmtpOutbox.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-12 08:41:17
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Contains the SmtpOutbox object"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from email.message import Message
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from Common_Foundation.Shell.All import CurrentShell
+
+from .SmtpMailer import SmtpMailer
+from .SmtpRetryPolicy import SmtpRetryPolicy
+from .SmtpTransactions import SendResult, Transaction
+from .StreamingMessage import StreamingMessage
+
+
+# ----------------------------------------------------------------------
+@dataclass(frozen=True)
+class FlushResult(object):
+    """The result of delivering the messages in an outbox"""
+
+    sent: List[str]                         = field(default_factory=list)   # message ids
+    deferred: Dict[str, str]                = field(default_factory=dict)   # message id -> error; the message will be retried
+    failed: Dict[str, str]                  = field(default_factory=dict)   # message id -> error; the message has been moved to the 'failed' directory
+
+
+# ----------------------------------------------------------------------
+class SmtpOutbox(object):
+    """\
+    Directory of messages that are waiting to be sent, so that messages can be delivered in the
+    background (or once the SMTP server is available) rather than when they are created.
+
+    Messages are written to the 'tmp' directory and moved into the 'queue' directory once they
+    are complete, so a message is never delivered before it has been fully written. A message
+    is moved to the 'sending' directory while it is being delivered, which ensures that it is
+    only delivered once when the outbox is flushed by multiple processes. Messages that could not
+    be sent because of transient failures (as classified by SmtpRetryPolicy) are retried with
+    exponential backoff until `max_attempts` is reached, at which point they are moved to the
+    'failed' directory; messages that fail permanently are moved to the 'failed' directory
+    immediately.
+
+    When a message is sent to some of its recipients, it is retried for the recipients that
+    refused it with transient replies, and a copy of the message is recorded in the 'failed'
+    directory for the recipients that refused it permanently.
+    """
+
+    # ----------------------------------------------------------------------
+    # |  Public Types
+    DEFAULT_MAX_ATTEMPTS                    = 8
+    DEFAULT_RETRY_DELAY_SECONDS             = 30.0
+    DEFAULT_MAX_RETRY_DELAY_SECONDS         = 60.0 * 60
+    DEFAULT_MAX_CONCURRENT_SESSIONS         = 4
+
+    # Messages in the 'sending' directory that are older than this were being delivered by a
+    # process that has exited and are added back to the queue
+    DEFAULT_STALE_SENDING_SECONDS           = 60.0 * 60
+
+    # ----------------------------------------------------------------------
+    # |  Public Methods
+    @classmethod
+    def GetDefaultDirectory(cls) -> Path:
+        return CurrentShell.user_directory / "SmtpMailerOutbox"
+
+    # ----------------------------------------------------------------------
+    def __init__(
+        self,
+        directory: Optional[Path]=None,
+        *,
+        max_attempts: int=DEFAULT_MAX_ATTEMPTS,
+        retry_delay_seconds: float=DEFAULT_RETRY_DELAY_SECONDS,
+        max_retry_delay_seconds: float=DEFAULT_MAX_RETRY_DELAY_SECONDS,
+    ):
+        self.directory                      = directory or self.__class__.GetDefaultDirectory()
+        self.max_attempts                   = max_attempts
+        self.retry_delay_seconds            = retry_delay_seconds
+        self.max_retry_delay_seconds        = max_retry_delay_seconds
+
+        self._tmp_directory                 = self.directory / "tmp"
+        self._queue_directory               = self.directory / "queue"
+        self._sending_directory             = self.directory / "sending"
+        self._failed_directory              = self.directory / "failed"
+
+        for directory in [
+            self._tmp_directory,
+            self._queue_directory,
+            self._sending_directory,
+            self._failed_directory,
+        ]:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    # ----------------------------------------------------------------------
+    def Enqueue(
+        self,
+        profile_name: str,
+        message: Union[Message, StreamingMessage],
+    ) -> str:
+        """Adds a message to the outbox, returning its id; the message will be sent with the SmtpMailer profile"""
+
+        transaction = Transaction.FromMessage(message)
+
+        message_id = "{}-{}".format(time.strftime("%Y%m%d%H%M%S"), uuid.uuid4().hex)
+
+        content = transaction.content
+        if isinstance(content, bytes):
+            content = [content]
+
+        # The content is written before the envelope, as the envelope identifies complete messages
+        self._WriteAtomically(self._queue_directory / (message_id + _CONTENT_EXTENSION), content)
+
+        self._WriteEnvelope(
+            self._queue_directory,
+            message_id,
+            {
+                "profile_name": profile_name,
+                "sender": transaction.sender,
+                "recipients": transaction.recipients,
+                "attempts": 0,
+                "next_attempt": 0.0,
+                "last_error": None,
+            },
+        )
+
+        return message_id
+
+    # ----------------------------------------------------------------------
+    def EnumMessages(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yields the id and envelope of each message that is waiting to be sent"""
+
+        for filename in sorted(self._queue_directory.glob("*" + _ENVELOPE_EXTENSION)):
+            try:
+                with filename.open("r", encoding="utf-8") as f:
+                    envelope = json.load(f)
+            except FileNotFoundError:
+                # The message was claimed by another process
+                continue
+
+            yield filename.stem, envelope
+
+    # ----------------------------------------------------------------------
+    def Flush(
+        self,
+        *,
+        include_deferred: bool=False,
+        max_concurrent_sessions: int=DEFAULT_MAX_CONCURRENT_SESSIONS,
+        stale_sending_seconds: float=DEFAULT_STALE_SENDING_SECONDS,
+    ) -> FlushResult:
+        """\
+        Sends the messages that are due, returning the outcome for each message.
+
+        Messages associated with the same profile are sent over as many as
+        `max_concurrent_sessions` sessions, each of which sends multiple messages. Messages that
+        are waiting to be retried are only sent when `include_deferred` is True.
+        """
+
+        self._RestoreStaleMessages(stale_sending_seconds)
+
+        result = FlushResult()
+        now = time.time()
+
+        # Claim the messages that are due
+        messages_by_profile: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+
+        for message_id, envelope in self.EnumMessages():
+            if not include_deferred and envelope["next_attempt"] > now:
+                continue
+
+            if not self._Claim(message_id):
+                continue
+
+            messages_by_profile.setdefault(envelope["profile_name"], []).append((message_id, envelope))
+
+        for profile_name, messages in messages_by_profile.items():
+            try:
+                mailer = SmtpMailer.Load(profile_name)
+            except Exception as ex:  # pylint: disable=broad-except
+                for message_id, envelope in messages:
+                    self._OnFailure(message_id, envelope, ex, result)
+
+                continue
+
+            # Distribute the messages across the sessions
+            num_sessions = min(max_concurrent_sessions, len(messages))
+            batches = [messages[index::num_sessions] for index in range(num_sessions)]
+
+            with ThreadPoolExecutor(num_sessions) as executor:
+                all_batch_results = list(
+                    executor.map(lambda batch: self._SendBatch(mailer, batch), batches),  # pylint: disable=cell-var-from-loop
+                )
+
+            for batch, batch_results in zip(batches, all_batch_results):
+                for (message_id, envelope), batch_result in zip(batch, batch_results):
+                    if isinstance(batch_result, SendResult) and batch_result.succeeded:
+                        self._OnSuccess(message_id, envelope, batch_result, result)
+                    else:
+                        self._OnFailure(message_id, envelope, batch_result, result)
+
+        return result
+
+    # ----------------------------------------------------------------------
+    def FlushUntilEmpty(
+        self,
+        max_concurrent_sessions: int=DEFAULT_MAX_CONCURRENT_SESSIONS,
+    ) -> None:
+        """Flushes the outbox until there are no messages waiting to be sent, waiting for deferred messages as necessary"""
+
+        while True:
+            self.Flush(max_concurrent_sessions=max_concurrent_sessions)
+
+            next_attempts = [envelope["next_attempt"] for _, envelope in self.EnumMessages()]
+            if not next_attempts:
+                break
+
+            time.sleep(max(0.0, min(next_attempts) - time.time()))
+
+    # ----------------------------------------------------------------------
+    def StartBackgroundFlush(self) -> None:
+        """Starts a process that flushes the outbox until it is empty; the process continues to run after this process exits"""
+
+        kwargs: Dict[str, Any] = {}
+
+        if CurrentShell.family_name == "Windows":
+            kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP  # type: ignore
+        else:
+            kwargs["start_new_session"] = True
+
+        subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-m", __name__, str(self.directory)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            **kwargs,
+        )
+
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    def _Claim(
+        self,
+        message_id: str,
+    ) -> bool:
+        try:
+            os.replace(
+                self._queue_directory / (message_id + _ENVELOPE_EXTENSION),
+                self._sending_directory / (message_id + _ENVELOPE_EXTENSION),
+            )
+        except FileNotFoundError:
+            # The message was claimed by another process
+            return False
+
+        # Update the modification time so that the message isn't considered stale
+        (self._sending_directory / (message_id + _ENVELOPE_EXTENSION)).touch()
+
+        return True
+
+    # ----------------------------------------------------------------------
+    def _SendBatch(
+        self,
+        mailer: SmtpMailer,
+        messages: List[Tuple[str, Dict[str, Any]]],
+    ) -> List[Union[SendResult, Exception]]:
+        try:
+            return list(
+                mailer.SendTransactions(
+                    Transaction(
+                        envelope["sender"],
+                        envelope["recipients"],
+                        _FileContent(self._queue_directory / (message_id + _CONTENT_EXTENSION)),
+                    )
+                    for message_id, envelope in messages
+                ),
+            )
+
+        except Exception as ex:  # pylint: disable=broad-except
+            return [ex] * len(messages)
+
+    # ----------------------------------------------------------------------
+    def _OnSuccess(
+        self,
+        message_id: str,
+        envelope: Dict[str, Any],
+        send_result: SendResult,
+        result: FlushResult,
+    ) -> None:
+        """Handles a message that was sent to at least one of its recipients"""
+
+        if not send_result.refused:
+            self._Remove(self._sending_directory, message_id)
+            result.sent.append(message_id)
+
+            return
+
+        retry_refused: Dict[str, Tuple[int, bytes]] = {}
+        failed_refused: Dict[str, Tuple[int, bytes]] = {}
+
+        for recipient, reply in send_result.refused.items():
+            if SmtpRetryPolicy.IsTransientCode(reply[0]):
+                retry_refused[recipient] = reply
+            else:
+                failed_refused[recipient] = reply
+
+        if failed_refused:
+            failed_result = SendResult([], failed_refused, send_result.code, send_result.response)
+            failed_envelope = dict(envelope, recipients=list(failed_refused))
+
+            if not retry_refused:
+                self._OnFailure(message_id, failed_envelope, failed_result, result)
+                return
+
+            # The message is still queued for the other recipients, so a copy of it is recorded
+            failed_id = "{}-{}".format(message_id, envelope["attempts"] + 1)
+            error = _GetError(failed_result)
+
+            failed_envelope["attempts"] += 1
+            failed_envelope["last_error"] = error
+
+            self._WriteAtomically(
+                self._failed_directory / (failed_id + _CONTENT_EXTENSION),
+                _FileContent(self._queue_directory / (message_id + _CONTENT_EXTENSION)),
+            )
+
+            self._WriteEnvelope(self._failed_directory, failed_id, failed_envelope)
+
+            result.failed[failed_id] = error
+
+        # The message is retried for the recipients that refused it with transient replies
+        self._OnFailure(
+            message_id,
+            dict(envelope, recipients=list(retry_refused)),
+            SendResult([], retry_refused, send_result.code, send_result.response),
+            result,
+        )
+
+    # ----------------------------------------------------------------------
+    def _OnFailure(
+        self,
+        message_id: str,
+        envelope: Dict[str, Any],
+        send_result: Union[SendResult, Exception],
+        result: FlushResult,
+    ) -> None:
+        error = _GetError(send_result)
+
+        envelope["attempts"] += 1
+        envelope["last_error"] = error
+
+        if not _IsTransient(send_result) or envelope["attempts"] >= self.max_attempts:
+            self._WriteEnvelope(self._failed_directory, message_id, envelope)
+
+            os.replace(
+                self._queue_directory / (message_id + _CONTENT_EXTENSION),
+                self._failed_directory / (message_id + _CONTENT_EXTENSION),
+            )
+
+            (self._sending_directory / (message_id + _ENVELOPE_EXTENSION)).unlink()
+
+            result.failed[message_id] = error
+            return
+
+        envelope["next_attempt"] = time.time() + min(
+            self.retry_delay_seconds * 2 ** (envelope["attempts"] - 1),
+            self.max_retry_delay_seconds,
+        )
+
+        # Writing the envelope to the queue makes the message available again
+        self._WriteEnvelope(self._queue_directory, message_id, envelope)
+        (self._sending_directory / (message_id + _ENVELOPE_EXTENSION)).unlink()
+
+        result.deferred[message_id] = error
+
+    # ----------------------------------------------------------------------
+    def _Remove(
+        self,
+        envelope_directory: Path,
+        message_id: str,
+    ) -> None:
+        (envelope_directory / (message_id + _ENVELOPE_EXTENSION)).unlink()
+        (self._queue_directory / (message_id + _CONTENT_EXTENSION)).unlink()
+
+    # ----------------------------------------------------------------------
+    def _RestoreStaleMessages(
+        self,
+        stale_sending_seconds: float,
+    ) -> None:
+        expiration = time.time() - stale_sending_seconds
+
+        for filename in self._sending_directory.glob("*" + _ENVELOPE_EXTENSION):
+            try:
+                if filename.stat().st_mtime < expiration:
+                    os.replace(filename, self._queue_directory / filename.name)
+            except FileNotFoundError:
+                pass
+
+    # ----------------------------------------------------------------------
+    def _WriteEnvelope(
+        self,
+        directory: Path,
+        message_id: str,
+        envelope: Dict[str, Any],
+    ) -> None:
+        self._WriteAtomically(
+            directory / (message_id + _ENVELOPE_EXTENSION),
+            [json.dumps(envelope).encode("utf-8")],
+        )
+
+    # ----------------------------------------------------------------------
+    def _WriteAtomically(
+        self,
+        filename: Path,
+        content: Iterable[bytes],
+    ) -> None:
+        """Writes the content to a temporary file that replaces `filename` once it is complete"""
+
+        temp_filename = self._tmp_directory / "{}-{}".format(filename.name, uuid.uuid4().hex)
+
+        try:
+            with temp_filename.open("wb") as f:
+                for chunk in content:
+                    f.write(chunk)
+
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(temp_filename, filename)
+
+        except:
+            temp_filename.unlink(missing_ok=True)
+            raise
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+_CONTENT_EXTENSION                          = ".eml"
+_ENVELOPE_EXTENSION                         = ".json"
+
+
+# ----------------------------------------------------------------------
+@dataclass(frozen=True)
+class _FileContent(object):
+    """Message content that is read from a file each time that it is iterated"""
+
+    filename: Path
+
+    # ----------------------------------------------------------------------
+    def __iter__(self) -> Iterator[bytes]:
+        with self.filename.open("rb") as f:
+            while True:
+                chunk = f.read(StreamingMessage.CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                yield chunk
+
+
+# ----------------------------------------------------------------------
+def _GetError(
+    result: Union[SendResult, Exception],
+) -> str:
+    if isinstance(result, Exception):
+        return str(result) or type(result).__name__
+
+    if not result.accepted and result.refused:
+        return "; ".join(
+            "{}: {} {}".format(recipient, code, response.decode("utf-8", "replace"))
+            for recipient, (code, response) in result.refused.items()
+        )
+
+    return "{} {}".format(result.code, result.response.decode("utf-8", "replace"))
+
+
+# ----------------------------------------------------------------------
+def _IsTransient(
+    result: Union[SendResult, Exception],
+) -> bool:
+    if isinstance(result, Exception):
+        return SmtpRetryPolicy.IsTransientError(result)
+
+    # SendTransactions reports the messages that weren't sent when the session ended with -1
+    if result.code == -1:
+        return True
+
+    if not result.accepted and result.refused:
+        return any(SmtpRetryPolicy.IsTransientCode(code) for code, _ in result.refused.values())
+
+    return SmtpRetryPolicy.IsTransientCode(result.code)
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+if __name__ == "__main__":
+    SmtpOutbox(Path(sys.argv[1])).FlushUntilEmpty()
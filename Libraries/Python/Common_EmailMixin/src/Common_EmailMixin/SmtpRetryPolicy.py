@@ -0,0 +1,233 @@
+# ----------------------------------------------------------------------
+# |
+# |  SmtpRetryPolicy.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-17 08:41:26
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Contains the SmtpRetryPolicy object"""
+
+import dataclasses
+import random
+import smtplib
+import ssl
+import time
+
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .SmtpDeadline import SmtpDeadline
+from .SmtpTransactions import SendResult, Transaction
+
+
+# ----------------------------------------------------------------------
+@dataclass(frozen=True)
+class SmtpRetryPolicy(object):
+    """\
+    Sends a transaction again when it fails for reasons that are likely to be temporary.
+
+    SMTP replies in the 4xx range (RFC 5321, section 4.2.1) and network errors (disconnections,
+    timeouts, refused connections) are considered transient; all other failures are permanent.
+    When some of the recipients of a message are refused with transient replies, only those
+    recipients are included in the next attempt. Attempts are separated by an exponentially
+    increasing delay that is randomized so that clients that failed at the same time don't
+    retry at the same time.
+    """
+
+    # ----------------------------------------------------------------------
+    # |  Public Types
+    DEFAULT_MAX_ATTEMPTS                    = 4
+    DEFAULT_INITIAL_DELAY_SECONDS           = 1.0
+    DEFAULT_MAX_DELAY_SECONDS               = 30.0
+
+    # ----------------------------------------------------------------------
+    # |  Public Data
+    max_attempts: int                       = DEFAULT_MAX_ATTEMPTS
+    initial_delay_seconds: float            = DEFAULT_INITIAL_DELAY_SECONDS
+    max_delay_seconds: float                = DEFAULT_MAX_DELAY_SECONDS
+
+    # ----------------------------------------------------------------------
+    # |  Public Methods
+    def __post_init__(self):
+        if self.max_attempts < 1:
+            raise Exception("'max_attempts' must be greater than 0.")
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def IsTransientCode(
+        code: int,
+    ) -> bool:
+        return 400 <= code < 500
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    def IsTransientError(
+        cls,
+        ex: Exception,
+    ) -> bool:
+        if isinstance(ex, smtplib.SMTPServerDisconnected):
+            return True
+
+        if isinstance(ex, smtplib.SMTPResponseException):
+            return cls.IsTransientCode(ex.smtp_code)
+
+        if isinstance(ex, smtplib.SMTPRecipientsRefused):
+            return any(cls.IsTransientCode(code) for code, _ in ex.recipients.values())
+
+        if isinstance(ex, ssl.SSLCertVerificationError):
+            return False
+
+        # Timeouts, refused connections, name resolution failures, etc.
+        return isinstance(ex, OSError)
+
+    # ----------------------------------------------------------------------
+    def GetDelay(
+        self,
+        attempt: int,
+    ) -> float:
+        """Returns the number of seconds to wait after the attempt (where the first attempt is 1) fails"""
+
+        delay = min(self.max_delay_seconds, self.initial_delay_seconds * 2 ** (attempt - 1))
+
+        return random.uniform(delay / 2, delay)
+
+    # ----------------------------------------------------------------------
+    def Send(
+        self,
+        transaction: Transaction,
+        send_func: Callable[[Transaction], SendResult],
+        deadline: Optional[SmtpDeadline]=None,
+    ) -> SendResult:
+        """\
+        Invokes `send_func` until the transaction has been sent to all of its recipients, it fails
+        permanently, the maximum number of attempts have been made, or there isn't enough time
+        remaining before the deadline for another attempt.
+
+        The result contains the recipients that accepted the message during any attempt and the
+        recipients that were refused in the final attempt (or permanently refused in an earlier one);
+        when the final attempt fails without replies for individual recipients, its reply is used
+        for each of them.
+        Exceptions raised during the final attempt (or that are permanent) are propagated if the
+        message wasn't accepted by any recipients; otherwise, the recipients of that attempt are
+        reported as refused with the exception's reply (or -1 and the exception's description).
+        """
+
+        accepted: List[str] = []
+        refused: Dict[str, Tuple[int, bytes]] = {}
+        success_reply: Optional[Tuple[int, bytes]] = None
+
+        attempt = 0
+
+        # ----------------------------------------------------------------------
+        def GetRetryDelay() -> Optional[float]:
+            if attempt == self.max_attempts:
+                return None
+
+            delay = self.GetDelay(attempt)
+
+            if deadline is not None:
+                remaining = deadline.GetRemainingSeconds()
+
+                if remaining is not None and remaining <= delay:
+                    return None
+
+            return delay
+
+        # ----------------------------------------------------------------------
+
+        while True:
+            attempt += 1
+
+            try:
+                result = send_func(transaction)
+
+            except Exception as ex:
+                delay = GetRetryDelay() if self.__class__.IsTransientError(ex) else None
+
+                if delay is None:
+                    if not accepted:
+                        raise
+
+                    # The message was sent to some of the recipients, so report the failure for the
+                    # recipients that were being retried rather than raising the exception.
+                    reply: Tuple[int, bytes]
+
+                    if isinstance(ex, smtplib.SMTPResponseException):
+                        response = ex.smtp_error
+
+                        if isinstance(response, str):
+                            response = response.encode("utf-8")
+
+                        reply = (ex.smtp_code, response)
+                    else:
+                        reply = (-1, (str(ex) or type(ex).__name__).encode("utf-8"))
+
+                    refused.update((recipient, reply) for recipient in transaction.recipients)
+
+                    break
+
+                time.sleep(delay)
+                continue
+
+            if result.succeeded:
+                accepted += result.accepted
+                success_reply = (result.code, result.response)
+
+                retry_recipients = [
+                    recipient
+                    for recipient, (code, _) in result.refused.items()
+                    if self.__class__.IsTransientCode(code)
+                ]
+
+            elif self.__class__.IsTransientCode(result.code):
+                # Retry all of the recipients when the failure wasn't associated with specific
+                # recipients (for example, a reply to MAIL or to the end of the data).
+                retry_recipients = [
+                    recipient
+                    for recipient in transaction.recipients
+                    if recipient not in result.refused or self.__class__.IsTransientCode(result.refused[recipient][0])
+                ]
+
+            else:
+                retry_recipients = []
+
+            delay = GetRetryDelay() if retry_recipients else None
+
+            if delay is None:
+                refused.update(result.refused)
+
+                if success_reply is None:
+                    return SendResult(accepted, refused, result.code, result.response)
+
+                # The message was sent to some of the recipients in an earlier attempt, so report
+                # the failure for the recipients that weren't refused individually (for example,
+                # when the reply to MAIL or to the end of the data was an error).
+                refused.update(
+                    (recipient, (result.code, result.response))
+                    for recipient in transaction.recipients
+                    if recipient not in result.refused and recipient not in result.accepted
+                )
+
+                break
+
+            # Recipients that were permanently refused are not included in the next attempt
+            refused.update(
+                (recipient, reply)
+                for recipient, reply in result.refused.items()
+                if recipient not in retry_recipients
+            )
+
+            transaction = dataclasses.replace(transaction, recipients=retry_recipients)
+
+            time.sleep(delay)
+
+        assert success_reply is not None
+        return SendResult(accepted, refused, *success_reply)
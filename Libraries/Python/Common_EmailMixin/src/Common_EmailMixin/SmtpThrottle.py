@@ -0,0 +1,244 @@
+# ----------------------------------------------------------------------
+# |
+# |  SmtpThrottle.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-14 09:18:52
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Contains the SmtpThrottle object"""
+
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional
+
+from Common_Foundation.Shell.All import CurrentShell
+
+from .SmtpDeadline import SmtpDeadline
+
+
+# ----------------------------------------------------------------------
+class SmtpThrottle(object):
+    """\
+    Limits the rate at which messages are sent and the number of concurrent sessions.
+
+    State is maintained in lock files within `directory`, so the limits are shared by all threads
+    and processes on the machine that use the same directory. Messages are limited with a token
+    bucket that holds up to one second of messages (or a single message, when the rate is less
+    than one message per second). Sessions are limited by exclusively locking one of
+    `max_concurrent_sessions` files; the operating system releases the lock if the process
+    exits while a session is active.
+    """
+
+    # ----------------------------------------------------------------------
+    # |  Public Types
+    POLL_SECONDS                            = 0.05
+
+    # ----------------------------------------------------------------------
+    # |  Public Methods
+    def __init__(
+        self,
+        directory: Optional[Path],          # May be None when there aren't any limits
+        max_messages_per_second: Optional[float],
+        max_concurrent_sessions: Optional[int],
+    ):
+        if directory is None and (max_messages_per_second is not None or max_concurrent_sessions is not None):
+            raise Exception("A directory must be provided when limits are specified.")
+
+        self.directory                      = directory
+        self.max_messages_per_second        = max_messages_per_second
+        self.max_concurrent_sessions        = max_concurrent_sessions
+
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    # ----------------------------------------------------------------------
+    def WaitForMessage(
+        self,
+        deadline: Optional[SmtpDeadline]=None,
+    ) -> None:
+        """Blocks until a message can be sent; SmtpTimeoutError is raised if the deadline would expire first"""
+
+        while True:
+            delay = self.TryAcquireMessage()
+            if not delay:
+                break
+
+            if deadline is None:
+                time.sleep(delay)
+            else:
+                deadline.Sleep(delay)
+
+    # ----------------------------------------------------------------------
+    def TryAcquireMessage(self) -> float:
+        """Returns 0.0 if a message can be sent now; otherwise, returns the number of seconds to wait before trying again"""
+
+        if self.max_messages_per_second is None:
+            return 0.0
+
+        assert self.directory is not None
+
+        rate = self.max_messages_per_second
+        capacity = max(1.0, rate)
+
+        with (self.directory / "messages.lock").open("a+b") as f:
+            _Lock(f, blocking=True)
+
+            try:
+                # The file contains the number of tokens in the bucket and the time that they were
+                # calculated
+                f.seek(0)
+                content = f.read().split()
+
+                now = time.time()
+
+                if len(content) == 2:
+                    tokens = min(capacity, float(content[0]) + max(0.0, now - float(content[1])) * rate)
+                else:
+                    tokens = capacity
+
+                if tokens >= 1.0:
+                    tokens -= 1.0
+                    delay = 0.0
+                else:
+                    delay = (1.0 - tokens) / rate
+
+                f.seek(0)
+                f.truncate()
+                f.write("{} {}".format(tokens, now).encode("ascii"))
+                f.flush()
+
+            finally:
+                _Unlock(f)
+
+        return delay
+
+    # ----------------------------------------------------------------------
+    @contextmanager
+    def Session(
+        self,
+        deadline: Optional[SmtpDeadline]=None,
+    ) -> Iterator[None]:
+        """Blocks until a session can be started (or raises SmtpTimeoutError if the deadline expires first); the session ends when the context exits"""
+
+        while True:
+            release_func = self.TryAcquireSession()
+            if release_func is not None:
+                break
+
+            if deadline is None:
+                time.sleep(self.__class__.POLL_SECONDS)
+            else:
+                deadline.Sleep(self.__class__.POLL_SECONDS)
+
+        try:
+            yield
+        finally:
+            release_func()
+
+    # ----------------------------------------------------------------------
+    def TryAcquireSession(self) -> Optional[Callable[[], None]]:
+        """Starts a session if one is available, returning a function that ends it; returns None if all sessions are active"""
+
+        if self.max_concurrent_sessions is None:
+            return lambda: None
+
+        assert self.directory is not None
+
+        for index in range(self.max_concurrent_sessions):
+            f = (self.directory / "session-{}.lock".format(index)).open("a+b")
+
+            if not _Lock(f, blocking=False):
+                f.close()
+                continue
+
+            # ----------------------------------------------------------------------
+            def Release(
+                f: BinaryIO=f,
+            ) -> None:
+                _Unlock(f)
+                f.close()
+
+            # ----------------------------------------------------------------------
+
+            return Release
+
+        return None
+
+
+# ----------------------------------------------------------------------
+@contextmanager
+def LockFile(
+    filename: Path,
+) -> Iterator[None]:
+    """Exclusively locks the file (creating it if necessary) while the context is active, blocking while another thread or process holds the lock"""
+
+    with filename.open("a+b") as f:
+        _Lock(f, blocking=True)
+
+        try:
+            yield
+        finally:
+            _Unlock(f)
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+def _Lock(
+    f: BinaryIO,
+    *,
+    blocking: bool,
+) -> bool:
+    """Exclusively locks the file, returning False if it is locked by another thread or process and `blocking` is False"""
+
+    if CurrentShell.family_name == "Windows":
+        import msvcrt
+
+        # Windows locks are associated with a range of the file
+        f.seek(0)
+
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)  # type: ignore
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+
+            time.sleep(SmtpThrottle.POLL_SECONDS)
+
+    import fcntl
+
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)  # type: ignore
+    except BlockingIOError:
+        return False
+
+    return True
+
+
+# ----------------------------------------------------------------------
+def _Unlock(
+    f: BinaryIO,
+) -> None:
+    if CurrentShell.family_name == "Windows":
+        import msvcrt
+
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)  # type: ignore
+
+        return
+
+    import fcntl
+
+    fcntl.flock(f.fileno(), fcntl.LOCK_UN)  # type: ignore
@@ -0,0 +1,319 @@
+# ----------------------------------------------------------------------
+# |
+# |  SmtpTransactions.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-04 10:31:17
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Sends mail transactions over an established SMTP session"""
+
+import copy
+import re
+import smtplib
+
+from dataclasses import dataclass
+from email.message import Message
+from email.utils import getaddresses
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .StreamingMessage import StreamingMessage
+
+
+# ----------------------------------------------------------------------
+@dataclass(frozen=True)
+class Transaction(object):
+    """A message and its envelope"""
+
+    sender: str
+    recipients: List[str]
+    content: Union[bytes, Iterable[bytes]]  # Iterables must produce the same content each time that they are iterated
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    def FromMessage(
+        cls,
+        message: Union[Message, StreamingMessage],
+    ) -> "Transaction":
+        """Creates a transaction based on the headers of a fully built message"""
+
+        if isinstance(message, StreamingMessage):
+            return cls(message.from_addr, message.recipients, message)
+
+        sender = message["Sender"] or message["From"]
+        if not sender:
+            raise Exception("The message does not have a sender.")
+
+        recipients = [
+            address
+            for _, address in getaddresses(
+                message.get_all("To", []) + message.get_all("Cc", []) + message.get_all("Bcc", []),
+            )
+            if address
+        ]
+
+        if "Bcc" in message:
+            message = copy.copy(message)
+            del message["Bcc"]
+
+        return cls(
+            sender,
+            recipients,
+            message.as_bytes(policy=message.policy.clone(linesep="\r\n")),
+        )
+
+
+# ----------------------------------------------------------------------
+@dataclass(frozen=True)
+class SendResult(object):
+    """The result of sending a single message"""
+
+    accepted: List[str]
+    refused: Dict[str, Tuple[int, bytes]]   # recipient -> (code, response)
+
+    code: int                               # Reply to the end of the message data, or to the command that prevented the message from being sent
+    response: bytes
+
+    # ----------------------------------------------------------------------
+    @property
+    def succeeded(self) -> bool:
+        return 200 <= self.code < 300
+
+    # ----------------------------------------------------------------------
+    def RaiseIfFailed(self) -> None:
+        """Raises the smtplib exception corresponding to a failed result"""
+
+        if not self.accepted and self.refused:
+            raise smtplib.SMTPRecipientsRefused(self.refused)  # type: ignore
+
+        if not self.succeeded:
+            raise smtplib.SMTPResponseException(self.code, self.response)
+
+
+# ----------------------------------------------------------------------
+def Send(
+    smtp: smtplib.SMTP,
+    transactions: Iterable[Transaction],
+) -> Iterator[SendResult]:
+    """\
+    Sends each transaction over the session, yielding a result for each one.
+
+    When the server advertises the PIPELINING extension (RFC 2920), the MAIL, RCPT, and DATA
+    commands of a transaction are sent as a single group, and that group is sent along with
+    the data of the previous message.
+    """
+
+    smtp.ehlo_or_helo_if_needed()
+
+    if smtp.has_extn("pipelining"):
+        yield from _SendPipelined(smtp, iter(transactions))
+    else:
+        yield from _SendSequential(smtp, iter(transactions))
+
+
+# ----------------------------------------------------------------------
+def CreateEnvelopeCommands(
+    transaction: Transaction,
+) -> List[bytes]:
+    """Returns the MAIL, RCPT, and DATA commands used to send the transaction"""
+
+    commands = ["MAIL FROM:{}".format(smtplib.quoteaddr(transaction.sender))]
+
+    commands += [
+        "RCPT TO:{}".format(smtplib.quoteaddr(recipient))
+        for recipient in transaction.recipients
+    ]
+
+    commands.append("DATA")
+
+    return ["{}\r\n".format(command).encode("ascii") for command in commands]
+
+
+# ----------------------------------------------------------------------
+def PrepareContent(
+    content: Union[bytes, Iterable[bytes]],
+) -> Iterator[bytes]:
+    """Normalizes line endings and escapes leading periods so that the content can be sent after DATA"""
+
+    if isinstance(content, bytes):
+        content = [content]
+
+    # Chunks are processed on line boundaries; the trailing partial line of a chunk is
+    # prepended to the next one.
+    pending = b""
+
+    for chunk in content:
+        if pending:
+            chunk = pending + chunk
+
+        index = chunk.rfind(b"\n") + 1
+
+        pending = chunk[index:]
+
+        if index:
+            yield _PrepareLines(chunk[:index])
+
+    if pending:
+        yield _PrepareLines(pending + b"\r\n")
+
+
+# ----------------------------------------------------------------------
+def ProcessRecipientReplies(
+    recipients: List[str],
+    replies: List[Tuple[int, bytes]],
+) -> Tuple[List[str], Dict[str, Tuple[int, bytes]]]:
+    """Splits the recipients into those that were accepted and those that were refused"""
+
+    accepted: List[str] = []
+    refused: Dict[str, Tuple[int, bytes]] = {}
+
+    for recipient, (code, response) in zip(recipients, replies):
+        if code in (250, 251):
+            accepted.append(recipient)
+        else:
+            refused[recipient] = (code, response)
+
+    return accepted, refused
+
+
+# ----------------------------------------------------------------------
+def CreateFailureResult(
+    accepted: List[str],
+    refused: Dict[str, Tuple[int, bytes]],
+    mail_code: int,
+    mail_response: bytes,
+    data_code: Optional[int],
+    data_response: Optional[bytes],
+) -> SendResult:
+    """Creates the result for a transaction whose data was not sent"""
+
+    if mail_code != 250:
+        return SendResult([], refused, mail_code, mail_response)
+
+    if not accepted:
+        # Report the reply associated with the first refused recipient
+        code, response = next(iter(refused.values()), (-1, b"No recipients were provided."))
+        return SendResult([], refused, code, response)
+
+    assert data_code is not None and data_response is not None
+    return SendResult([], refused, data_code, data_response)
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+_crlf_regex                                 = re.compile(rb"\r\n|\n|\r")
+_leading_period_regex                       = re.compile(rb"(?m)^\.")
+
+
+# ----------------------------------------------------------------------
+def _PrepareLines(
+    content: bytes,
+) -> bytes:
+    content = _crlf_regex.sub(b"\r\n", content)
+    content = _leading_period_regex.sub(b"..", content)
+
+    return content
+
+
+# ----------------------------------------------------------------------
+def _SendPipelined(
+    smtp: smtplib.SMTP,
+    transactions: Iterator[Transaction],
+) -> Iterator[SendResult]:
+    transaction = next(transactions, None)
+    if transaction is None:
+        return
+
+    smtp.send(b"".join(CreateEnvelopeCommands(transaction)))
+
+    while transaction is not None:
+        mail_code, mail_response = smtp.getreply()
+        rcpt_replies = [smtp.getreply() for _ in transaction.recipients]
+        data_code, data_response = smtp.getreply()
+
+        next_transaction = next(transactions, None)
+        next_envelope = b"" if next_transaction is None else b"".join(CreateEnvelopeCommands(next_transaction))
+
+        accepted, refused = ProcessRecipientReplies(transaction.recipients, rcpt_replies)
+
+        if mail_code == 250 and accepted and data_code == 354:
+            for chunk in PrepareContent(transaction.content):
+                smtp.send(chunk)
+
+            smtp.send(b".\r\n" + next_envelope)
+
+            code, response = smtp.getreply()
+
+            yield SendResult(accepted, refused, code, response)
+
+        else:
+            # Terminate the message if the server started it anyway and reset the session
+            # before processing the next envelope.
+            terminate_data = data_code == 354
+
+            smtp.send((b".\r\n" if terminate_data else b"") + b"RSET\r\n" + next_envelope)
+
+            if terminate_data:
+                smtp.getreply()
+
+            smtp.getreply()
+
+            yield CreateFailureResult(
+                accepted,
+                refused,
+                mail_code,
+                mail_response,
+                data_code,
+                data_response,
+            )
+
+        transaction = next_transaction
+
+
+# ----------------------------------------------------------------------
+def _SendSequential(
+    smtp: smtplib.SMTP,
+    transactions: Iterator[Transaction],
+) -> Iterator[SendResult]:
+    for transaction in transactions:
+        mail_code, mail_response = smtp.mail(transaction.sender)
+
+        if mail_code != 250:
+            smtp.rset()
+            yield SendResult([], {}, mail_code, mail_response)
+            continue
+
+        accepted, refused = ProcessRecipientReplies(
+            transaction.recipients,
+            [smtp.rcpt(recipient) for recipient in transaction.recipients],
+        )
+
+        if not accepted:
+            smtp.rset()
+            yield CreateFailureResult(accepted, refused, mail_code, mail_response, None, None)
+            continue
+
+        smtp.putcmd("data")
+
+        data_code, data_response = smtp.getreply()
+        if data_code != 354:
+            smtp.rset()
+            yield CreateFailureResult(accepted, refused, mail_code, mail_response, data_code, data_response)
+            continue
+
+        for chunk in PrepareContent(transaction.content):
+            smtp.send(chunk)
+
+        smtp.send(b".\r\n")
+
+        code, response = smtp.getreply()
+
+        yield SendResult(accepted, refused, code, response)
@@ -0,0 +1,299 @@
+# ----------------------------------------------------------------------
+# |
+# |  StreamingMessage.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-06 09:02:55
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Contains the StreamingMessage object"""
+
+import base64
+import codecs
+import mimetypes
+import queue
+import threading
+import uuid
+import zlib
+
+from dataclasses import dataclass, field
+from email.message import Message
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+from email.policy import compat32
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Union
+
+
+# ----------------------------------------------------------------------
+@dataclass(frozen=True)
+class StreamingMessage(object):
+    """\
+    MIME message that is generated in chunks as it is sent, so that attachments are read and
+    encoded incrementally rather than loaded into memory.
+
+    Iterating over the object produces the message content; it can be iterated multiple times.
+
+    When `message` is a Path, the message body is read from that utf-8 encoded file as the
+    message is sent.
+    """
+
+    # ----------------------------------------------------------------------
+    # |  Public Types
+    CHUNK_SIZE                              = 57 * 1024     # Multiple of 57, as each 57 byte block is encoded as a 76 character base64 line
+
+    # ----------------------------------------------------------------------
+    # |  Public Data
+    from_addr: str
+    recipients: List[str]
+    subject: str
+    message: Union[str, Path]
+
+    attachment_filenames: List[Path]        = field(default_factory=list)
+    message_format: str                     = field(default="plain")    # "html"
+
+    # Text attachments at least this many bytes in size are sent gzip-compressed
+    compress_attachments_threshold: Optional[int]   = field(default=None)
+
+    # ----------------------------------------------------------------------
+    # |  Public Methods
+    def __iter__(self) -> Iterator[bytes]:
+        return self.Generate()
+
+    # ----------------------------------------------------------------------
+    def Generate(self) -> Iterator[bytes]:
+        """Generates the message content"""
+
+        boundary = "==============={}==".format(uuid.uuid4().hex)
+
+        headers = Message()
+
+        headers.add_header(
+            "Content-Type",
+            "multipart/alternative" if not self.attachment_filenames else "multipart/mixed",
+            boundary=boundary,
+        )
+        headers["MIME-Version"] = "1.0"
+        headers["Subject"] = self.subject
+        headers["From"] = self.from_addr
+        headers["To"] = ", ".join(self.recipients)
+
+        yield _ToBytes(headers)
+
+        delimiter = "--{}\r\n".format(boundary).encode("ascii")
+
+        yield delimiter
+        yield from self._GenerateBody()
+        yield b"\r\n"
+
+        for attachment_filename in self.attachment_filenames:
+            yield delimiter
+            yield from self._GenerateAttachment(attachment_filename)
+            yield b"\r\n"
+
+        yield "--{}--\r\n".format(boundary).encode("ascii")
+
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    def _GenerateBody(self) -> Iterator[bytes]:
+        if isinstance(self.message, str):
+            yield _ToBytes(MIMEText(self.message, self.message_format), include_payload=True)
+            return
+
+        body = MIMEBase("text", self.message_format, charset="utf-8")
+
+        body["Content-Transfer-Encoding"] = "base64"
+
+        yield _ToBytes(body)
+        yield from EncodeBase64(_ReadChunks(self.message, self.__class__.CHUNK_SIZE))
+
+    # ----------------------------------------------------------------------
+    def _GenerateAttachment(
+        self,
+        filename: Path,
+    ) -> Iterator[bytes]:
+        ctype, encoding = mimetypes.guess_type(filename)
+
+        if ctype is None and encoding is None:
+            is_text = _IsText(filename)
+        else:
+            is_text = ctype is not None and ctype.startswith("text/") and encoding is None
+
+        if ctype is None or encoding is not None:
+            ctype = "application/octet-stream"
+
+        maintype, subtype = ctype.split("/", 1)
+
+        attachment_name = filename.name
+
+        if (
+            is_text
+            and self.compress_attachments_threshold is not None
+            and filename.stat().st_size >= self.compress_attachments_threshold
+        ):
+            attachment = MIMEBase("application", "gzip")
+            attachment_name += ".gz"
+
+            chunks = _CompressInBackground(filename, self.__class__.CHUNK_SIZE)
+
+        else:
+            if maintype == "text":
+                attachment = MIMEBase(maintype, subtype, charset="utf-8")
+            else:
+                attachment = MIMEBase(maintype, subtype)
+
+            chunks = _ReadChunks(filename, self.__class__.CHUNK_SIZE)
+
+        attachment["Content-Transfer-Encoding"] = "base64"
+        attachment.add_header("Content-Disposition", "attachment", filename=attachment_name)
+
+        yield _ToBytes(attachment)
+        yield from EncodeBase64(chunks)
+
+
+# ----------------------------------------------------------------------
+def EncodeBase64(
+    chunks: Iterable[bytes],
+) -> Iterator[bytes]:
+    """Encodes arbitrarily sized chunks as base64 lines terminated by CRLF"""
+
+    pending = b""
+
+    for chunk in chunks:
+        if pending:
+            chunk = pending + chunk
+
+        # Encode complete lines now and the remainder once more data is available
+        index = len(chunk) - len(chunk) % 57
+
+        pending = chunk[index:]
+
+        if index:
+            yield base64.encodebytes(chunk[:index]).replace(b"\n", b"\r\n")
+
+    if pending:
+        yield base64.encodebytes(pending).replace(b"\n", b"\r\n")
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+_policy                                     = compat32.clone(linesep="\r\n")
+
+
+# ----------------------------------------------------------------------
+def _IsText(
+    filename: Path,
+) -> bool:
+    """Returns True if the beginning of the file looks like utf-8 text"""
+
+    with filename.open("rb") as f:
+        content = f.read(8192)
+
+    if b"\0" in content:
+        return False
+
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(content, final=False)
+    except UnicodeDecodeError:
+        return False
+
+    return True
+
+
+# ----------------------------------------------------------------------
+def _ReadChunks(
+    filename: Path,
+    chunk_size: int,
+) -> Iterator[bytes]:
+    with filename.open("rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+
+            yield chunk
+
+
+# ----------------------------------------------------------------------
+def _CompressInBackground(
+    filename: Path,
+    chunk_size: int,
+) -> Iterator[bytes]:
+    """Compresses the file on a worker thread, yielding gzip data as it becomes available"""
+
+    # Items are compressed data, None when compression is complete, or an exception
+    items: "queue.Queue[Union[bytes, Exception, None]]" = queue.Queue(maxsize=8)
+    is_cancelled = threading.Event()
+
+    # ----------------------------------------------------------------------
+    def Put(
+        item: Union[bytes, Exception, None],
+    ) -> bool:
+        while not is_cancelled.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    # ----------------------------------------------------------------------
+    def Execute() -> None:
+        try:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip container
+
+            for chunk in _ReadChunks(filename, chunk_size):
+                chunk = compressor.compress(chunk)
+                if chunk and not Put(chunk):
+                    return
+
+            if Put(compressor.flush()):
+                Put(None)
+
+        except Exception as ex:  # pylint: disable=broad-except
+            Put(ex)
+
+    # ----------------------------------------------------------------------
+
+    thread = threading.Thread(target=Execute, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = items.get()
+
+            if item is None:
+                break
+
+            if isinstance(item, Exception):
+                raise item
+
+            yield item
+
+    finally:
+        is_cancelled.set()
+        thread.join()
+
+
+# ----------------------------------------------------------------------
+def _ToBytes(
+    message: Message,
+    *,
+    include_payload: bool=False,
+) -> bytes:
+    """Returns the message's headers (and optionally its payload)"""
+
+    if not include_payload:
+        message.set_payload("")
+
+    return message.as_bytes(policy=_policy)
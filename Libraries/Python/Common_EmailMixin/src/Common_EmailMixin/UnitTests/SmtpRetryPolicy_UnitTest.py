@@ -0,0 +1,205 @@
+# ----------------------------------------------------------------------
+# |
+# |  SmtpRetryPolicy_UnitTest.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-19 13:27:05
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Unit tests for SmtpRetryPolicy.py"""
+
+import smtplib
+
+from typing import List, Union
+
+import pytest
+
+from Common_EmailMixin.SmtpRetryPolicy import SmtpRetryPolicy
+from Common_EmailMixin.SmtpTransactions import SendResult, Transaction
+
+
+# ----------------------------------------------------------------------
+_policy                                     = SmtpRetryPolicy(initial_delay_seconds=0.001)
+
+
+# ----------------------------------------------------------------------
+class _Sender(object):
+    """Returns (or raises) the provided outcomes, recording the recipients of each attempt"""
+
+    # ----------------------------------------------------------------------
+    def __init__(
+        self,
+        *outcomes: Union[SendResult, Exception],
+    ):
+        self.recipients: List[List[str]]    = []
+
+        self._outcomes                      = list(outcomes)
+
+    # ----------------------------------------------------------------------
+    def __call__(
+        self,
+        transaction: Transaction,
+    ) -> SendResult:
+        self.recipients.append(transaction.recipients)
+
+        outcome = self._outcomes.pop(0)
+
+        if isinstance(outcome, Exception):
+            raise outcome
+
+        return outcome
+
+
+# ----------------------------------------------------------------------
+def test_Success():
+    sender = _Sender(SendResult(["a"], {}, 250, b"queued"))
+
+    result = _policy.Send(Transaction("sender", ["a"], b"content"), sender)
+
+    assert result == SendResult(["a"], {}, 250, b"queued")
+    assert sender.recipients == [["a"]]
+
+
+# ----------------------------------------------------------------------
+def test_TransientReply():
+    sender = _Sender(
+        SendResult([], {}, 451, b"try later"),
+        SendResult(["a", "b"], {}, 250, b"queued"),
+    )
+
+    result = _policy.Send(Transaction("sender", ["a", "b"], b"content"), sender)
+
+    assert result == SendResult(["a", "b"], {}, 250, b"queued")
+    assert sender.recipients == [["a", "b"], ["a", "b"]]
+
+
+# ----------------------------------------------------------------------
+def test_PermanentReply():
+    sender = _Sender(SendResult([], {}, 554, b"rejected"))
+
+    result = _policy.Send(Transaction("sender", ["a"], b"content"), sender)
+
+    assert result == SendResult([], {}, 554, b"rejected")
+    assert sender.recipients == [["a"]]
+
+
+# ----------------------------------------------------------------------
+def test_RefusedRecipients():
+    sender = _Sender(
+        SendResult(["a"], {"b": (451, b"try later"), "c": (550, b"no such user")}, 250, b"queued"),
+        SendResult(["b"], {}, 250, b"queued again"),
+    )
+
+    result = _policy.Send(Transaction("sender", ["a", "b", "c"], b"content"), sender)
+
+    assert result == SendResult(["a", "b"], {"c": (550, b"no such user")}, 250, b"queued again")
+    assert sender.recipients == [["a", "b", "c"], ["b"]]
+
+
+# ----------------------------------------------------------------------
+def test_MaxAttempts():
+    sender = _Sender(*(SendResult([], {"a": (451, b"try later")}, 451, b"try later") for _ in range(2)))
+
+    result = SmtpRetryPolicy(max_attempts=2, initial_delay_seconds=0.001).Send(
+        Transaction("sender", ["a"], b"content"),
+        sender,
+    )
+
+    assert result == SendResult([], {"a": (451, b"try later")}, 451, b"try later")
+    assert sender.recipients == [["a"], ["a"]]
+
+
+# ----------------------------------------------------------------------
+def test_TransientError():
+    sender = _Sender(
+        smtplib.SMTPServerDisconnected("disconnected"),
+        SendResult(["a"], {}, 250, b"queued"),
+    )
+
+    result = _policy.Send(Transaction("sender", ["a"], b"content"), sender)
+
+    assert result == SendResult(["a"], {}, 250, b"queued")
+    assert sender.recipients == [["a"], ["a"]]
+
+
+# ----------------------------------------------------------------------
+def test_PermanentError():
+    sender = _Sender(ValueError("invalid"))
+
+    with pytest.raises(ValueError):
+        _policy.Send(Transaction("sender", ["a"], b"content"), sender)
+
+    assert sender.recipients == [["a"]]
+
+
+# ----------------------------------------------------------------------
+def test_TransientReplyAfterPartialSuccess():
+    # The final attempt fails without replies for individual recipients (for example, a reply
+    # to MAIL), so its reply is reported for the recipients that were being retried.
+    sender = _Sender(
+        SendResult(["a"], {"b": (451, b"try later")}, 250, b"queued"),
+        SendResult([], {}, 451, b"try later again"),
+    )
+
+    result = SmtpRetryPolicy(max_attempts=2, initial_delay_seconds=0.001).Send(
+        Transaction("sender", ["a", "b"], b"content"),
+        sender,
+    )
+
+    assert result == SendResult(["a"], {"b": (451, b"try later again")}, 250, b"queued")
+    assert sender.recipients == [["a", "b"], ["b"]]
+
+
+# ----------------------------------------------------------------------
+def test_PermanentReplyAfterPartialSuccess():
+    sender = _Sender(
+        SendResult(["a"], {"b": (451, b"try later"), "c": (451, b"try later")}, 250, b"queued"),
+        SendResult([], {"c": (550, b"no such user")}, 554, b"rejected"),
+    )
+
+    result = _policy.Send(Transaction("sender", ["a", "b", "c"], b"content"), sender)
+
+    assert result == SendResult(
+        ["a"],
+        {"b": (554, b"rejected"), "c": (550, b"no such user")},
+        250,
+        b"queued",
+    )
+    assert sender.recipients == [["a", "b", "c"], ["b", "c"]]
+
+
+# ----------------------------------------------------------------------
+def test_ErrorAfterPartialSuccess():
+    # The recipients that were being retried must be reported as refused
+    sender = _Sender(
+        SendResult(["a"], {"b": (451, b"try later")}, 250, b"queued"),
+        smtplib.SMTPServerDisconnected("disconnected"),
+    )
+
+    result = SmtpRetryPolicy(max_attempts=2, initial_delay_seconds=0.001).Send(
+        Transaction("sender", ["a", "b"], b"content"),
+        sender,
+    )
+
+    assert result == SendResult(["a"], {"b": (-1, b"disconnected")}, 250, b"queued")
+    assert sender.recipients == [["a", "b"], ["b"]]
+
+
+# ----------------------------------------------------------------------
+def test_ResponseErrorAfterPartialSuccess():
+    sender = _Sender(
+        SendResult(["a"], {"b": (451, b"try later")}, 250, b"queued"),
+        smtplib.SMTPResponseException(554, b"rejected"),
+    )
+
+    result = _policy.Send(Transaction("sender", ["a", "b"], b"content"), sender)
+
+    assert result == SendResult(["a"], {"b": (554, b"rejected")}, 250, b"queued")
+    assert sender.recipients == [["a", "b"], ["b"]]
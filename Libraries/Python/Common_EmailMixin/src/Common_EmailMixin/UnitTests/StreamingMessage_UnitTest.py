@@ -0,0 +1,217 @@
+# ----------------------------------------------------------------------
+# |
+# |  StreamingMessage_UnitTest.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-20 11:41:06
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Unit tests for StreamingMessage.py"""
+
+import base64
+import email
+import gzip
+import re
+
+from email.message import Message
+from typing import Dict, List
+
+from Common_EmailMixin.StreamingMessage import EncodeBase64, StreamingMessage
+from Common_EmailMixin.SmtpTransactions import PrepareContent
+
+
+# ----------------------------------------------------------------------
+def _Parse(
+    message: StreamingMessage,
+) -> Message:
+    return email.message_from_bytes(b"".join(message))
+
+
+# ----------------------------------------------------------------------
+def _GetAttachments(
+    message: Message,
+) -> Dict[str, Message]:
+    return {
+        part.get_filename(): part
+        for part in message.get_payload()
+        if part.get_filename() is not None
+    }
+
+
+# ----------------------------------------------------------------------
+def test_EncodeBase64():
+    content = bytes(range(256)) * 10
+
+    for chunk_size in [1, 56, 57, 58, 1000, len(content)]:
+        chunks = [content[index:index + chunk_size] for index in range(0, len(content), chunk_size)]
+        encoded = b"".join(EncodeBase64(chunks))
+
+        assert encoded == base64.encodebytes(content).replace(b"\n", b"\r\n")
+        assert all(len(line) <= 76 for line in encoded.split(b"\r\n"))
+
+
+# ----------------------------------------------------------------------
+def test_Headers():
+    message = _Parse(StreamingMessage("from@example.com", ["one@example.com", "two@example.com"], "The Subject", "Body"))
+
+    assert message["Subject"] == "The Subject"
+    assert message["From"] == "from@example.com"
+    assert message["To"] == "one@example.com, two@example.com"
+    assert message.get_content_type() == "multipart/alternative"
+
+    body = message.get_payload()[0]
+
+    assert body.get_content_type() == "text/plain"
+    assert body.get_payload(decode=True) == b"Body"
+
+
+# ----------------------------------------------------------------------
+def test_BodyFromFile(tmp_path):
+    content = "".join("Line {} é中\n".format(index) for index in range(10000))
+
+    body_filename = tmp_path / "body.html"
+    body_filename.write_text(content, encoding="utf-8")
+
+    message = _Parse(StreamingMessage("from@example.com", ["to@example.com"], "Subject", body_filename, message_format="html"))
+
+    body = message.get_payload()[0]
+
+    assert body.get_content_type() == "text/html"
+    assert body["Content-Transfer-Encoding"] == "base64"
+    assert body.get_payload(decode=True).decode("utf-8") == content
+
+
+# ----------------------------------------------------------------------
+def test_Attachments(tmp_path):
+    binary_content = bytes(range(256)) * (StreamingMessage.CHUNK_SIZE // 256 + 3)
+    text_content = b"".join(b"Log line %d\n" % index for index in range(20000))
+
+    binary_filename = tmp_path / "data.bin"
+    binary_filename.write_bytes(binary_content)
+
+    text_filename = tmp_path / "output.txt"
+    text_filename.write_bytes(text_content)
+
+    message = _Parse(
+        StreamingMessage(
+            "from@example.com",
+            ["to@example.com"],
+            "Subject",
+            "Body",
+            attachment_filenames=[binary_filename, text_filename],
+        ),
+    )
+
+    assert message.get_content_type() == "multipart/mixed"
+
+    attachments = _GetAttachments(message)
+
+    assert sorted(attachments) == ["data.bin", "output.txt"]
+
+    assert attachments["data.bin"].get_content_type() == "application/octet-stream"
+    assert attachments["data.bin"].get_payload(decode=True) == binary_content
+
+    assert attachments["output.txt"].get_content_type() == "text/plain"
+    assert attachments["output.txt"].get_content_charset() == "utf-8"
+    assert attachments["output.txt"].get_payload(decode=True) == text_content
+
+
+# ----------------------------------------------------------------------
+def test_CompressedAttachments(tmp_path):
+    large_content = b"".join(b"Log line %d\n" % index for index in range(200000))
+    small_content = b"Small log\n"
+
+    large_filename = tmp_path / "large.log"
+    large_filename.write_bytes(large_content)
+
+    small_filename = tmp_path / "small.txt"
+    small_filename.write_bytes(small_content)
+
+    streaming_message = StreamingMessage(
+        "from@example.com",
+        ["to@example.com"],
+        "Subject",
+        "Body",
+        attachment_filenames=[large_filename, small_filename],
+        compress_attachments_threshold=1024,
+    )
+
+    # The message can be generated more than once
+    for _ in range(2):
+        attachments = _GetAttachments(_Parse(streaming_message))
+
+        assert sorted(attachments) == ["large.log.gz", "small.txt"]
+
+        assert attachments["large.log.gz"].get_content_type() == "application/gzip"
+        assert gzip.decompress(attachments["large.log.gz"].get_payload(decode=True)) == large_content
+
+        assert attachments["small.txt"].get_content_type() == "text/plain"
+        assert attachments["small.txt"].get_payload(decode=True) == small_content
+
+
+# ----------------------------------------------------------------------
+def test_DotStuffing():
+    message = StreamingMessage(
+        "from@example.com",
+        ["to@example.com"],
+        "Subject",
+        "First\n.\n.Leading period\n..Two leading periods\nLast\n",
+    )
+
+    # Each generation uses a different boundary
+    chunks = list(message)
+
+    content = b"".join(chunks)
+    prepared = b"".join(PrepareContent(chunks))
+
+    lines: List[bytes] = prepared.split(b"\r\n")
+
+    assert lines[-1] == b""
+    assert b"." not in lines
+    assert b"..Leading period" in lines
+    assert b"...Two leading periods" in lines
+
+    # Removing the escaped periods restores the original content
+    assert re.sub(rb"(?m)^\.", b"", prepared) == content
+
+
+# ----------------------------------------------------------------------
+def test_DotStuffingAcrossChunks():
+    content = b"First\r\n.Second\n..Third\r.Fourth\r\nLast"
+
+    for chunk_size in range(1, len(content) + 1):
+        chunks = [content[index:index + chunk_size] for index in range(0, len(content), chunk_size)]
+
+        assert b"".join(PrepareContent(chunks)) == b"First\r\n..Second\r\n...Third\r\n..Fourth\r\nLast\r\n", chunk_size
+
+
+# ----------------------------------------------------------------------
+def test_EmptyAttachment(tmp_path):
+    filename = tmp_path / "empty.txt"
+    filename.write_bytes(b"")
+
+    attachments = _GetAttachments(
+        _Parse(StreamingMessage("from@example.com", ["to@example.com"], "Subject", "Body", attachment_filenames=[filename])),
+    )
+
+    assert attachments["empty.txt"].get_payload(decode=True) == b""
+
+
+# ----------------------------------------------------------------------
+def test_PathIsNotLoaded(tmp_path):
+    # The body and attachments are read as the message is generated
+    filename = tmp_path / "body.txt"
+    filename.write_text("Original", encoding="utf-8")
+
+    message = StreamingMessage("from@example.com", ["to@example.com"], "Subject", filename)
+
+    filename.write_text("Updated", encoding="utf-8")
+
+    assert _Parse(message).get_payload()[0].get_payload(decode=True) == b"Updated"
@@ -13,7 +13,7 @@
 # |  http://www.boost.org/LICENSE_1_0.txt.
 # |
 # ----------------------------------------------------------------------
-"""Creates, Lists, and Verifies SmtpMailer profiles"""
+"""Creates, Lists, and Verifies SmtpMailer profiles, and sends messages in the outbox"""
 
 import datetime
 import getpass
@@ -29,6 +29,7 @@ from typer.core import TyperGroup
 from Common_Foundation.Streams.DoneManager import DoneManager, DoneManagerFlags
 
 from Common_EmailMixin.SmtpMailer import SmtpMailer
+from Common_EmailMixin.SmtpOutbox import SmtpOutbox
 
 
 # ----------------------------------------------------------------------
@@ -64,6 +65,11 @@ def Create(
     port: Optional[int]=typer.Option(None, min=1, help="SMTP server port."),
     ssl: bool=typer.Option(False, "--ssl", help="Use SSL to connect to the SMTP server."),
     password: Optional[str]=typer.Option(None, help="SMTP server password; you will be prompted for the password if it is not provided on the command line."),
+    max_messages_per_second: Optional[float]=typer.Option(None, "--max-messages-per-second", min=0.001, help="Maximum rate at which messages are sent with the profile by all processes on this machine; messages are delayed rather than sent in bursts that may be rejected by the server."),
+    max_concurrent_sessions: Optional[int]=typer.Option(None, "--max-concurrent-sessions", min=1, help="Maximum number of SMTP sessions used concurrently with the profile by all processes on this machine."),
+    connect_timeout: float=typer.Option(SmtpMailer.DEFAULT_CONNECT_TIMEOUT_SECONDS, "--connect-timeout", min=0.001, help="Seconds to wait for the SMTP server when connecting and authenticating."),
+    command_timeout: float=typer.Option(SmtpMailer.DEFAULT_COMMAND_TIMEOUT_SECONDS, "--command-timeout", min=0.001, help="Seconds to wait for the SMTP server to respond to a command once connected."),
+    deadline: Optional[float]=typer.Option(None, "--deadline", min=0.001, help="Maximum number of seconds spent sending a message, including retries."),
     verbose: bool=typer.Option(False, "--verbose", help="Write verbose information to the terminal."),
     debug: bool=typer.Option(False, "--debug", help="Write debug information to the terminal."),
 ) -> None:
@@ -85,6 +91,11 @@ def Create(
                 from_name=from_name,
                 from_email=from_email,
                 ssl=ssl,
+                max_messages_per_second=max_messages_per_second,
+                max_concurrent_sessions=max_concurrent_sessions,
+                connect_timeout_seconds=connect_timeout,
+                command_timeout_seconds=command_timeout,
+                deadline_seconds=deadline,
             ).Save(profile_name)
 
 
@@ -108,7 +119,14 @@ def ListFunc(
 
                 """,
             ).format(
-                "\n".join("    - {}".format(profile) for profile in SmtpMailer.EnumProfiles()),
+                "\n".join(
+                    "    - {:<30} {:<40} {}".format(
+                        info.name,
+                        info.settings["host"],
+                        "verified {}".format(info.last_verified) if info.last_verified else "not verified",
+                    )
+                    for info in SmtpMailer.EnumProfileInfo()
+                ),
             ),
         )
 
@@ -130,9 +148,13 @@ def Display(
             "Loading profile...",
             suffix="\n",
         ):
-            mailer = SmtpMailer.Load(profile_name)
+            # The password is only available in the profile itself
+            if show_password:
+                content = SmtpMailer.Load(profile_name).ToString(show_password=True)
+            else:
+                content = SmtpMailer.GetProfileInfo(profile_name).ToString()
 
-        dm.WriteLine(mailer.ToString(show_password=show_password))
+        dm.WriteLine(content)
         dm.WriteLine("")
 
 
@@ -142,6 +164,7 @@ def Verify(
     profile_name: str=_profile_name_argument,
     recipients: List[str]=typer.Argument(..., help="Email recipients (multiple can be provided)."),
     attachments: Optional[List[Path]]=typer.Option(None, "--attachment", resolve_path=True, exists=True, dir_okay=False, help="Optional attachments to include with the message."),
+    compress_attachments_threshold: Optional[int]=typer.Option(None, "--compress-attachments-threshold", min=0, help="Text attachments at least this many bytes in size are sent gzip-compressed."),
     verbose: bool=typer.Option(False, "--verbose", help="Write verbose information to the terminal."),
     debug: bool=typer.Option(False, "--debug", help="Write debug information to the terminal."),
 ) -> None:
@@ -161,6 +184,47 @@ def Verify(
             "SmtpMailer Verification ({})".format(datetime.datetime.now()),
             "This is a test message to ensure that the profile '{}' is working as expected.\n".format(profile_name),
             attachments,
+            compress_attachments_threshold=compress_attachments_threshold,
+        )
+
+        SmtpMailer.SetVerified(profile_name)
+
+
+# ----------------------------------------------------------------------
+@app.command("Flush", no_args_is_help=False)
+def Flush(
+    outbox_directory: Optional[Path]=typer.Option(None, "--outbox-directory", file_okay=False, resolve_path=True, help="Outbox directory; the default outbox is used if a directory is not provided."),
+    include_deferred: bool=typer.Option(False, "--include-deferred", help="Send messages that are waiting to be retried after a previous failure."),
+    max_concurrent_sessions: int=typer.Option(SmtpOutbox.DEFAULT_MAX_CONCURRENT_SESSIONS, "--max-concurrent-sessions", min=1, help="Maximum number of SMTP sessions used to send messages associated with a profile."),
+    verbose: bool=typer.Option(False, "--verbose", help="Write verbose information to the terminal."),
+    debug: bool=typer.Option(False, "--debug", help="Write debug information to the terminal."),
+) -> None:
+    """Sends the messages in the outbox."""
+
+    with DoneManager.CreateCommandLine(
+        output_flags=DoneManagerFlags.Create(verbose=verbose, debug=debug),
+    ) as dm:
+        with dm.Nested(
+            "Sending messages...",
+            suffix="\n",
+        ) as flush_dm:
+            result = SmtpOutbox(outbox_directory).Flush(
+                include_deferred=include_deferred,
+                max_concurrent_sessions=max_concurrent_sessions,
+            )
+
+            for message_id, error in result.deferred.items():
+                flush_dm.WriteWarning("'{}' will be retried: {}".format(message_id, error))
+
+            for message_id, error in result.failed.items():
+                flush_dm.WriteError("'{}' could not be sent: {}".format(message_id, error))
+
+        dm.WriteLine(
+            "{} sent, {} deferred, {} failed\n".format(
+                len(result.sent),
+                len(result.deferred),
+                len(result.failed),
+            ),
         )
 
 
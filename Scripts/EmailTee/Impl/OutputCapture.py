@@ -0,0 +1,304 @@
+# ----------------------------------------------------------------------
+# |
+# |  OutputCapture.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-10 11:26:38
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Contains the OutputCapture object"""
+
+import sys
+import tempfile
+
+from collections import deque
+from typing import Deque, Iterator, List, Optional
+
+
+# ----------------------------------------------------------------------
+class OutputCapture(object):
+    """\
+    Text stream that captures output in memory until it exceeds a threshold, at which point
+    the content is spooled to a temporary file (a threshold of 0 writes the content to the
+    temporary file immediately).
+
+    When `max_lines` and/or `max_bytes` are provided, only the first and last lines of the
+    output (half of each limit for each) are retained, and the lines in between are replaced
+    with a marker that indicates how many lines were omitted.
+    """
+
+    # ----------------------------------------------------------------------
+    # |  Public Types
+    DEFAULT_MAX_MEMORY_SIZE                 = 16 * 1024 * 1024
+    DEFAULT_READ_CHUNK_SIZE                 = 1024 * 1024
+
+    # ----------------------------------------------------------------------
+    # |  Public Methods
+    def __init__(
+        self,
+        max_memory_size: int=DEFAULT_MAX_MEMORY_SIZE,
+        max_lines: Optional[int]=None,
+        max_bytes: Optional[int]=None,
+    ):
+        # SpooledTemporaryFile never rolls over when `max_size` is 0
+        if max_memory_size == 0:
+            self._file                      = tempfile.TemporaryFile(
+                mode="w+",
+                encoding="utf-8",
+                newline="",
+            )
+        else:
+            self._file                      = tempfile.SpooledTemporaryFile(
+                max_size=max_memory_size,
+                mode="w+",
+                encoding="utf-8",
+                newline="",
+            )
+
+        self._is_truncating                 = max_lines is not None or max_bytes is not None
+
+        if max_lines is None:
+            max_lines = sys.maxsize
+        if max_bytes is None:
+            max_bytes = sys.maxsize
+
+        self._head_max_lines                = (max_lines + 1) // 2
+        self._head_max_bytes                = (max_bytes + 1) // 2
+        self._tail_max_lines                = max_lines // 2
+        self._tail_max_bytes                = max_bytes // 2
+
+        self._head_lines                    = 0
+        self._head_bytes                    = 0
+        self._is_head_complete              = False
+
+        self._tail: Deque[str]              = deque()
+        self._tail_bytes                    = 0
+
+        self._omitted_lines                 = 0
+
+        # Content that hasn't been terminated by a newline; it is counted as a line in the head
+        # or tail (whichever it will be written to) so that the limits apply to it as well.
+        self._pending: List[str]            = []
+        self._pending_bytes                 = 0
+        self._is_pending_omitted            = False
+
+    # ----------------------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    # ----------------------------------------------------------------------
+    def __exit__(self, *args):
+        self.close()
+
+    # ----------------------------------------------------------------------
+    def write(
+        self,
+        content: str,
+    ) -> int:
+        if not self._is_truncating:
+            return self._file.write(content)
+
+        result = len(content)
+
+        # Only the new content is searched, as the pending content doesn't contain a newline
+        index = content.rfind("\n") + 1
+
+        if index:
+            lines = content[:index]
+            content = content[index:]
+
+            if self._is_pending_omitted:
+                # The beginning of the line was omitted, so the rest of it is omitted as well
+                lines = lines[lines.index("\n") + 1:]
+
+                self._omitted_lines += 1
+                self._is_pending_omitted = False
+
+            elif self._pending:
+                self._pending.append(lines)
+                lines = "".join(self._pending)
+
+                self._pending = []
+                self._pending_bytes = 0
+
+            if lines and not self._is_head_complete:
+                lines = self._WriteHead(lines)
+
+            if lines:
+                self._WriteTail(lines)
+
+        if content and not self._is_pending_omitted:
+            self._pending.append(content)
+            self._pending_bytes += _GetSize(content)
+
+            self._LimitPending()
+
+        return result
+
+    # ----------------------------------------------------------------------
+    def flush(self) -> None:
+        self._file.flush()
+
+    # ----------------------------------------------------------------------
+    def isatty(self) -> bool:
+        return False
+
+    # ----------------------------------------------------------------------
+    def close(self) -> None:
+        self._file.close()
+
+    # ----------------------------------------------------------------------
+    def Read(
+        self,
+        chunk_size: int=DEFAULT_READ_CHUNK_SIZE,
+    ) -> Iterator[str]:
+        """Yields the captured content in chunks"""
+
+        self._file.flush()
+        self._file.seek(0)
+
+        while True:
+            chunk = self._file.read(chunk_size)
+            if not chunk:
+                break
+
+            yield chunk
+
+        omitted_lines = self._omitted_lines + (1 if self._is_pending_omitted else 0)
+
+        if omitted_lines:
+            # Reset any styles that were active at the end of the head so that they don't
+            # apply to the marker.
+            yield "\033[0m... {:,} line{} omitted ...\n".format(
+                omitted_lines,
+                "" if omitted_lines == 1 else "s",
+            )
+
+        yield from self._tail
+        yield from self._pending
+
+    # ----------------------------------------------------------------------
+    def GetValue(self) -> str:
+        """Returns all of the captured content"""
+
+        return "".join(self.Read())
+
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    def _WriteHead(
+        self,
+        content: str,
+    ) -> str:
+        """Writes lines until the head is full, returning the content that was not written"""
+
+        num_lines = content.count("\n")
+        num_bytes = _GetSize(content)
+
+        if (
+            self._head_lines + num_lines <= self._head_max_lines
+            and self._head_bytes + num_bytes <= self._head_max_bytes
+        ):
+            self._file.write(content)
+
+            self._head_lines += num_lines
+            self._head_bytes += num_bytes
+
+            return ""
+
+        offset = 0
+
+        while offset < len(content):
+            index = content.index("\n", offset) + 1
+            line_bytes = _GetSize(content[offset:index])
+
+            if (
+                self._head_lines == self._head_max_lines
+                or self._head_bytes + line_bytes > self._head_max_bytes
+            ):
+                break
+
+            self._head_lines += 1
+            self._head_bytes += line_bytes
+
+            offset = index
+
+        self._file.write(content[:offset])
+        self._is_head_complete = True
+
+        return content[offset:]
+
+    # ----------------------------------------------------------------------
+    def _WriteTail(
+        self,
+        content: str,
+    ) -> None:
+        lines = content.split("\n")
+
+        # The content ends with a newline, so the last item is empty
+        for line in lines[:-1]:
+            line += "\n"
+
+            self._tail.append(line)
+            self._tail_bytes += _GetSize(line)
+
+            while self._tail and (
+                len(self._tail) > self._tail_max_lines
+                or self._tail_bytes > self._tail_max_bytes
+            ):
+                self._tail_bytes -= _GetSize(self._tail.popleft())
+                self._omitted_lines += 1
+
+    # ----------------------------------------------------------------------
+    def _LimitPending(self) -> None:
+        """Makes room for the pending content, omitting it if it can't be retained"""
+
+        if not self._is_head_complete:
+            if (
+                self._head_lines < self._head_max_lines
+                and self._head_bytes + self._pending_bytes <= self._head_max_bytes
+            ):
+                return
+
+            # The line will be written to the tail (or omitted) once it is complete
+            if self._tail_max_lines and self._pending_bytes <= self._tail_max_bytes:
+                return
+
+            self._is_head_complete = True
+
+        if self._tail_max_lines and self._pending_bytes <= self._tail_max_bytes:
+            while self._tail and (
+                len(self._tail) + 1 > self._tail_max_lines
+                or self._tail_bytes + self._pending_bytes > self._tail_max_bytes
+            ):
+                self._tail_bytes -= _GetSize(self._tail.popleft())
+                self._omitted_lines += 1
+
+            return
+
+        # The line is too large to retain, so it is omitted along with the lines that precede it
+        # in the tail (as the omitted lines must be contiguous).
+        self._omitted_lines += len(self._tail)
+
+        self._tail.clear()
+        self._tail_bytes = 0
+
+        self._pending = []
+        self._pending_bytes = 0
+        self._is_pending_omitted = True
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+def _GetSize(
+    content: str,
+) -> int:
+    return len(content) if content.isascii() else len(content.encode("utf-8"))
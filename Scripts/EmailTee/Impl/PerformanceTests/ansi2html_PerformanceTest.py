@@ -0,0 +1,241 @@
+# ----------------------------------------------------------------------
+# |
+# |  ansi2html_PerformanceTest.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-20 10:02:37
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""\
+Measures the throughput of the single-pass ansi2html tokenizer against the multi-pass tokenizer
+that it replaced.
+
+Usage:
+    python ansi2html_PerformanceTest.py [<size in MB>] [<iterations>]
+"""
+
+import random
+import re
+import sys
+import time
+
+from pathlib import Path
+from typing import Callable, Iterator, List, Set, Union
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+try:
+    from ansi2html.converter import Ansi2HTMLConverter, CursorMoveUp, OSC_Link, map_vt100_box_code
+    from ansi2html.converter import _State  # pylint: disable=protected-access
+finally:
+    sys.path.pop(0)
+
+
+# ----------------------------------------------------------------------
+# |
+# |  Public Functions
+# |
+# ----------------------------------------------------------------------
+def Main(
+    size_mb: float=8.0,
+    iterations: int=5,
+) -> None:
+    for description, content in [
+        ("Build log", _CreateBuildLog(size_mb, sgr_lines=0.0)),
+        ("Colored build log", _CreateBuildLog(size_mb, sgr_lines=0.12)),
+    ]:
+        single_pass = Ansi2HTMLConverter()
+        multi_pass = _MultiPassConverter()
+
+        assert single_pass.convert(content, full=False) == multi_pass.convert(content, full=False), description
+
+        sys.stdout.write("{} ({:.1f} MB):\n".format(description, len(content) / 1e6))
+
+        multi_pass_seconds = _Measure(lambda: multi_pass.convert(content, full=False), iterations)
+        single_pass_seconds = _Measure(lambda: single_pass.convert(content, full=False), iterations)
+
+        for name, seconds in [
+            ("multi-pass", multi_pass_seconds),
+            ("single-pass", single_pass_seconds),
+        ]:
+            sys.stdout.write(
+                "    {:<12} {:7.3f}s {:8.1f} MB/s\n".format(
+                    name,
+                    seconds,
+                    len(content) / 1e6 / seconds,
+                ),
+            )
+
+        sys.stdout.write("    speedup      {:7.2f}x\n\n".format(multi_pass_seconds / single_pass_seconds))
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+class _MultiPassConverter(Ansi2HTMLConverter):
+    """\
+    Tokenizes the input the way that the converter did before it used a single scan: HTML
+    special characters, box drawing characters, OSC 8 links, and CSI sequences are each handled in
+    a separate pass over the input. Only the tokenizer differs; CSI sequences and spans are
+    handled by the base class.
+    """
+
+    _box_codes_regex                        = re.compile("\033\\(([B0])")
+    _osc_link_regex                         = re.compile("\033\\]8;;(.*?)\007(.*?)\033\\]8;;\007")
+    _csi_regex                              = re.compile("\033\\[([\\d;:]*)([a-zA-Z])")
+
+    # ----------------------------------------------------------------------
+    def _apply_regex(
+        self,
+        ansi: str,
+        styles_used: Set[str],
+        state: _State,
+    ) -> Iterator[Union[str, OSC_Link, CursorMoveUp]]:
+        if self.escaped and not self.latex:
+            ansi = ansi.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+        # ----------------------------------------------------------------------
+        def BoxDrawing() -> Iterator[str]:
+            last_end = 0
+
+            for match in self._box_codes_regex.finditer(ansi):
+                text = ansi[last_end:match.start()]
+
+                if state.box_drawing_mode:
+                    yield "".join(map_vt100_box_code(char) for char in text)
+                else:
+                    yield text
+
+                last_end = match.end()
+                state.box_drawing_mode = match.group(1) == "0"
+
+            text = ansi[last_end:]
+
+            if state.box_drawing_mode:
+                yield "".join(map_vt100_box_code(char) for char in text)
+            else:
+                yield text
+
+        # ----------------------------------------------------------------------
+
+        ansi = "".join(BoxDrawing())
+
+        last_end = 0
+
+        for match in self._osc_link_regex.finditer(ansi):
+            yield from self._ApplyCsiRegex(ansi[last_end:match.start()], styles_used, state)
+
+            if state.sgr is not state.span_sgr:
+                markup = self._update_span(state, styles_used)
+                if markup:
+                    yield markup
+
+            yield OSC_Link(match.group(1), match.group(2))
+            last_end = match.end()
+
+        yield from self._ApplyCsiRegex(ansi[last_end:], styles_used, state)
+
+    # ----------------------------------------------------------------------
+    def _ApplyCsiRegex(
+        self,
+        ansi: str,
+        styles_used: Set[str],
+        state: _State,
+    ) -> Iterator[Union[str, CursorMoveUp]]:
+        last_end = 0
+
+        for match in self._csi_regex.finditer(ansi):
+            yield from self._ApplyText(ansi[last_end:match.start()], styles_used, state)
+            yield from self._handle_ansi_code(match.group(1), match.group(2), state)
+
+            last_end = match.end()
+
+        yield from self._ApplyText(ansi[last_end:], styles_used, state)
+
+    # ----------------------------------------------------------------------
+    def _ApplyText(
+        self,
+        text: str,
+        styles_used: Set[str],
+        state: _State,
+    ) -> Iterator[str]:
+        if not text:
+            return
+
+        if state.sgr is not state.span_sgr:
+            markup = self._update_span(state, styles_used)
+            if markup:
+                yield markup
+
+        yield text
+
+
+# ----------------------------------------------------------------------
+def _CreateBuildLog(
+    size_mb: float,
+    sgr_lines: float,
+) -> str:
+    rng = random.Random(0)
+
+    lines: List[str] = []
+    size = 0
+    index = 0
+
+    while size < size_mb * 1e6:
+        value = rng.random()
+
+        if value < sgr_lines / 2:
+            line = "\033[32m[PASS]\033[0m test_{} ({:.2f}s)".format(index, rng.random())
+        elif value < sgr_lines:
+            line = "\033[1;31merror:\033[0m src/file_{}.cpp:{}: expected '>' before '&' token".format(index, index)
+        elif value < sgr_lines + 0.02:
+            line = "\033(0lqqqqqqqqqqqqqqqqk\033(B see \033]8;;https://example.com/build/{}\007build {}\033]8;;\007".format(index, index)
+        else:
+            line = "  compiling src/module_{}/file_{}.cpp -> obj/file_{}.o [{}/{}] (std::vector<T> && other)".format(
+                index % 50,
+                index,
+                index,
+                index,
+                index + 1000,
+            )
+
+        lines.append(line)
+        size += len(line) + 1
+        index += 1
+
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------------------------------------------------
+def _Measure(
+    func: Callable[[], object],
+    iterations: int,
+) -> float:
+    best = None
+
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+
+        if best is None or seconds < best:
+            best = seconds
+
+    assert best is not None
+    return best
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+if __name__ == "__main__":
+    Main(
+        float(sys.argv[1]) if len(sys.argv) > 1 else 8.0,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+    )
@@ -0,0 +1,635 @@
+# ----------------------------------------------------------------------
+# |
+# |  RedrawResolver.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-15 16:07:44
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Contains the RedrawResolver object"""
+
+import re
+
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# ----------------------------------------------------------------------
+class RedrawResolver(object):
+    """\
+    Resolves the sequences that terminal applications use to redraw output (carriage returns,
+    erase line, and cursor movement) into the text that would be visible once the output
+    was written to a terminal. Progress bars and spinners are reduced to their final frame.
+
+    Lines are held while the cursor is within `max_history_lines` of them, as they may still
+    be redrawn.
+    """
+
+    # ----------------------------------------------------------------------
+    # |  Public Types
+    DEFAULT_MAX_HISTORY_LINES               = 256
+
+    # ----------------------------------------------------------------------
+    # |  Public Methods
+    def __init__(
+        self,
+        max_history_lines: int=DEFAULT_MAX_HISTORY_LINES,
+    ):
+        self._max_history_lines             = max_history_lines
+
+        self._lines: List[_Line]            = [_Line()]
+        self._row                           = 0
+        self._column                        = 0
+        self._pen                           = _DEFAULT_PEN
+
+        # Zero-width sequences (hyperlinks, character sets) that precede the next character
+        self._prefix                        = ""
+
+        # Pen at the end of the content that has been returned
+        self._output_pen                    = _DEFAULT_PEN
+        self._output: List[str]             = []
+
+        # Content that hasn't been terminated by a newline
+        self._pending: List[str]            = []
+        self._pending_size                  = 0
+
+        # True if the content processed so far ends with a newline
+        self._is_terminated                 = False
+
+    # ----------------------------------------------------------------------
+    def Feed(
+        self,
+        content: str,
+    ) -> str:
+        """Processes the content, returning the lines that can no longer be redrawn"""
+
+        # Only the new content is searched, as the pending content doesn't contain a newline
+        index = content.rfind("\n") + 1
+
+        if index:
+            self._pending.append(content[:index])
+            self._Process("".join(self._pending))
+
+            self._pending = [content[index:]] if index != len(content) else []
+            self._pending_size = len(content) - index
+            self._is_terminated = not self._pending
+
+        elif content:
+            self._pending.append(content)
+            self._pending_size += len(content)
+
+            # A line that is redrawn many times (for example, by a progress bar) can be very long,
+            # so it is processed rather than held indefinitely.
+            if self._pending_size >= _max_pending_size:
+                self._ProcessPending()
+
+        return self._GetOutput()
+
+    # ----------------------------------------------------------------------
+    def Finish(self) -> str:
+        """Returns the remaining content"""
+
+        if self._pending:
+            self._Process("".join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+            self._is_terminated = False
+
+        # The cursor may have been moved up from the end of the content, in which case the last
+        # line isn't empty; the line terminator is added so that it isn't lost.
+        if self._is_terminated and not self._lines[-1].IsEmpty():
+            self._lines.append(_Line())
+
+        self._Release(len(self._lines), is_final=True)
+
+        return self._GetOutput()
+
+    # ----------------------------------------------------------------------
+    def Resolve(
+        self,
+        chunks: Iterable[str],
+    ) -> Iterator[str]:
+        """Yields the resolved content of all of the chunks"""
+
+        for chunk in chunks:
+            result = self.Feed(chunk)
+            if result:
+                yield result
+
+        result = self.Finish()
+        if result:
+            yield result
+
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    # ----------------------------------------------------------------------
+    def _Process(
+        self,
+        content: str,
+    ) -> None:
+        if (
+            self._row == len(self._lines) - 1
+            and content.count("\r") == content.count("\r\n")
+            and not _csi_regex.search(content)
+        ):
+            # The content doesn't redraw itself (it doesn't contain carriage returns that
+            # aren't part of a line ending or CSI sequences other than SGR), so only the
+            # lines at its end need to be processed (as they may be redrawn by subsequent
+            # content).
+            first_index = content.find("\n") + 1
+            last_index = len(content)
+
+            for _ in range(self._max_history_lines + 1):
+                last_index = content.rfind("\n", 0, last_index)
+                if last_index == -1:
+                    break
+
+            last_index += 1
+
+            if first_index and first_index < last_index:
+                self._ProcessLines(content[:first_index])
+                self._Release(len(self._lines) - 1, is_final=False)
+
+                lines = content[first_index:last_index]
+
+                if self._pen != self._output_pen:
+                    self._output.append(_GetTransition(self._output_pen, self._pen))
+
+                self._output.append(lines)
+
+                for match in _sgr_regex.finditer(lines):
+                    self._pen = _ApplySgr(self._pen, match.group(1))
+
+                link_index = lines.rfind("\033]8;;")
+                if link_index != -1:
+                    match = _link_regex.match(lines, link_index)
+                    if match:
+                        self._pen = self._pen[:_LINK_INDEX] + (match.group(1),)
+
+                self._output_pen = self._pen
+
+                content = content[last_index:]
+
+        self._ProcessLines(content)
+
+    # ----------------------------------------------------------------------
+    def _ProcessPending(self) -> None:
+        """Processes the pending content, except for an escape sequence at its end that may be incomplete"""
+
+        content = "".join(self._pending)
+
+        # Escape sequences are short, so only the end of the content is searched
+        index = content.find("\033", max(0, len(content) - 4096))
+
+        while index != -1:
+            match = _control_regex.match(content, index)
+            if match is None:
+                break
+
+            index = content.find("\033", match.end())
+
+        if index == -1:
+            index = len(content)
+
+        self._pending = [content[index:]] if index != len(content) else []
+        self._pending_size = len(content) - index
+
+        if index:
+            self._Process(content[:index])
+            self._is_terminated = False
+
+    # ----------------------------------------------------------------------
+    def _ProcessLines(
+        self,
+        content: str,
+    ) -> None:
+        for index, line in enumerate(content.split("\n")):
+            if index:
+                self._NewLine()
+
+            if not line:
+                continue
+
+            if "\033" not in line and "\r" not in line:
+                self._WriteText(line)
+                continue
+
+            last_end = 0
+
+            for match in _control_regex.finditer(line):
+                if match.start() != last_end:
+                    self._WriteText(line[last_end:match.start()])
+
+                last_end = match.end()
+
+                command = match.group(2)
+
+                if command is None:
+                    if match.group(0) == "\r":
+                        self._column = 0
+                    elif match.group(3) is not None:
+                        self._pen = self._pen[:_LINK_INDEX] + (match.group(3),)
+                    else:
+                        self._prefix += match.group(0)
+
+                elif command == "m":
+                    self._pen = _ApplySgr(self._pen, match.group(1))
+                elif command == "K":
+                    self._EraseLine(match.group(1))
+                elif command in "ABCDEFG":
+                    self._MoveCursor(command, match.group(1))
+
+                # Other sequences don't produce output, so they are removed
+
+            if last_end != len(line):
+                self._WriteText(line[last_end:])
+
+    # ----------------------------------------------------------------------
+    def _WriteText(
+        self,
+        text: str,
+    ) -> None:
+        line = self._lines[self._row]
+
+        if line.cells is None:
+            if self._column == line.width:
+                line.runs.append((self._pen, self._prefix, text))
+                line.width += len(text)
+
+                self._prefix = ""
+                self._column = line.width
+
+                return
+
+            line.ToCells()
+            assert line.cells is not None
+
+        if self._column > len(line.cells):
+            line.cells += [(_DEFAULT_PEN, " ")] * (self._column - len(line.cells))
+
+        cells = [(self._pen, char) for char in text]
+
+        if self._prefix:
+            cells[0] = (self._pen, self._prefix + text[0])
+            self._prefix = ""
+
+        line.cells[self._column:self._column + len(cells)] = cells
+
+        self._column += len(cells)
+
+    # ----------------------------------------------------------------------
+    def _NewLine(self) -> None:
+        if self._prefix:
+            self._lines[self._row].Append(self._pen, self._prefix)
+            self._prefix = ""
+
+        self._row += 1
+        self._column = 0
+
+        if self._row == len(self._lines):
+            self._lines.append(_Line())
+
+        # Lines are released in batches rather than one at a time
+        if self._row > 2 * self._max_history_lines:
+            self._Release(self._row - self._max_history_lines, is_final=False)
+
+    # ----------------------------------------------------------------------
+    def _EraseLine(
+        self,
+        params: str,
+    ) -> None:
+        line = self._lines[self._row]
+
+        if params in ("", "0"):
+            if self._column == 0:
+                line.Clear()
+            else:
+                line.ToCells()
+                assert line.cells is not None
+
+                del line.cells[self._column:]
+
+        elif params == "1":
+            line.ToCells()
+            assert line.cells is not None
+
+            num_cells = min(self._column + 1, len(line.cells))
+            line.cells[:num_cells] = [(_DEFAULT_PEN, " ")] * num_cells
+
+        elif params == "2":
+            line.Clear()
+
+    # ----------------------------------------------------------------------
+    def _MoveCursor(
+        self,
+        command: str,
+        params: str,
+    ) -> None:
+        try:
+            value = max(int(params or "1"), 1)
+        except ValueError:
+            return
+
+        if command == "C":
+            self._column += value
+            return
+
+        if command == "D":
+            self._column = max(self._column - value, 0)
+            return
+
+        if command == "G":
+            self._column = value - 1
+            return
+
+        if command in "AF":
+            # Lines that have been released can't be redrawn
+            self._row = max(self._row - value, 0)
+        else:
+            # The cursor doesn't move beyond the last line
+            self._row = min(self._row + value, len(self._lines) - 1)
+
+        if command in "EF":
+            self._column = 0
+
+    # ----------------------------------------------------------------------
+    def _Release(
+        self,
+        num_lines: int,
+        *,
+        is_final: bool,
+    ) -> None:
+        for index, line in enumerate(self._lines[:num_lines]):
+            if index:
+                self._EndOutputLink()
+                self._output.append("\n")
+
+            for pen, content in line.Enumerate():
+                if pen != self._output_pen:
+                    self._output.append(_GetTransition(self._output_pen, pen))
+                    self._output_pen = pen
+
+                self._output.append(content)
+
+        self._EndOutputLink()
+
+        if not is_final:
+            # The line that follows the released lines remains
+            self._output.append("\n")
+
+        del self._lines[:num_lines]
+        self._row -= num_lines
+
+        if not self._lines:
+            self._lines.append(_Line())
+            self._row = 0
+            self._column = 0
+
+    # ----------------------------------------------------------------------
+    def _EndOutputLink(self) -> None:
+        """Ends the hyperlink in the output at the end of a line (it is begun again on the next line if necessary), as the converter only recognizes hyperlinks within a line"""
+
+        if not self._output_pen[_LINK_INDEX]:
+            return
+
+        pen = self._output_pen[:_LINK_INDEX] + ("",)
+
+        self._output.append(_GetTransition(self._output_pen, pen))
+        self._output_pen = pen
+
+    # ----------------------------------------------------------------------
+    def _GetOutput(self) -> str:
+        result = "".join(self._output)
+        self._output = []
+
+        return result
+
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# Attributes set by SGR codes, where each attribute is the SGR parameter(s) that set it or an
+# empty string when the attribute has its default value, followed by the url of the active
+# hyperlink (or an empty string when there isn't one).
+_Pen                                        = Tuple[str, ...]
+
+_LINK_INDEX                                 = 9
+_DEFAULT_PEN: _Pen                          = ("",) * (_LINK_INDEX + 1)
+
+
+# ----------------------------------------------------------------------
+def _CreateSgrAttributes() -> Dict[int, int]:
+    """Maps each SGR code to the index of the pen attribute that it sets"""
+
+    attributes: Dict[int, int] = {}
+
+    for index, codes in enumerate(
+        [
+            [1, 2, 22],                                         # intensity
+            [3, 23],                                            # italic
+            [4, 24],                                            # underline
+            [5, 6, 25],                                         # blink
+            [7, 27],                                            # negative
+            [8, 28],                                            # conceal
+            [9, 29],                                            # crossed out
+            [*range(30, 40), *range(90, 98)],                   # foreground
+            [*range(40, 50), *range(100, 108)],                 # background
+        ],
+    ):
+        for code in codes:
+            attributes[code] = index
+
+    return attributes
+
+
+_sgr_attributes                             = _CreateSgrAttributes()
+_sgr_default_codes                          = set([22, 23, 24, 25, 27, 28, 29, 39, 49])
+
+# CSI sequences other than SGR
+_csi_regex                                  = re.compile(r"\033\[(?![\d;:]*m)")
+
+_sgr_regex                                  = re.compile(r"\033\[([\d;:]*)m")
+
+# Content that doesn't contain a newline is processed once this much is pending
+_max_pending_size                           = 1024 * 1024
+
+# OSC 8 sequences that begin a hyperlink (group 1 is the url) or end it (the url is empty)
+_link_regex                                 = re.compile(r"\033\]8;;([^\007]*)\007")
+
+# Carriage returns, CSI sequences (group 1 is the parameters and group 2 the command), OSC 8
+# hyperlink sequences (group 3 is the url), and character sets (which are zero-width sequences
+# that are passed to the converter). The text of a hyperlink is written to cells like any other
+# text, with the hyperlink as an attribute of the pen.
+_control_regex                              = re.compile(
+    r"\r|\033\[([\d;:?]*)([A-Za-z])|\033\]8;;([^\007]*)\007|\033\([B0]",
+)
+
+
+# ----------------------------------------------------------------------
+class _Line(object):
+    """\
+    Line of output. Lines are stored as runs of text as they are written, and are converted
+    to individual cells when they are redrawn.
+    """
+
+    __slots__ = ("runs", "width", "cells", "suffix")
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        # (pen, zero-width prefix, text)
+        self.runs: List[Tuple[_Pen, str, str]]    = []
+        self.width                          = 0
+
+        # (pen, zero-width prefix + character)
+        self.cells: Optional[List[Tuple[_Pen, str]]]    = None
+
+        # Zero-width sequences that follow the last cell
+        self.suffix                         = ""
+
+    # ----------------------------------------------------------------------
+    def Append(
+        self,
+        pen: _Pen,
+        prefix: str,
+    ) -> None:
+        """Appends zero-width sequences to the end of the line"""
+
+        if self.cells is None:
+            self.runs.append((pen, prefix, ""))
+        else:
+            self.suffix += prefix
+
+    # ----------------------------------------------------------------------
+    def IsEmpty(self) -> bool:
+        return not self.runs and not self.cells and not self.suffix
+
+    # ----------------------------------------------------------------------
+    def Clear(self) -> None:
+        self.runs = []
+        self.width = 0
+        self.cells = None
+        self.suffix = ""
+
+    # ----------------------------------------------------------------------
+    def ToCells(self) -> None:
+        if self.cells is not None:
+            return
+
+        cells: List[Tuple[_Pen, str]] = []
+        prefix = ""
+
+        for pen, run_prefix, text in self.runs:
+            prefix += run_prefix
+
+            if not text:
+                continue
+
+            cells.append((pen, prefix + text[0]))
+            cells += [(pen, char) for char in text[1:]]
+
+            prefix = ""
+
+        self.runs = []
+        self.cells = cells
+        self.suffix = prefix
+
+    # ----------------------------------------------------------------------
+    def Enumerate(self) -> Iterator[Tuple[_Pen, str]]:
+        """Yields the pen and content of each part of the line"""
+
+        if self.cells is None:
+            for pen, prefix, text in self.runs:
+                yield pen, (prefix + text) if prefix else text
+        else:
+            yield from self.cells
+
+            if self.suffix:
+                yield (self.cells[-1][0] if self.cells else _DEFAULT_PEN), self.suffix
+
+
+# ----------------------------------------------------------------------
+@lru_cache(maxsize=4096)
+def _ApplySgr(
+    pen: _Pen,
+    params: str,
+) -> _Pen:
+    """Returns the pen that results from applying the SGR parameters"""
+
+    values = list(pen)
+
+    items = params.split(";")
+    index = 0
+
+    while index < len(items):
+        item = items[index]
+        index += 1
+
+        try:
+            code = int(item.partition(":")[0] or "0")
+        except ValueError:
+            continue
+
+        if code == 0:
+            values[:_LINK_INDEX] = _DEFAULT_PEN[:_LINK_INDEX]
+            continue
+
+        attribute = _sgr_attributes.get(code)
+        if attribute is None:
+            continue
+
+        if code in (38, 48) and ":" not in item:
+            # 256 color (5;<index>) or truecolor (2;<r>;<g>;<b>)
+            if index < len(items) and items[index] == "5":
+                num_items = 2
+            elif index < len(items) and items[index] == "2":
+                num_items = 4
+            else:
+                num_items = 0
+
+            item = ";".join(items[index - 1:index + num_items])
+            index += num_items
+
+        values[attribute] = "" if code in _sgr_default_codes else item
+
+    return tuple(values)
+
+
+# ----------------------------------------------------------------------
+@lru_cache(maxsize=4096)
+def _GetTransition(
+    current_pen: _Pen,
+    pen: _Pen,
+) -> str:
+    """Returns the SGR and OSC 8 sequences that change the current pen to the pen"""
+
+    link = pen[_LINK_INDEX]
+    current_link = current_pen[_LINK_INDEX]
+
+    result: List[str] = []
+
+    # The current hyperlink is ended before the SGR sequence and the new one begun after it,
+    # so that the SGR sequence isn't part of the hyperlink's text.
+    if current_link and link != current_link:
+        result.append("\033]8;;\007")
+
+    if pen[:_LINK_INDEX] != current_pen[:_LINK_INDEX]:
+        params = ";".join(value for value in pen[:_LINK_INDEX] if value)
+
+        if not params:
+            result.append("\033[0m")
+        elif current_pen[:_LINK_INDEX] == _DEFAULT_PEN[:_LINK_INDEX]:
+            result.append("\033[{}m".format(params))
+        else:
+            result.append("\033[0;{}m".format(params))
+
+    if link and link != current_link:
+        result.append("\033]8;;{}\007".format(link))
+
+    return "".join(result)
@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------
+# |
+# |  OutputCapture_UnitTest.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-20 12:18:43
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Unit tests for OutputCapture.py"""
+
+import sys
+
+from pathlib import Path
+from typing import List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+try:
+    from OutputCapture import OutputCapture
+finally:
+    sys.path.pop(0)
+
+
+# ----------------------------------------------------------------------
+_lines                                      = ["line {}\n".format(index) for index in range(10)]
+
+
+# ----------------------------------------------------------------------
+def _Capture(
+    content: List[str],
+    max_memory_size: int=OutputCapture.DEFAULT_MAX_MEMORY_SIZE,
+    max_lines: Optional[int]=None,
+    max_bytes: Optional[int]=None,
+) -> str:
+    with OutputCapture(max_memory_size, max_lines, max_bytes) as capture:
+        for item in content:
+            capture.write(item)
+
+        return capture.GetValue()
+
+
+# ----------------------------------------------------------------------
+def test_NoLimits():
+    content = "".join(_lines) + "last"
+
+    assert _Capture(_lines + ["last"]) == content
+    assert _Capture(_lines + ["last"], max_memory_size=5) == content
+    assert _Capture(_lines + ["last"], max_memory_size=0) == content
+
+
+# ----------------------------------------------------------------------
+def test_WithinLimits():
+    assert _Capture(_lines, max_lines=10, max_bytes=70) == "".join(_lines)
+
+
+# ----------------------------------------------------------------------
+def test_MaxLines():
+    expected = "line 0\nline 1\n\033[0m... 6 lines omitted ...\nline 8\nline 9\n"
+
+    assert _Capture(_lines, max_lines=4) == expected
+    assert _Capture(["".join(_lines)], max_lines=4) == expected
+
+    assert _Capture(_lines[:5], max_lines=4) == "line 0\nline 1\n\033[0m... 1 line omitted ...\nline 3\nline 4\n"
+
+
+# ----------------------------------------------------------------------
+def test_MaxBytes():
+    # Each line is 7 bytes; half of the limit is available to the head and half to the tail
+    assert _Capture(_lines, max_bytes=28) == "line 0\nline 1\n\033[0m... 6 lines omitted ...\nline 8\nline 9\n"
+
+    # Limits are based on the size of the utf-8 encoded content
+    assert _Capture(["é\n"] * 6, max_bytes=6) == "é\n\033[0m... 4 lines omitted ...\né\n"
+
+
+# ----------------------------------------------------------------------
+def test_UnterminatedLastLine():
+    expected = "line 0\nline 1\n\033[0m... 7 lines omitted ...\nline 9\nlast"
+
+    assert _Capture(_lines + ["last"], max_lines=4) == expected
+    assert _Capture(["".join(_lines) + "la", "st"], max_lines=4) == expected
+
+    assert _Capture(["line 0\n", "last"], max_lines=4) == "line 0\nlast"
+
+
+# ----------------------------------------------------------------------
+def test_LinesWrittenInPieces():
+    assert _Capture(["li", "ne 0\nli", "ne 1\nline 2", "\nline 3\n"], max_lines=2) == "line 0\n\033[0m... 2 lines omitted ...\nline 3\n"
+
+
+# ----------------------------------------------------------------------
+def test_LargeUnterminatedLine():
+    # A line that is too large for the tail is omitted, even when it isn't terminated
+    assert _Capture(_lines[:3] + ["x" * 100], max_lines=4, max_bytes=40) == "line 0\nline 1\n\033[0m... 2 lines omitted ...\n"
+
+    # The rest of the omitted line is omitted once it is terminated
+    assert _Capture(
+        _lines[:3] + ["x" * 100, "yy\nline a\n", "line b\n"],
+        max_lines=4,
+        max_bytes=40,
+    ) == "line 0\nline 1\n\033[0m... 2 lines omitted ...\nline a\nline b\n"
@@ -0,0 +1,135 @@
+# ----------------------------------------------------------------------
+# |
+# |  RedrawResolver_UnitTest.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-20 13:06:19
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Unit tests for RedrawResolver.py"""
+
+import sys
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+try:
+    from RedrawResolver import RedrawResolver
+finally:
+    sys.path.pop(0)
+
+
+# ----------------------------------------------------------------------
+def _Resolve(
+    content: str,
+    max_history_lines: int=RedrawResolver.DEFAULT_MAX_HISTORY_LINES,
+) -> str:
+    result = "".join(RedrawResolver(max_history_lines).Resolve([content]))
+
+    # The result is the same when the content is provided a character at a time
+    assert "".join(RedrawResolver(max_history_lines).Resolve(content)) == result
+
+    return result
+
+
+# ----------------------------------------------------------------------
+def test_NoRedraws():
+    assert _Resolve("") == ""
+    assert _Resolve("one\ntwo\n") == "one\ntwo\n"
+    assert _Resolve("one\ntwo") == "one\ntwo"
+    assert _Resolve("\033[31mred\033[0m plain\n") == "\033[31mred\033[0m plain\n"
+
+
+# ----------------------------------------------------------------------
+def test_CarriageReturn():
+    assert _Resolve("10%\r50%\rdone\n") == "done\n"
+    assert _Resolve("abcdef\rxy\n") == "xycdef\n"
+    assert _Resolve("first\nprogress 10%\rprogress 100%\nlast\n") == "first\nprogress 100%\nlast\n"
+
+    # Carriage returns that are part of a line ending aren't redraws
+    assert _Resolve("one\r\ntwo\r\n") == "one\ntwo\n"
+
+
+# ----------------------------------------------------------------------
+def test_CarriageReturnWithStyles():
+    # Overwritten characters take the style that they were written with
+    assert _Resolve("\033[31mabc\033[0m\rX\n") == "X\033[31mbc\n"
+
+
+# ----------------------------------------------------------------------
+def test_EraseLine():
+    assert _Resolve("abcdef\r\033[Kxy\n") == "xy\n"
+    assert _Resolve("abcdef\033[3D\033[Kx\n") == "abcx\n"
+    assert _Resolve("abcdef\033[3D\033[0Kx\n") == "abcx\n"
+    assert _Resolve("abcdef\033[3D\033[1K\n") == "    ef\n"
+    assert _Resolve("abc\033[2Kxy\n") == "   xy\n"
+
+
+# ----------------------------------------------------------------------
+def test_CursorUp():
+    assert _Resolve("one\ntwo\n\033[1Aup\n") == "one\nupo\n"
+    assert _Resolve("one\ntwo\nthree\n\033[2Aa\033[K\n\n") == "one\na\nthree\n"
+
+    # A cursor up without parameters moves one line
+    assert _Resolve("one\ntwo\n\033[A\033[2Kup\n") == "one\nup\n"
+
+    # Progress that is redrawn in place
+    assert _Resolve(
+        "task 1: 0%\ntask 2: 0%\n\033[2A\033[2Ktask 1: 100%\n\033[2Ktask 2: 100%\n",
+    ) == "task 1: 100%\ntask 2: 100%\n"
+
+
+# ----------------------------------------------------------------------
+def test_CursorUpBeforeFirstLine():
+    assert _Resolve("one\n\033[5Atwo\n") == "two\n"
+
+
+# ----------------------------------------------------------------------
+def test_CursorUpAtEnd():
+    # The line terminator that follows the redrawn line is retained
+    assert _Resolve("one\ntwo\n\033[1Ax") == "one\nxwo\n"
+
+
+# ----------------------------------------------------------------------
+def test_CursorUpBeyondHistory():
+    # Lines that are no longer in the history can't be redrawn, so the cursor stops at the first
+    # line that is still held
+    content = "".join("line {}\n".format(index) for index in range(10)) + "\033[9A\033[2KX\n"
+
+    assert _Resolve(content, max_history_lines=2) == "line 0\nline 1\nline 2\nline 3\nline 4\nline 5\nX\nline 7\nline 8\nline 9\n"
+    assert _Resolve(content) == "line 0\nX\nline 2\nline 3\nline 4\nline 5\nline 6\nline 7\nline 8\nline 9\n"
+
+
+# ----------------------------------------------------------------------
+def test_CursorColumn():
+    assert _Resolve("a\033[5Gb\n") == "a   b\n"
+    assert _Resolve("abc\033[2Cd\n") == "abc  d\n"
+    assert _Resolve("abc\033[2Dd\n") == "adc\n"
+
+
+# ----------------------------------------------------------------------
+def test_Hyperlinks():
+    assert _Resolve("see \033]8;;http://a\007Link\033]8;;\007 here\n") == "see \033]8;;http://a\007Link\033]8;;\007 here\n"
+
+    # The text of a hyperlink occupies cells like any other text
+    assert _Resolve("\033]8;;http://a\007L\033]8;;\007 x\rY\n") == "Y x\n"
+    assert _Resolve("\033]8;;http://a\007Link\033]8;;\007 x\rY\n") == "Y\033]8;;http://a\007ink\033]8;;\007 x\n"
+    assert _Resolve("abc\033]8;;http://a\007Link\033]8;;\007\rX\n") == "Xbc\033]8;;http://a\007Link\033]8;;\007\n"
+
+    # Hyperlinks are ended at the end of each line
+    assert _Resolve("\033]8;;http://a\007one\ntwo\033]8;;\007\rX\n") == (
+        "\033]8;;http://a\007one\033]8;;\007\nX\033]8;;http://a\007wo\033]8;;\007\n"
+    )
+    assert _Resolve("\033]8;;http://a\007unterminated") == "\033]8;;http://a\007unterminated\033]8;;\007"
+
+
+# ----------------------------------------------------------------------
+def test_OtherSequencesRemoved():
+    assert _Resolve("\033[?25lhidden cursor\033[?25h\n") == "hidden cursor\n"
@@ -0,0 +1,181 @@
+# ----------------------------------------------------------------------
+# |
+# |  ansi2html_UnitTest.py
+# |
+# |  David Brownell <db@DavidBrownell.com>
+# |      2023-04-20 09:14:52
+# |
+# ----------------------------------------------------------------------
+# |
+# |  Copyright David Brownell 2023
+# |  Distributed under the Boost Software License, Version 1.0. See
+# |  accompanying file LICENSE_1_0.txt or copy at
+# |  http://www.boost.org/LICENSE_1_0.txt.
+# |
+# ----------------------------------------------------------------------
+"""Unit tests for the vendored ansi2html package"""
+
+import random
+import sys
+
+from pathlib import Path
+from typing import List
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+try:
+    from ansi2html.converter import Ansi2HTMLConverter
+finally:
+    sys.path.pop(0)
+
+
+# ----------------------------------------------------------------------
+def _CreateLog(
+    num_lines: int,
+) -> str:
+    """Creates output with styles that span lines, redraws, box drawing, and links"""
+
+    rng = random.Random(0)
+
+    pieces: List[str] = []
+
+    for index in range(num_lines):
+        value = rng.random()
+
+        if value < 0.1:
+            pieces.append("\033[1;3{}m".format(index % 8))
+        elif value < 0.15:
+            pieces.append("\033[0m")
+        elif value < 0.17:
+            pieces.append("\033[38;5;{}m256 \033[48;2;1;2;{}mtruecolor\033[39;49m ".format(index % 256, index % 256))
+        elif value < 0.19:
+            pieces.append("\033(0lqqk\033(B ")
+        elif value < 0.21:
+            pieces.append("\033]8;;https://example.com/{}\007link\033]8;;\007 ".format(index))
+        elif value < 0.23:
+            pieces.append("10%\r50%\r")
+        elif value < 0.24:
+            pieces.append("overwritten\n\033[1A")
+
+        pieces.append("line {} <&> https://example.com/{}\n".format(index, index))
+
+    return "".join(pieces)
+
+
+# ----------------------------------------------------------------------
+def _Convert(
+    ansi: str,
+) -> str:
+    return Ansi2HTMLConverter().convert(ansi, full=False)
+
+
+# ----------------------------------------------------------------------
+def test_CarriageReturn():
+    assert _Convert("10%\r50%\rdone\n") == "done\n"
+
+
+# ----------------------------------------------------------------------
+def test_WindowsLineEndings():
+    # Windows text-mode output of "\r\n" produces "\r\r\n", which is a line ending rather than
+    # a carriage return that overwrites the line.
+    assert _Convert("hello\r\r\nworld\r\r\n") == "hello\r\r\nworld\r\r\n"
+    assert _Convert("hello\r\nworld\r\n") == "hello\r\nworld\r\n"
+    assert _Convert("10%\r50%\r\r\ndone\n") == "50%\r\r\ndone\n"
+
+
+# ----------------------------------------------------------------------
+def test_FeedAndFinish():
+    content = (
+        "plain <&>\n"
+        "\033[31mred\033[1m bold\nstill\033[0m done\n"
+        "\033(0lqk\033(B\n"
+        "\033]8;;http://example.com\007link\033]8;;\007\n"
+        "10%\r50%\r\r\n"
+        "overwritten\n\033[1Aup\n"
+        "unterminated"
+    )
+
+    expected = Ansi2HTMLConverter().convert(content)
+
+    # The content is split at every pair of positions, including within escape sequences and
+    # line endings
+    converter = Ansi2HTMLConverter()
+
+    for first in range(len(content) + 1):
+        for second in range(first, len(content) + 1):
+            body = (
+                converter.feed(content[:first])
+                + converter.feed(content[first:second])
+                + converter.feed(content[second:])
+                + converter.finish()
+            )
+
+            assert converter.produce_document(body) == expected, (first, second)
+
+
+# ----------------------------------------------------------------------
+def test_FinishWithoutFeed():
+    converter = Ansi2HTMLConverter()
+
+    assert converter.produce_document(converter.finish()) == Ansi2HTMLConverter().convert("")
+
+
+# ----------------------------------------------------------------------
+def test_FinishTrailingNewline():
+    converter = Ansi2HTMLConverter()
+
+    body = converter.feed("first\nsecond") + converter.finish(ensure_trailing_newline=True)
+
+    assert body == Ansi2HTMLConverter().convert("first\nsecond", full=False, ensure_trailing_newline=True)
+    assert body.endswith("second\n")
+
+
+# ----------------------------------------------------------------------
+def test_FeedLongLine():
+    # Very long lines are converted before they are terminated, rather than held as input
+    content = "\033[32m" + "x" * (3 * 1024 * 1024) + "\033[0m\n"
+
+    converter = Ansi2HTMLConverter()
+
+    chunks: List[str] = []
+
+    for index in range(0, len(content) - 1, 65536):
+        chunks.append(converter.feed(content[index:min(index + 65536, len(content) - 1)]))
+
+        assert converter._pending_input_size <= 1024 * 1024  # pylint: disable=protected-access
+
+    chunks.append(converter.feed("\n"))
+    chunks.append(converter.finish())
+
+    assert "".join(chunks) == _Convert(content)
+
+
+# ----------------------------------------------------------------------
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"inline": True},
+        {"linkify": True},
+        {"preserve_spaces": True},
+    ],
+)
+def test_ParallelConvert(options):
+    # The content is large enough to be split into multiple chunks
+    content = _CreateLog(40000)
+
+    assert Ansi2HTMLConverter(**options).convert(content, jobs=4) == Ansi2HTMLConverter(**options).convert(content)
+
+    assert Ansi2HTMLConverter(**options).convert(
+        content,
+        jobs=2,
+        ensure_trailing_newline=True,
+    ) == Ansi2HTMLConverter(**options).convert(content, ensure_trailing_newline=True)
+
+
+# ----------------------------------------------------------------------
+def test_ParallelConvertSmallContent():
+    content = _CreateLog(10)
+
+    assert Ansi2HTMLConverter().convert(content, jobs=4) == Ansi2HTMLConverter().convert(content)
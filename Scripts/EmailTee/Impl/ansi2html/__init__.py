@@ -1,3 +1,3 @@
-from ansi2html.converter import Ansi2HTMLConverter
+from .converter import Ansi2HTMLConverter
 
 __all__ = ["Ansi2HTMLConverter"]
@@ -20,18 +20,22 @@
 #  along with this program.  If not, see
 #  <http://www.gnu.org/licenses/>.
 
+import copy
 import io
+import itertools
 import optparse
 import re
 import sys
-from collections import OrderedDict
-from typing import Iterator, List, Optional, Set, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
 
-from ansi2html.style import (
+from .style import (
     SCHEME,
-    add_truecolor_style_rule,
+    Rule,
+    TruecolorRules,
+    get_style_dict,
     get_styles,
-    pop_truecolor_styles,
 )
 
 if sys.version_info >= (3, 8):
@@ -119,135 +123,174 @@ _html_template = """<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//E
 </head>
 <body class="body_foreground body_background" style="font-size: %(font_size)s;" >
 <pre class="ansi2html-content">
-%(content)s
-</pre>
+%(content_start)s%(content)s
+%(content_end)s</pre>
 </body>
 
 </html>
 """
 
 
+class _SgrState(NamedTuple):
+    """SGR attributes; the value is immutable so that it can be used as a cache key"""
+
+    intensity: int = ANSI_INTENSITY_NORMAL
+    style: int = ANSI_STYLE_NORMAL
+    blink: int = ANSI_BLINK_OFF
+    underline: int = ANSI_UNDERLINE_OFF
+    crossedout: int = ANSI_CROSSED_OUT_OFF
+    visibility: int = ANSI_VISIBILITY_ON
+    foreground: Tuple[int, Optional[str]] = (ANSI_FOREGROUND_DEFAULT, None)
+    background: Tuple[int, Optional[str]] = (ANSI_BACKGROUND_DEFAULT, None)
+    negative: int = ANSI_NEGATIVE_OFF
+
+    def adjust_sgr(self, params: List[int]) -> "_SgrState":
+        if not params:
+            return self
+
+        values = list(self)
+        skip_after_index = -1
+        for i, v in enumerate(params):
+            if i <= skip_after_index:
+                continue
+
+            if v == ANSI_FOREGROUND or v == ANSI_BACKGROUND:
+                index = _FOREGROUND_INDEX if v == ANSI_FOREGROUND else _BACKGROUND_INDEX
+                x_bit_color_id = params[i + 1] if i + 1 < len(params) else -1
+                if x_bit_color_id == ANSI_256_COLOR_ID:
+                    if i + 2 >= len(params):
+                        continue
+                    values[index] = (v, str(params[i + 2]))
+                    skip_after_index = i + 2
+                    continue
+                if x_bit_color_id == ANSI_TRUECOLOR_ID:
+                    if i + 4 >= len(params):
+                        continue
+                    # r=1, g=64, b=255 -> 001064255
+                    values[index] = (v, "{:03d}{:03d}{:03d}".format(*params[i + 2 : i + 5]))
+                    skip_after_index = i + 4
+                    continue
+
+            attribute = _SGR_ATTRIBUTES.get(v)
+            if attribute is not None:
+                values[attribute[0]] = attribute[1]
+
+        return _SgrState._make(values)
+
+    def to_css_classes(self) -> Tuple[str, ...]:
+        return _get_css_classes(self)
+
+
+_DEFAULT_SGR_STATE = _SgrState()
+
+_FOREGROUND_INDEX = _SgrState._fields.index("foreground")
+_BACKGROUND_INDEX = _SgrState._fields.index("background")
+
+
+def _create_sgr_attributes() -> Dict[int, Tuple[int, Any]]:
+    """Map each SGR code to the index of the _SgrState attribute that it sets and the
+    value of that attribute"""
+    attributes: Dict[int, Tuple[int, Any]] = {}
+
+    for name, codes in [
+        (
+            "intensity",
+            [ANSI_INTENSITY_INCREASED, ANSI_INTENSITY_REDUCED, ANSI_INTENSITY_NORMAL],
+        ),
+        ("style", [ANSI_STYLE_ITALIC, ANSI_STYLE_NORMAL]),
+        ("blink", [ANSI_BLINK_SLOW, ANSI_BLINK_FAST, ANSI_BLINK_OFF]),
+        ("underline", [ANSI_UNDERLINE_ON, ANSI_UNDERLINE_OFF]),
+        ("crossedout", [ANSI_CROSSED_OUT_ON, ANSI_CROSSED_OUT_OFF]),
+        ("visibility", [ANSI_VISIBILITY_ON, ANSI_VISIBILITY_OFF]),
+        ("negative", [ANSI_NEGATIVE_ON, ANSI_NEGATIVE_OFF]),
+    ]:
+        for code in codes:
+            attributes[code] = (_SgrState._fields.index(name), code)
+
+    for index, codes in [
+        (
+            _FOREGROUND_INDEX,
+            [
+                *range(ANSI_FOREGROUND_CUSTOM_MIN, ANSI_FOREGROUND_CUSTOM_MAX + 1),
+                *range(
+                    ANSI_FOREGROUND_HIGH_INTENSITY_MIN,
+                    ANSI_FOREGROUND_HIGH_INTENSITY_MAX + 1,
+                ),
+                ANSI_FOREGROUND,
+                ANSI_FOREGROUND_DEFAULT,
+            ],
+        ),
+        (
+            _BACKGROUND_INDEX,
+            [
+                *range(ANSI_BACKGROUND_CUSTOM_MIN, ANSI_BACKGROUND_CUSTOM_MAX + 1),
+                *range(
+                    ANSI_BACKGROUND_HIGH_INTENSITY_MIN,
+                    ANSI_BACKGROUND_HIGH_INTENSITY_MAX + 1,
+                ),
+                ANSI_BACKGROUND,
+                ANSI_BACKGROUND_DEFAULT,
+            ],
+        ),
+    ]:
+        for code in codes:
+            attributes[code] = (index, (code, None))
+
+    return attributes
+
+
+_SGR_ATTRIBUTES = _create_sgr_attributes()
+
+
+@lru_cache(maxsize=4096)
+def _get_css_classes(sgr: _SgrState) -> Tuple[str, ...]:
+    css_classes = [
+        "ansi%d" % value
+        for value, default in zip(sgr[:6], _DEFAULT_SGR_STATE[:6])
+        if value != default
+    ]
+
+    negative = sgr.negative == ANSI_NEGATIVE_ON
+    for (value, parameter), default, neg_css_class in (
+        (sgr.foreground, ANSI_FOREGROUND_DEFAULT, "inv_background"),
+        (sgr.background, ANSI_BACKGROUND_DEFAULT, "inv_foreground"),
+    ):
+        if value != default:
+            prefix = "inv" if negative else "ansi"
+            css_class_index = (
+                str(value) if (parameter is None) else "%d-%s" % (value, parameter)
+            )
+            css_classes.append(prefix + css_class_index)
+        elif negative:
+            css_classes.append(neg_css_class)
+
+    return tuple(css_classes)
+
+
 class _State:
+    """Conversion state that is carried from one escape sequence to the next.
+
+    Spans are opened lazily: ``sgr`` is the state set by the input, and ``span_sgr`` is
+    the state of the span in the output (when ``inside_span``), which is brought up to
+    date when text is written.
+    """
+
+    __slots__ = ("inside_span", "box_drawing_mode", "sgr", "span_sgr")
+
     def __init__(self) -> None:
         self.inside_span = False
-        self.reset()
+        self.box_drawing_mode = False
+        self.sgr = _DEFAULT_SGR_STATE
+        self.span_sgr = _DEFAULT_SGR_STATE
 
     def reset(self) -> None:
-        self.intensity: int = ANSI_INTENSITY_NORMAL
-        self.style: int = ANSI_STYLE_NORMAL
-        self.blink: int = ANSI_BLINK_OFF
-        self.underline: int = ANSI_UNDERLINE_OFF
-        self.crossedout: int = ANSI_CROSSED_OUT_OFF
-        self.visibility: int = ANSI_VISIBILITY_ON
-        self.foreground: Tuple[int, Optional[str]] = (ANSI_FOREGROUND_DEFAULT, None)
-        self.background: Tuple[int, Optional[str]] = (ANSI_BACKGROUND_DEFAULT, None)
-        self.negative: int = ANSI_NEGATIVE_OFF
-
-    def adjust(self, ansi_code: int, parameter: Optional[str] = None) -> None:
-        if ansi_code in (
-            ANSI_INTENSITY_INCREASED,
-            ANSI_INTENSITY_REDUCED,
-            ANSI_INTENSITY_NORMAL,
-        ):
-            self.intensity = ansi_code
-        elif ansi_code in (ANSI_STYLE_ITALIC, ANSI_STYLE_NORMAL):
-            self.style = ansi_code
-        elif ansi_code in (ANSI_BLINK_SLOW, ANSI_BLINK_FAST, ANSI_BLINK_OFF):
-            self.blink = ansi_code
-        elif ansi_code in (ANSI_UNDERLINE_ON, ANSI_UNDERLINE_OFF):
-            self.underline = ansi_code
-        elif ansi_code in (ANSI_CROSSED_OUT_ON, ANSI_CROSSED_OUT_OFF):
-            self.crossedout = ansi_code
-        elif ansi_code in (ANSI_VISIBILITY_ON, ANSI_VISIBILITY_OFF):
-            self.visibility = ansi_code
-        elif ANSI_FOREGROUND_CUSTOM_MIN <= ansi_code <= ANSI_FOREGROUND_CUSTOM_MAX:
-            self.foreground = (ansi_code, None)
-        elif (
-            ANSI_FOREGROUND_HIGH_INTENSITY_MIN
-            <= ansi_code
-            <= ANSI_FOREGROUND_HIGH_INTENSITY_MAX
-        ):
-            self.foreground = (ansi_code, None)
-        elif ansi_code == ANSI_FOREGROUND:
-            self.foreground = (ansi_code, parameter)
-        elif ansi_code == ANSI_FOREGROUND_DEFAULT:
-            self.foreground = (ansi_code, None)
-        elif ANSI_BACKGROUND_CUSTOM_MIN <= ansi_code <= ANSI_BACKGROUND_CUSTOM_MAX:
-            self.background = (ansi_code, None)
-        elif (
-            ANSI_BACKGROUND_HIGH_INTENSITY_MIN
-            <= ansi_code
-            <= ANSI_BACKGROUND_HIGH_INTENSITY_MAX
-        ):
-            self.background = (ansi_code, None)
-        elif ansi_code == ANSI_BACKGROUND:
-            self.background = (ansi_code, parameter)
-        elif ansi_code == ANSI_BACKGROUND_DEFAULT:
-            self.background = (ansi_code, None)
-        elif ansi_code in (ANSI_NEGATIVE_ON, ANSI_NEGATIVE_OFF):
-            self.negative = ansi_code
-
-    def adjust_truecolor(self, ansi_code: int, r: int, g: int, b: int) -> None:
-        parameter = "{:03d}{:03d}{:03d}".format(
-            r, g, b
-        )  # r=1, g=64, b=255 -> 001064255
-
-        is_foreground = ansi_code == ANSI_FOREGROUND
-        add_truecolor_style_rule(is_foreground, ansi_code, r, g, b, parameter)
-        if is_foreground:
-            self.foreground = (ansi_code, parameter)
-        else:
-            self.background = (ansi_code, parameter)
-
-    def to_css_classes(self) -> List[str]:
-        css_classes: List[str] = []
-
-        def append_unless_default(output: List[str], value: int, default: int) -> None:
-            if value != default:
-                css_class = "ansi%d" % value
-                output.append(css_class)
-
-        def append_color_unless_default(
-            output: List[str],
-            color: Tuple[int, Optional[str]],
-            default: int,
-            negative: bool,
-            neg_css_class: str,
-        ) -> None:
-            value, parameter = color
-            if value != default:
-                prefix = "inv" if negative else "ansi"
-                css_class_index = (
-                    str(value) if (parameter is None) else "%d-%s" % (value, parameter)
-                )
-                output.append(prefix + css_class_index)
-            elif negative:
-                output.append(neg_css_class)
-
-        append_unless_default(css_classes, self.intensity, ANSI_INTENSITY_NORMAL)
-        append_unless_default(css_classes, self.style, ANSI_STYLE_NORMAL)
-        append_unless_default(css_classes, self.blink, ANSI_BLINK_OFF)
-        append_unless_default(css_classes, self.underline, ANSI_UNDERLINE_OFF)
-        append_unless_default(css_classes, self.crossedout, ANSI_CROSSED_OUT_OFF)
-        append_unless_default(css_classes, self.visibility, ANSI_VISIBILITY_ON)
-
-        flip_fore_and_background = self.negative == ANSI_NEGATIVE_ON
-        append_color_unless_default(
-            css_classes,
-            self.foreground,
-            ANSI_FOREGROUND_DEFAULT,
-            flip_fore_and_background,
-            "inv_background",
-        )
-        append_color_unless_default(
-            css_classes,
-            self.background,
-            ANSI_BACKGROUND_DEFAULT,
-            flip_fore_and_background,
-            "inv_foreground",
-        )
+        self.sgr = _DEFAULT_SGR_STATE
+
+    def adjust_sgr(self, params: List[int]) -> None:
+        self.sgr = self.sgr.adjust_sgr(params)
 
-        return css_classes
+    def to_css_classes(self) -> Tuple[str, ...]:
+        return self.sgr.to_css_classes()
 
 
 class OSC_Link:
@@ -261,6 +304,193 @@ def map_vt100_box_code(char: str) -> str:
     return VT100_BOX_CODES[char_hex] if char_hex in VT100_BOX_CODES else char
 
 
+_VT100_BOX_TABLE = str.maketrans(
+    {int(char_hex, 16): box_char for char_hex, box_char in VT100_BOX_CODES.items()}
+)
+
+# VT100 box drawing mode (1), OSC 8 hyperlinks (2, 3), and CSI sequences (4, 5)
+_escape_codes_prog = re.compile(
+    "\033(?:"
+    "\\(([B0])"
+    "|\\]8;;(.*?)\007(.*?)\033\\]8;;\007"
+    "|\\[([\\d;:]*)([a-zA-Z])"
+    ")"
+)
+
+
+def _find_incomplete_escape(ansi: str, start: int) -> int:
+    """Return the index of the first escape at or after 'start' that doesn't begin a
+    complete escape sequence, or the length of 'ansi' if there isn't one"""
+    index = ansi.find("\033", start)
+    while index != -1:
+        match = _escape_codes_prog.match(ansi, index)
+        if match is None:
+            return index
+        index = ansi.find("\033", match.end())
+    return len(ansi)
+
+
+def _escape_html(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+# Number of lines held by the converter that can be removed by cursor movement in
+# subsequent input.
+_CURSOR_UP_HISTORY = 64
+
+# Carriage returns that aren't part of a line ending (Windows text-mode output of "\r\n"
+# produces "\r\r\n", which is also a line ending)
+_carriage_return_prog = re.compile("\r+(?!\r*\n)")
+
+_cursor_up_prog = re.compile("\033\\[[\\d;:]*A")
+_sgr_separator_prog = re.compile("[;:]")
+_tag_split_prog = re.compile("[^<]+|<[^>]*>")
+
+# Maximum number of (state, SGR code) combinations cached by a converter
+_SGR_CACHE_SIZE = 4096
+
+# Input is only converted in parallel when each process has at least this much to do
+_MIN_PARALLEL_CHUNK_SIZE = 256 * 1024
+
+# Streamed input that doesn't contain a newline is converted once this much is held
+_MAX_PENDING_INPUT = 1024 * 1024
+
+
+def _parse_sgr_params(code_params: str) -> Tuple[bool, List[int]]:
+    """Return whether the SGR parameters include a reset, and the parameters that follow
+    the last reset"""
+    params: Union[str, List[int]] = code_params
+
+    if "::" in params or ";;" in params:
+        while True:
+            param_len = len(params)
+            params = params.replace("::", ":")
+            params = params.replace(";;", ";")
+            if len(params) == param_len:
+                break
+
+    try:
+        params = [int(x) for x in _sgr_separator_prog.split(params)]
+    except ValueError:
+        params = [ANSI_FULL_RESET]
+
+    # Find latest reset marker
+    last_null_index = None
+    skip_after_index = -1
+    for i, v in enumerate(params):
+        if i <= skip_after_index:
+            continue
+
+        if v == ANSI_FULL_RESET:
+            last_null_index = i
+        elif v in (ANSI_FOREGROUND, ANSI_BACKGROUND):
+            try:
+                x_bit_color_id = params[i + 1]
+            except IndexError:
+                x_bit_color_id = -1
+            is_256_color = x_bit_color_id == ANSI_256_COLOR_ID
+            shift = 2 if is_256_color else 4
+            skip_after_index = i + shift
+
+    if last_null_index is None:
+        return False, params
+    return True, params[last_null_index + 1 :]
+
+
+def _preserve_spaces(text: str) -> str:
+    """Replace the spaces that would be collapsed by an HTML renderer with ``&nbsp;``.
+
+    Every other space in a run is replaced, as well as one at the start of the text or
+    of a line (as it may follow a space or a line that was overwritten in the output).
+    """
+    text = text.replace("  ", " &nbsp;").replace("\n ", "\n&nbsp;")
+    if "\r" in text:
+        text = text.replace("\r ", "\r&nbsp;")
+    if text.startswith(" "):
+        text = "&nbsp;" + text[1:]
+    return text
+
+
+def _preserve_link_spaces(text: str) -> str:
+    """Replace spaces with ``&nbsp;`` in text that contains links, leaving the tags as
+    they are"""
+    return "".join(
+        part if part.startswith("<") else _preserve_spaces(part)
+        for part in _tag_split_prog.findall(text)
+    )
+
+
+def _advance_state(ansi: str, state: _State) -> None:
+    """Update the state as though the input had been converted, without producing any
+    output"""
+    sgr_params: List[str] = []
+    for match in _escape_codes_prog.finditer(ansi):
+        box_mode, _, _, params, command = match.groups()
+        if box_mode is not None:
+            state.box_drawing_mode = box_mode == "0"
+        elif command is not None and command in "mM":
+            sgr_params.append(params)
+
+    if not sgr_params:
+        return
+
+    # Only the codes following the last reset affect the state
+    pending: List[List[int]] = []
+    for params in reversed(sgr_params):
+        reset, values = _parse_sgr_params(params)
+        pending.append(values)
+        if reset:
+            state.reset()
+            break
+
+    for values in reversed(pending):
+        state.adjust_sgr(values)
+
+    # Chunks end with a newline, which brings the span up to date with the state
+    state.inside_span = bool(state.to_css_classes())
+    state.span_sgr = state.sgr
+
+
+def _split_lines(ansi: str, chunk_size: int) -> List[str]:
+    """Split the input into chunks of about ``chunk_size`` characters that end on line
+    boundaries. A chunk doesn't end within the lines preceding a cursor-up sequence, as
+    the sequence may remove content from those lines."""
+    chunks: List[str] = []
+    start = 0
+    while len(ansi) - start > chunk_size:
+        index = ansi.find("\n", start + chunk_size) + 1
+        while index:
+            end = index
+            for _ in range(_CURSOR_UP_HISTORY):
+                end = ansi.find("\n", end) + 1
+                if not end:
+                    end = len(ansi)
+                    break
+
+            match = _cursor_up_prog.search(ansi, index, end)
+            if match is None:
+                break
+            index = ansi.find("\n", match.end()) + 1
+
+        if not index:
+            break
+
+        chunks.append(ansi[start:index])
+        start = index
+
+    chunks.append(ansi[start:])
+    return chunks
+
+
+def _convert_chunk(
+    options: Dict[str, Any], ansi: str, state: _State, final: bool
+) -> Tuple[str, Set[str], bool]:
+    """Convert a chunk of input in a worker process"""
+    converter = Ansi2HTMLConverter(**options)
+    body = converter._convert_chunk(ansi, state, final)
+    return body, converter.styles_used, converter.hyperref
+
+
 def _needs_extra_newline(text: str) -> bool:
     if not text or text.endswith("\n"):
         return False
@@ -271,6 +501,10 @@ class CursorMoveUp:
     pass
 
 
+class _Markup(str):
+    """Markup generated for an escape sequence, as opposed to text from the input"""
+
+
 class Attributes(TypedDict):
     dark_bg: bool
     line_wrap: bool
@@ -302,7 +536,13 @@ class Ansi2HTMLConverter:
         output_encoding: str = "utf-8",
         scheme: str = "ansi2html",
         title: str = "",
+        preserve_spaces: bool = False,
+        background_color: Optional[str] = None,
     ) -> None:
+        """
+        :param preserve_spaces: Emit spaces as ``&nbsp;`` where needed so that they aren't collapsed by HTML renderers that ignore ``<pre>`` (e.g. some mail clients); runs of spaces alternate between the two.
+        :param background_color: Wrap the content of the HTML document in a ``div`` with this background color.
+        """
 
         self.latex = latex
         self.inline = inline
@@ -315,24 +555,28 @@ class Ansi2HTMLConverter:
         self.output_encoding = output_encoding
         self.scheme = scheme
         self.title = title
+        self.preserve_spaces = preserve_spaces
+        self.background_color = background_color
         self._attrs: Attributes
         self.hyperref = False
         if inline:
-            self.styles = dict(
-                [
-                    (item.klass.strip("."), item)
-                    for item in get_styles(self.dark_bg, self.line_wrap, self.scheme)
-                ]
-            )
+            self.styles = get_style_dict(self.dark_bg, self.line_wrap, self.scheme)
+        # Truecolor rules are specific to this converter, as the colors vary by input
+        self.truecolor_rules = TruecolorRules()
+        self._sgr_cache: Dict[Tuple[_SgrState, str], _SgrState] = {}
+        self._span_cache: Dict[
+            Tuple[Optional[_SgrState], _SgrState], Tuple[bool, _Markup, Tuple[str, ...]]
+        ] = {}
+        self._open_span_cache: Dict[_SgrState, _Markup] = {}
+        self._close_span = _Markup("}" if latex else "</span>")
 
-        self.vt100_box_codes_prog = re.compile("\033\\(([B0])")
-        self.ansi_codes_prog = re.compile("\033\\[([\\d;:]*)([a-zA-Z])")
         self.url_matcher = re.compile(
             r"(((((https?|ftps?|gopher|telnet|nntp)://)|"
             r"(mailto:|news:))(%[0-9A-Fa-f]{2}|[-()_.!~*"
             r"\';/?:@&=+$,A-Za-z0-9])+)([).!\';/?:,][\s])?)"
         )
-        self.osc_link_re = re.compile("\033\\]8;;(.*?)\007(.*?)\033\\]8;;\007")
+
+        self._begin_document()
 
     def do_linkify(self, line: str) -> str:
         if not isinstance(line, str):
@@ -348,287 +592,578 @@ class Ansi2HTMLConverter:
             return """\\href{%s}{%s}""" % (part.url, part.text)
         return """<a href="%s">%s</a>""" % (part.url, part.text)
 
+    @property
+    def styles_used(self) -> Set[str]:
+        """CSS classes used by the current (or most recently finished) document"""
+        return self._styles_used
+
     def apply_regex(self, ansi: str) -> Tuple[str, Set[str]]:
-        styles_used: Set[str] = set()
-        all_parts = self._apply_regex(ansi, styles_used)
-        no_cursor_parts = self._collapse_cursor(all_parts)
-        no_cursor_parts = list(no_cursor_parts)
-
-        def _check_links(parts: List[Union[str, OSC_Link]]) -> Iterator[str]:
-            for part in parts:
-                if isinstance(part, str):
-                    if self.linkify:
-                        yield self.do_linkify(part)
-                    else:
-                        yield part
-                elif isinstance(part, OSC_Link):
-                    yield self.handle_osc_links(part)
-                else:
-                    yield part
+        combined = self.feed(ansi) + self.finish()
+        return combined, self.styles_used
 
-        parts = list(_check_links(no_cursor_parts))
-        combined = "".join(parts)
-        if self.markup_lines and not self.latex:
-            combined = "\n".join(
-                [
-                    """<span id="line-%i">%s</span>""" % (i, line)
-                    for i, line in enumerate(combined.split("\n"))
-                ]
+    def feed(self, ansi: str) -> str:
+        """Convert a chunk of input, returning the markup that is ready to be output.
+
+        State is carried across calls so that output can be converted while it is being
+        produced; call ``finish`` once all of the input has been provided. Input is
+        processed a line at a time, so content following the last newline is held until
+        more input arrives (or until the line becomes very long).
+        """
+        if not self._streaming:
+            self._begin_document()
+            self._streaming = True
+
+        # Only the new input is searched for a newline, as the held input doesn't contain one
+        index = ansi.rfind("\n") + 1
+
+        if not index:
+            if ansi:
+                self._pending_input.append(ansi)
+                self._pending_input_size += len(ansi)
+
+            if self._pending_input_size < _MAX_PENDING_INPUT:
+                return ""
+
+            return self._convert_long_line()
+
+        self._pending_input.append(ansi[:index])
+        lines = "".join(self._pending_input)
+
+        self._pending_input = [ansi[index:]] if index != len(ansi) else []
+        self._pending_input_size = len(ansi) - index
+
+        return self._convert_lines(lines, final=False)
+
+    def finish(self, ensure_trailing_newline: bool = False) -> str:
+        r"""Convert any remaining input and close the document.
+
+        :param ensure_trailing_newline: Ensures that ``\n`` character is present at the end of the output.
+        """
+        if not self._streaming:
+            self._begin_document()
+
+        result = self._convert_lines("".join(self._pending_input), final=True)
+
+        if ensure_trailing_newline and _needs_extra_newline(self._last_char):
+            result += "\n"
+
+        self._pending_input = []
+        self._pending_input_size = 0
+        self._streaming = False
+
+        return result
+
+    def _begin_document(self) -> None:
+        self._streaming = False
+        self._state = _State()
+        self._pending_input: List[str] = []
+        self._pending_input_size = 0
+        self._pending_parts: List[Union[str, OSC_Link]] = []
+        self._pending_lines = 0
+        self._overwrite_line = False
+        self._styles_used: Set[str] = set()
+        self._line_number = 0
+        self._inside_line = False
+        self._last_char = ""
+
+    def _convert_long_line(self) -> str:
+        """Convert the held input, which doesn't contain a newline, so that a very long line
+        isn't held indefinitely. An escape sequence (that may be incomplete) at the end of the
+        input and carriage returns that may be followed by a newline are held."""
+        ansi = "".join(self._pending_input)
+
+        # Escape sequences (including the text of OSC links) are short, so only the end of
+        # the input is searched
+        index = _find_incomplete_escape(ansi, max(0, len(ansi) - 4096))
+        while index and ansi[index - 1] == "\r":
+            index -= 1
+
+        self._pending_input = [ansi[index:]] if index != len(ansi) else []
+        self._pending_input_size = len(ansi) - index
+
+        return self._convert_lines(ansi[:index], final=False)
+
+    def _convert_lines(self, ansi: str, final: bool) -> str:
+        parts = self._apply_regex(ansi, self._styles_used, self._state)
+        ready_parts: List[Union[str, OSC_Link]] = []
+
+        carriage_returns = _carriage_return_prog.search(ansi) is not None
+        if carriage_returns or self._overwrite_line or _cursor_up_prog.search(ansi):
+            self._collapse_lines(parts, carriage_returns, ready_parts)
+        else:
+            # This input can't overwrite itself, so only the lines at its end need to
+            # be held (and it doesn't contain cursor movements)
+            self._pending_parts.extend(
+                part for part in parts if not isinstance(part, CursorMoveUp)
             )
-        return combined, styles_used
+            self._release_lines(ready_parts)
 
-    def _apply_regex(
-        self, ansi: str, styles_used: Set[str]
-    ) -> Iterator[Union[str, OSC_Link, CursorMoveUp]]:
-        if self.escaped:
-            if (
-                self.latex
-            ):  # Known Perl function which does this: https://tex.stackexchange.com/questions/34580/escape-character-in-latex/119383#119383
-                specials = OrderedDict([])
-            else:
-                specials = OrderedDict(
-                    [
-                        ("&", "&amp;"),
-                        ("<", "&lt;"),
-                        (">", "&gt;"),
-                    ]
-                )
-            for pattern, special in specials.items():
-                ansi = ansi.replace(pattern, special)
-
-        def _vt100_box_drawing() -> Iterator[str]:
-            last_end = 0  # the index of the last end of a code we've seen
-            box_drawing_mode = False
-            for match in self.vt100_box_codes_prog.finditer(ansi):
-                trailer = ansi[last_end : match.start()]
-                if box_drawing_mode:
-                    for char in trailer:
-                        yield map_vt100_box_code(char)
-                else:
-                    yield trailer
-                last_end = match.end()
-                box_drawing_mode = match.groups()[0] == "0"
-            yield ansi[last_end:]
-
-        ansi = "".join(_vt100_box_drawing())
-
-        def _osc_link(ansi: str) -> Iterator[Union[str, OSC_Link]]:
-            last_end = 0
-            for match in self.osc_link_re.finditer(ansi):
-                trailer = ansi[last_end : match.start()]
-                yield trailer
-                url = match.groups()[0]
-                text = match.groups()[1]
-                yield OSC_Link(url, text)
-                last_end = match.end()
-            yield ansi[last_end:]
+        if final:
+            ready_parts.extend(self._pending_parts)
+            self._pending_parts.clear()
+            self._pending_lines = 0
+            self._overwrite_line = False
+
+            if self._state.inside_span:
+                self._state.inside_span = False
+                ready_parts.append(self._close_span)
+
+        combined = "".join(self._check_links(ready_parts))
 
+        if self.markup_lines and not self.latex:
+            combined = self._markup_lines(combined, final)
+
+        if combined:
+            self._last_char = combined[-1]
+
+        return combined
+
+    def _convert_parallel(self, ansi: str, jobs: int) -> Iterator[str]:
+        # Each process is given several chunks so that the work is distributed evenly
+        chunks = _split_lines(
+            ansi, max(len(ansi) // (jobs * 4) + 1, _MIN_PARALLEL_CHUNK_SIZE)
+        )
+        if len(chunks) == 1:
+            yield self.feed(ansi)
+            yield self.finish()
+            return
+
+        self._begin_document()
+
+        # Determine the state at the start of each chunk
+        states = []
         state = _State()
-        for part in _osc_link(ansi):
-            if isinstance(part, OSC_Link):
-                yield part
-            else:
-                yield from self._handle_ansi_code(part, styles_used, state)
-        if state.inside_span:
-            if self.latex:
-                yield "}"
+        for chunk in chunks:
+            states.append(copy.copy(state))
+            if len(states) != len(chunks):
+                _advance_state(chunk, state)
+
+        options = dict(
+            latex=self.latex,
+            inline=self.inline,
+            dark_bg=self.dark_bg,
+            line_wrap=self.line_wrap,
+            linkify=self.linkify,
+            escaped=self.escaped,
+            scheme=self.scheme,
+            preserve_spaces=self.preserve_spaces,
+        )
+
+        with ProcessPoolExecutor(min(jobs, len(chunks))) as executor:
+            results = executor.map(
+                _convert_chunk,
+                itertools.repeat(options),
+                chunks,
+                states,
+                [index == len(chunks) - 1 for index in range(len(chunks))],
+            )
+
+            for index, (body, styles_used, hyperref) in enumerate(results):
+                self._styles_used.update(styles_used)
+                self.hyperref = self.hyperref or hyperref
+
+                if self.markup_lines and not self.latex:
+                    body = self._markup_lines(body, index == len(chunks) - 1)
+
+                yield body
+
+    def _convert_chunk(self, ansi: str, state: _State, final: bool) -> str:
+        """Convert a chunk of input starting with the given state. Unless this is the
+        final chunk, a span that is open at the end of the chunk is left open, as it
+        continues into the next chunk."""
+        self._begin_document()
+        self._state = state
+
+        body = self._convert_lines(ansi, final)
+        if not final:
+            body += "".join(self._check_links(self._pending_parts))
+            self._pending_parts.clear()
+
+        return body
+
+    def _check_links(self, parts: List[Union[str, OSC_Link]]) -> Iterator[str]:
+        for part in parts:
+            if isinstance(part, str):
+                if self.linkify:
+                    part = self.do_linkify(part)
+                    if self.preserve_spaces and not self.latex:
+                        part = _preserve_link_spaces(part)
+                    yield part
+                else:
+                    yield part
+            elif isinstance(part, OSC_Link):
+                yield self.handle_osc_links(part)
             else:
-                yield "</span>"
+                yield part
 
-    def _handle_ansi_code(
-        self, ansi: str, styles_used: Set[str], state: _State
-    ) -> Iterator[Union[str, CursorMoveUp]]:
-        last_end = 0  # the index of the last end of a code we've seen
-        for match in self.ansi_codes_prog.finditer(ansi):
-            yield ansi[last_end : match.start()]
-            last_end = match.end()
+    def _markup_lines(self, combined: str, final: bool) -> str:
+        output: List[str] = []
 
-            params: Union[str, List[int]]
-            params, command = match.groups()
+        if combined or final:
+            if not self._inside_line:
+                output.append("""<span id="line-%i">""" % self._line_number)
+                self._inside_line = True
 
-            if command not in "mMA":
-                continue
+            lines = combined.split("\n")
+            output.append(lines[0])
 
-            # Special cursor-moving code.  The only supported one.
-            if command == "A":
-                yield CursorMoveUp()
-                continue
+            for line in lines[1:]:
+                self._line_number += 1
+                output.append("""</span>\n<span id="line-%i">""" % self._line_number)
+                output.append(line)
 
-            while True:
-                param_len = len(params)
-                params = params.replace("::", ":")
-                params = params.replace(";;", ";")
-                if len(params) == param_len:
-                    break
+            if final:
+                output.append("</span>")
+                self._inside_line = False
 
-            try:
-                params = [int(x) for x in re.split("[;:]", params)]
-            except ValueError:
-                params = [ANSI_FULL_RESET]
-
-            # Find latest reset marker
-            last_null_index = None
-            skip_after_index = -1
-            for i, v in enumerate(params):
-                if i <= skip_after_index:
-                    continue
+        return "".join(output)
+
+    def _apply_regex(
+        self, ansi: str, styles_used: Set[str], state: _State
+    ) -> Iterator[Union[str, OSC_Link, CursorMoveUp]]:
+        # Escaping, box drawing characters, OSC links and SGR codes are all handled in a
+        # single scan over the input
+        escape = self.escaped and not self.latex
+        # Spaces in linkified text are handled once the links have been created
+        nbsp = self.preserve_spaces and not self.latex and not self.linkify
+
+        last_end = 0  # the index of the last end of a code we've seen
+        for match in _escape_codes_prog.finditer(ansi):
+            text = ansi[last_end : match.start()]
+            if text:
+                if state.sgr is not state.span_sgr:
+                    markup = self._update_span(state, styles_used)
+                    if markup:
+                        yield markup
+                yield self._convert_text(text, escape, nbsp, state)
+            last_end = match.end()
 
-                if v == ANSI_FULL_RESET:
-                    last_null_index = i
-                elif v in (ANSI_FOREGROUND, ANSI_BACKGROUND):
-                    try:
-                        x_bit_color_id = params[i + 1]
-                    except IndexError:
-                        x_bit_color_id = -1
-                    is_256_color = x_bit_color_id == ANSI_256_COLOR_ID
-                    shift = 2 if is_256_color else 4
-                    skip_after_index = i + shift
+            box_mode, url, link_text, params, command = match.groups()
+            if command is not None:
+                yield from self._handle_ansi_code(params, command, state)
+            elif box_mode is not None:
+                state.box_drawing_mode = box_mode == "0"
+            else:
+                if escape:
+                    url = _escape_html(url)
+                    link_text = _escape_html(link_text)
+                if state.sgr is not state.span_sgr:
+                    markup = self._update_span(state, styles_used)
+                    if markup:
+                        yield markup
+                yield OSC_Link(url, link_text)
+
+        text = ansi[last_end:]
+        if text:
+            if state.sgr is not state.span_sgr:
+                markup = self._update_span(state, styles_used)
+                if markup:
+                    yield markup
+            yield self._convert_text(text, escape, nbsp, state)
+
+    @staticmethod
+    def _convert_text(text: str, escape: bool, nbsp: bool, state: _State) -> str:
+        # Box drawing characters are mapped before any entities are added to the text
+        if state.box_drawing_mode:
+            text = text.translate(_VT100_BOX_TABLE)
+        if escape:
+            text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        if nbsp and " " in text:
+            text = _preserve_spaces(text)
+        return text
 
+    def _handle_ansi_code(
+        self, code_params: str, command: str, state: _State
+    ) -> Iterator[CursorMoveUp]:
+        if command not in "mMA":
+            return
+
+        # Special cursor-moving code.  The only supported one.
+        if command == "A":
+            yield CursorMoveUp()
+            return
+
+        # Output typically uses the same few codes over and over
+        key = (state.sgr, code_params)
+        sgr = self._sgr_cache.get(key)
+        if sgr is None:
             # Process reset marker, drop everything before
-            if last_null_index is not None:
-                params = params[last_null_index + 1 :]
-                if state.inside_span:
-                    state.inside_span = False
-                    if self.latex:
-                        yield "}"
-                    else:
-                        yield "</span>"
-                state.reset()
-
-                if not params:
-                    continue
+            reset, params = _parse_sgr_params(code_params)
+            sgr = (_DEFAULT_SGR_STATE if reset else state.sgr).adjust_sgr(params)
+
+            if len(self._sgr_cache) >= _SGR_CACHE_SIZE:
+                self._sgr_cache.clear()
+            self._sgr_cache[key] = sgr
+
+        # The span is updated when text is written, so codes that don't apply to any
+        # text (or that don't change how it is styled) don't produce any markup
+        state.sgr = sgr
+
+    def _update_span(self, state: _State, styles_used: Set[str]) -> _Markup:
+        """Return the markup that brings the span in the output up to date with the
+        state"""
+        key = (state.span_sgr if state.inside_span else None, state.sgr)
+        result = self._span_cache.get(key)
+        if result is None:
+            result = self._render_span(*key)
+            if len(self._span_cache) >= _SGR_CACHE_SIZE:
+                self._span_cache.clear()
+            self._span_cache[key] = result
+
+        inside_span, markup, css_classes = result
+        if markup:
+            state.inside_span = inside_span
+            styles_used.update(css_classes)
+        state.span_sgr = state.sgr
+        return markup
+
+    def _render_span(
+        self, span_sgr: Optional[_SgrState], sgr: _SgrState
+    ) -> Tuple[bool, _Markup, Tuple[str, ...]]:
+        """Return whether a span is open, the markup, and the CSS classes that result
+        from replacing the span for 'span_sgr' (if one is open) with one for 'sgr'"""
+        css_classes = sgr.to_css_classes()
+        open_span = self._get_open_span(sgr) if css_classes else ""
+
+        if span_sgr is None:
+            return bool(css_classes), _Markup(open_span), css_classes
+
+        # Adjacent spans that look the same are merged
+        if open_span == self._get_open_span(span_sgr):
+            return True, _Markup(""), css_classes
+
+        return bool(css_classes), _Markup(self._close_span + open_span), css_classes
+
+    def _get_open_span(self, sgr: _SgrState) -> _Markup:
+        """Return the markup that opens a span for the state"""
+        result = self._open_span_cache.get(sgr)
+        if result is not None:
+            return result
+
+        css_classes = sgr.to_css_classes()
+
+        if self.inline:
+            rules = [
+                self.styles.get(klass) or self.truecolor_rules.get(klass)
+                for klass in css_classes
+            ]
+            if self.latex:
+                style = [
+                    rule.kwl[0][1]
+                    for rule in rules
+                    if rule is not None and rule.kwl[0][0] == "color"
+                ]
+                result = _Markup("\\textcolor[HTML]{%s}{" % style[0])
+            else:
+                style = [rule.kw for rule in rules if rule is not None]
+                result = _Markup('<span style="%s">' % "; ".join(style))
+        else:
+            if self.latex:
+                result = _Markup("\\textcolor{%s}{" % " ".join(css_classes))
+            else:
+                result = _Markup('<span class="%s">' % " ".join(css_classes))
 
-            # Turn codes into CSS classes
-            skip_after_index = -1
-            for i, v in enumerate(params):
-                if i <= skip_after_index:
-                    continue
+        if len(self._open_span_cache) >= _SGR_CACHE_SIZE:
+            self._open_span_cache.clear()
+        self._open_span_cache[sgr] = result
 
-                is_x_bit_color = v in (ANSI_FOREGROUND, ANSI_BACKGROUND)
-                try:
-                    x_bit_color_id = params[i + 1]
-                except IndexError:
-                    x_bit_color_id = -1
-                is_256_color = x_bit_color_id == ANSI_256_COLOR_ID
-                is_truecolor = x_bit_color_id == ANSI_TRUECOLOR_ID
-                if is_x_bit_color and is_256_color:
-                    try:
-                        parameter: Optional[str] = str(params[i + 2])
-                    except IndexError:
-                        continue
-                    skip_after_index = i + 2
-                elif is_x_bit_color and is_truecolor:
-                    try:
-                        state.adjust_truecolor(
-                            v, params[i + 2], params[i + 3], params[i + 4]
-                        )
-                    except IndexError:
-                        continue
-                    skip_after_index = i + 4
-                    continue
-                else:
-                    parameter = None
-                state.adjust(v, parameter=parameter)
+        return result
 
-            if state.inside_span:
-                if self.latex:
-                    yield "}"
-                else:
-                    yield "</span>"
-                state.inside_span = False
+    def _collapse_lines(
+        self,
+        parts: Iterator[Union[str, OSC_Link, CursorMoveUp]],
+        carriage_returns: bool,
+        ready_parts: List[Union[str, OSC_Link]],
+    ) -> None:
+        """Act on cursor movements and carriage returns as the parts are produced.
 
-            css_classes = state.to_css_classes()
-            if not css_classes:
-                continue
-            styles_used.update(css_classes)
+        Parts are held until they are more than _CURSOR_UP_HISTORY lines from the end of
+        the output, as they may still be overwritten; older parts are moved to
+        'ready_parts'.
+        """
+        pending = self._pending_parts
 
-            if self.inline:
-                self.styles.update(pop_truecolor_styles())
-                if self.latex:
-                    style = [
-                        self.styles[klass].kwl[0][1]
-                        for klass in css_classes
-                        if self.styles[klass].kwl[0][0] == "color"
-                    ]
-                    yield "\\textcolor[HTML]{%s}{" % style[0]
-                else:
-                    style = [
-                        self.styles[klass].kw
-                        for klass in css_classes
-                        if klass in self.styles
-                    ]
-                    yield '<span style="%s">' % "; ".join(style)
-            else:
-                if self.latex:
-                    yield "\\textcolor{%s}{" % " ".join(css_classes)
+        for part in parts:
+            # Text from the input (markup is a str subclass)
+            if type(part) is str:
+                if carriage_returns and "\r" in part:
+                    # Text following a carriage return overwrites the current line,
+                    # which collapses progress bars to their final frame
+                    segments = _carriage_return_prog.split(part)
+                    if segments[0]:
+                        self._add_text(segments[0])
+                    for segment in segments[1:]:
+                        self._overwrite_line = True
+                        if segment:
+                            self._add_text(segment)
+                elif self._overwrite_line:
+                    self._add_text(part)
                 else:
-                    yield '<span class="%s">' % " ".join(css_classes)
-            state.inside_span = True
-        yield ansi[last_end:]
+                    pending.append(part)
+                    self._pending_lines += part.count("\n")
 
-    def _collapse_cursor(
-        self, parts: Iterator[Union[str, OSC_Link, CursorMoveUp]]
-    ) -> List[Union[str, OSC_Link]]:
-        """Act on any CursorMoveUp commands by deleting preceding tokens"""
+                # Lines are released in batches rather than one at a time
+                if self._pending_lines > 2 * _CURSOR_UP_HISTORY:
+                    self._release_lines(ready_parts)
 
-        final_parts: List[Union[str, OSC_Link]] = []
-        for part in parts:
+            elif isinstance(part, _Markup):
+                pending.append(part)
+            elif isinstance(part, CursorMoveUp):
+                self._remove_line(overwrite=False)
+            else:
+                self._add_text(part)
+
+    def _add_text(self, part: Union[str, OSC_Link]) -> None:
+        if self._overwrite_line:
+            self._overwrite_line = False
+            if not (isinstance(part, str) and part.startswith("\n")):
+                self._remove_line(overwrite=True)
+
+        self._pending_parts.append(part)
+        if isinstance(part, str):
+            self._pending_lines += part.count("\n")
+
+    def _remove_line(self, overwrite: bool) -> None:
+        """Delete the current line. When moving the cursor up (rather than overwriting
+        the line) and nothing has been written to the current line, the previous line
+        is deleted as well."""
+        pending = self._pending_parts
+
+        has_text = overwrite
+        # Whether a span was open at the start of the line, if the line contains markup
+        line_inside_span: Optional[bool] = None
+
+        while pending:
+            part = pending[-1]
+            if isinstance(part, _Markup):
+                line_inside_span = part.startswith(self._close_span)
+            elif isinstance(part, str):
+                end = len(part)
+                if not has_text and part.endswith("\n"):
+                    # The cursor moves to the previous line
+                    end -= 1
+                    self._pending_lines -= 1
+                index = part.rfind("\n", 0, end) + 1
+                if index:
+                    if index != len(part):
+                        pending[-1] = part[:index]
+                    break
+                has_text = True
+            else:
+                has_text = True
+
+            pending.pop()
+
+        # Markup that applied to the deleted text may have opened or closed a span, so
+        # restore the current state
+        if line_inside_span is not None:
+            if line_inside_span:
+                pending.append(self._close_span)
+            if self._state.inside_span:
+                pending.append(self._get_open_span(self._state.span_sgr))
+
+    def _release_lines(self, ready_parts: List[Union[str, OSC_Link]]) -> None:
+        """Move the parts that are no longer within _CURSOR_UP_HISTORY lines of the end
+        of the output to 'ready_parts'"""
+        pending = self._pending_parts
+
+        lines = 0
+        index = len(pending)
+        while index:
+            index -= 1
+            part = pending[index]
+            if not isinstance(part, str):
+                continue
 
-            # Throw out empty string tokens ("")
-            if not part:
+            part_lines = part.count("\n")
+            lines += part_lines
+            if lines < _CURSOR_UP_HISTORY:
                 continue
 
-            # Go back, deleting every token in the last 'line'
-            if isinstance(part, CursorMoveUp):
-                if final_parts:
-                    final_parts.pop()
+            ready_parts.extend(pending[:index])
 
-                while final_parts and (
-                    isinstance(final_parts[-1], OSC_Link)
-                    or (
-                        isinstance(final_parts[-1], str) and "\n" not in final_parts[-1]
-                    )
-                ):
-                    final_parts.pop()
+            # Release the beginning of the part and hold the lines at its end
+            keep_lines = _CURSOR_UP_HISTORY - lines + part_lines
+            if keep_lines < part_lines:
+                split = len(part)
+                for _ in range(keep_lines + 1):
+                    split = part.rfind("\n", 0, split)
+                split += 1
 
-                continue
+                ready_parts.append(part[:split])
+                pending[index] = part[split:]
 
-            # Otherwise, just pass this token forward
-            final_parts.append(part)
+            del pending[:index]
+            lines = _CURSOR_UP_HISTORY
+            break
 
-        return final_parts
+        self._pending_lines = lines
 
     def prepare(
-        self, ansi: str = "", ensure_trailing_newline: bool = False
+        self, ansi: str = "", ensure_trailing_newline: bool = False, jobs: int = 1
     ) -> Attributes:
         """Load the contents of 'ansi' into this object"""
 
-        body, styles = self.apply_regex(ansi)
-
-        if ensure_trailing_newline and _needs_extra_newline(body):
-            body += "\n"
+        if jobs > 1:
+            body = "".join(self._convert_parallel(ansi, jobs))
+            if ensure_trailing_newline and _needs_extra_newline(body):
+                body += "\n"
+        else:
+            body = self.feed(ansi) + self.finish(
+                ensure_trailing_newline=ensure_trailing_newline
+            )
 
         self._attrs = {
             "dark_bg": self.dark_bg,
             "line_wrap": self.line_wrap,
             "font_size": self.font_size,
             "body": body,
-            "styles": styles,
+            "styles": self.styles_used,
         }
 
         return self._attrs
 
     def convert(
-        self, ansi: str, full: bool = True, ensure_trailing_newline: bool = False
+        self,
+        ansi: str,
+        full: bool = True,
+        ensure_trailing_newline: bool = False,
+        jobs: int = 1,
     ) -> str:
         r"""
         :param ansi: ANSI sequence to convert.
         :param full: Whether to include the full HTML document or only the body.
         :param ensure_trailing_newline: Ensures that ``\n`` character is present at the end of the output.
+        :param jobs: Number of processes used to convert large input; the output is the same regardless of the number of processes.
         """
-        attrs = self.prepare(ansi, ensure_trailing_newline=ensure_trailing_newline)
+        attrs = self.prepare(
+            ansi, ensure_trailing_newline=ensure_trailing_newline, jobs=jobs
+        )
         if not full:
             return attrs["body"]
+        return self.produce_document(attrs["body"])
+
+    def produce_document(self, body: str) -> str:
+        """Wrap converted content in the full document, using the styles of the most
+        recently finished document.
+
+        >>> conv = Ansi2HTMLConverter()
+        >>> body = "".join(conv.feed(chunk) for chunk in chunks) + conv.finish()
+        >>> html = conv.produce_document(body)
+        """
+        start, end = self.produce_document_parts()
+        return start + body + end
+
+    def produce_document_parts(self) -> Tuple[str, str]:
+        """Return the markup that precedes and follows the converted content in the full
+        document, so that the document can be written without joining the content into a
+        single string.
+
+        >>> start, end = conv.produce_document_parts()
+        >>> f.write(start)
+        >>> shutil.copyfileobj(body_file, f)
+        >>> f.write(end)
+        """
         if self.latex:
             _template = _latex_template
         else:
@@ -636,25 +1171,55 @@ class Ansi2HTMLConverter:
         all_styles = get_styles(self.dark_bg, self.line_wrap, self.scheme)
         backgrounds = all_styles[:5]
         used_styles = filter(
-            lambda e: e.klass.lstrip(".") in attrs["styles"], all_styles
+            lambda e: e.klass.lstrip(".") in self.styles_used, all_styles
         )
 
-        return _template % {
-            "style": "\n".join(list(map(str, backgrounds + list(used_styles)))),
+        values = {
+            "style": "\n".join(
+                list(
+                    map(
+                        str,
+                        backgrounds
+                        + list(used_styles)
+                        + self._get_truecolor_styles(),
+                    )
+                )
+            ),
             "title": self.title,
             "font_size": self.font_size,
-            "content": attrs["body"],
+            "content_start": (
+                '<div style="background-color: %s">\n' % self.background_color
+                if self.background_color
+                else ""
+            ),
+            "content_end": "</div>\n" if self.background_color else "",
             "output_encoding": self.output_encoding,
             "hyperref": "\\usepackage{hyperref}" if self.hyperref else "",
         }
 
+        start, end = _template.split("%(content)s")
+        return start % values, end % values
+
     def produce_headers(self) -> str:
         return '<style type="text/css">\n%(style)s\n</style>\n' % {
             "style": "\n".join(
-                map(str, get_styles(self.dark_bg, self.line_wrap, self.scheme))
+                map(
+                    str,
+                    get_styles(self.dark_bg, self.line_wrap, self.scheme)
+                    + self._get_truecolor_styles(),
+                )
             )
         }
 
+    def _get_truecolor_styles(self) -> List[Rule]:
+        """Truecolor rules used by the current (or most recently finished) document"""
+        rules = []
+        for klass in sorted(self.styles_used):
+            rule = self.truecolor_rules.get(klass)
+            if rule is not None:
+                rules.append(rule)
+        return rules
+
 
 def main() -> None:
     """
@@ -813,6 +1378,12 @@ def main() -> None:
         return
 
     full = not bool(opts.partial or opts.inline)
+    if not full:
+        for line in sys.stdin:
+            _print(conv.feed(line), end="")
+        _print(conv.finish(ensure_trailing_newline=True), end="")
+        return
+
     output = conv.convert(
         "".join(sys.stdin.readlines()), full=full, ensure_trailing_newline=True
     )
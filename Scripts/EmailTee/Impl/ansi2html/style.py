@@ -17,7 +17,12 @@
 #    <http://www.gnu.org/licenses/>.
 
 
-from typing import Dict, List
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from types import MappingProxyType
+from typing import List, Mapping, Optional, Tuple
 
 
 class Rule:
@@ -229,10 +234,6 @@ SCHEME = {
     ),
 }
 
-# to be filled in runtime, when truecolor found
-truecolor_rules: List[Rule] = []
-
-
 def intensify(color: str, dark_bg: bool, amount: int = 64) -> str:
     if not dark_bg:
         amount = -amount
@@ -245,6 +246,33 @@ def get_styles(
     line_wrap: bool = True,
     scheme: str = "ansi2html",
 ) -> List[Rule]:
+    return list(_get_base_styles(dark_bg, line_wrap, scheme))
+
+
+@lru_cache(maxsize=None)
+def get_style_dict(
+    dark_bg: bool = True,
+    line_wrap: bool = True,
+    scheme: str = "ansi2html",
+) -> Mapping[str, Rule]:
+    """Read-only mapping of CSS class name (without the leading '.') to rule, not
+    including truecolor rules"""
+    return MappingProxyType(
+        {
+            item.klass.strip("."): item
+            for item in _get_base_styles(dark_bg, line_wrap, scheme)
+        }
+    )
+
+
+# The rules only depend on the arguments, so they are created once for each
+# combination and shared
+@lru_cache(maxsize=None)
+def _get_base_styles(
+    dark_bg: bool,
+    line_wrap: bool,
+    scheme: str,
+) -> Tuple[Rule, ...]:
     css = [
         Rule(
             ".ansi2html-content",
@@ -353,26 +381,58 @@ def get_styles(
         css.append(Rule(".ansi48-%s" % index2(grey), background=level(grey)))
         css.append(Rule(".inv48-%s" % index2(grey), color=level(grey)))
 
-    css.extend(truecolor_rules)
+    return tuple(css)
+
+
+# as truecolor encoding has 16 millions colors, rules are only created for the colors
+# that are used
+class TruecolorRules:
+    """Rules for truecolor CSS classes (e.g. "ansi38-001064255"), created as they are
+    needed.
+
+    Rules are deduplicated, and only the ``max_size`` most recently used rules are
+    retained; a rule that has been discarded is created again when it is next needed.
+    """
+
+    def __init__(self, max_size: int = 1024) -> None:
+        self.max_size = max_size
+        self._rules: "OrderedDict[str, Rule]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def get(self, klass: str) -> Optional[Rule]:
+        """Return the rule for a CSS class name (without the leading '.'), or None if
+        it isn't a truecolor class"""
+        with self._lock:
+            rule = self._rules.get(klass)
+            if rule is not None:
+                self._rules.move_to_end(klass)
+                return rule
+
+            rule = create_truecolor_rule(klass)
+            if rule is None:
+                return None
+
+            self._rules[klass] = rule
+            if len(self._rules) > self.max_size:
+                self._rules.popitem(last=False)
+
+            return rule
 
-    return css
 
+def create_truecolor_rule(klass: str) -> Optional[Rule]:
+    """Create the rule for a truecolor CSS class name (without the leading '.')"""
+    match = _truecolor_class_re.fullmatch(klass)
+    if match is None:
+        return None
 
-# as truecolor encoding has 16 millions colors, adding only used colors during parsing
-def add_truecolor_style_rule(
-    is_foreground: bool, ansi_code: int, r: int, g: int, b: int, parameter: str
-) -> None:
-    rule_name = ".ansi{}-{}".format(ansi_code, parameter)
-    color = "#{:02X}{:02X}{:02X}".format(r, g, b)
-    if is_foreground:
-        rule = Rule(rule_name, color=color)
-    else:
-        rule = Rule(rule_name, background_color=color)
-    truecolor_rules.append(rule)
+    ansi_code, r, g, b = match.groups()
+    color = "#{:02X}{:02X}{:02X}".format(int(r), int(g), int(b))
+    if ansi_code == "38":
+        return Rule("." + klass, color=color)
+    return Rule("." + klass, background_color=color)
 
 
-def pop_truecolor_styles() -> Dict[str, Rule]:
-    global truecolor_rules  # pylint: disable=global-statement
-    styles = dict([(item.klass.strip("."), item) for item in truecolor_rules])
-    truecolor_rules = []
-    return styles
+_truecolor_class_re = re.compile(r"ansi(38|48)-(\d{3})(\d{3})(\d{3})")
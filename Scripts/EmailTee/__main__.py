@@ -16,10 +16,11 @@
 """Sends an email message that includes the result on logs of an executed process."""
 
 import os
+import shutil
 import sys
+import tempfile
 
 from datetime import datetime
-from io import StringIO
 from pathlib import Path
 from typing import Optional
 
@@ -36,12 +37,15 @@ from Common_Foundation.Streams.StreamDecorator import StreamDecorator
 from Common_Foundation import SubprocessEx
 
 from Common_EmailMixin.SmtpMailer import SmtpMailer
+from Common_EmailMixin.SmtpOutbox import SmtpOutbox
 
 
 # ----------------------------------------------------------------------
 sys.path.insert(0, str(PathEx.EnsureDir(Path(__file__).parent / "Impl")))
 with ExitStack(lambda: sys.path.pop(0)):
     from Impl.ansi2html.converter import Ansi2HTMLConverter
+    from Impl.OutputCapture import OutputCapture
+    from Impl.RedrawResolver import RedrawResolver
 
 
 # ----------------------------------------------------------------------
@@ -76,6 +80,13 @@ def EntryPoint(
     force_color: bool=typer.Option(False, "--force-color", help="Forces color ouptut."),
     output_filename: Optional[Path]=typer.Option(None, "--output-filename", dir_okay=False, resolve_path=True, help="Writes formatted html output to a file; this is useful when --force-color has also been specified as an argument."),
     background_color: str=typer.Option("black", "--background-color", help="Email background color."),
+    max_capture_memory: int=typer.Option(OutputCapture.DEFAULT_MAX_MEMORY_SIZE, "--max-capture-memory", min=0, help="Output is captured in memory until it exceeds this size (in bytes), at which point it is spooled to a temporary file; 0 writes the output to a temporary file immediately."),
+    max_lines: Optional[int]=typer.Option(None, "--max-lines", min=1, help="Limits the email message to this many lines of output; the first and last lines are included and those in between are omitted. The terminal output is not truncated."),
+    max_bytes: Optional[int]=typer.Option(None, "--max-bytes", min=1, help="Limits the email message to this many bytes of output; the first and last lines are included and those in between are omitted. The terminal output is not truncated."),
+    resolve_redraws: bool=typer.Option(False, "--resolve-redraws", help="Resolves carriage returns, erase line, and cursor movement sequences in the output to the text that would be visible in a terminal; this significantly reduces the size of the email message for output that includes progress bars."),
+    email_deadline: Optional[float]=typer.Option(None, "--email-deadline", min=0.001, help="Maximum number of seconds spent sending the email message (including retries); overrides the deadline in the SMTP profile."),
+    enqueue: bool=typer.Option(False, "--enqueue", help="Adds the message to the outbox rather than sending it; the message is sent by a background process and is retried if it can't be sent. Use 'CreateSmtpMailer{} Flush' to send messages in the outbox.".format(CurrentShell.script_extensions[0])),
+    jobs: int=typer.Option(1, "--jobs", min=1, help="Number of processes used to convert large output to HTML; when greater than 1, all of the output is read into memory before it is converted."),
     verbose: bool=typer.Option(False, "--verbose", help="Write verbose information to the terminal."),
     debug: bool=typer.Option(False, "--debug", help="Write debug information to the terminal."),
 ) -> None:
@@ -112,7 +123,11 @@ def EntryPoint(
             suffix="\n",
         ) as running_dm:
             # Create the stream used to capture the message content
-            message_sink = StringIO()
+            message_sink = OutputCapture(
+                max_capture_memory,
+                max_lines=max_lines,
+                max_bytes=max_bytes,
+            )
 
             Capabilities.Create(
                 message_sink,
@@ -128,63 +143,108 @@ def EntryPoint(
                     StreamDecorator([message_sink, dm_stream]),
                 )
 
-            message = message_sink.getvalue()
-
-        with dm.Nested(
-            "Processing output...",
-            suffix="\n",
-        ) as processing_dm:
-            title = None
-
-            if output_filename:
-                title = output_filename.stem
-
-            # Value to convert spaces into before the text is converted to html.
-            space_placeholder = "__nbsp;__"
-
-            with processing_dm.Nested("Converting output to HTML..."):
-                message = message.replace(" ", space_placeholder)
-
-                message = Ansi2HTMLConverter(
-                    dark_bg=True,
-                    inline=True,
-                    line_wrap=False,
-                    title=title or "",
-                ).convert(message)
-
-            for source, dest in [
-                (space_placeholder, "&nbsp;"),
-                # Create a div to set the background color
-                (
-                    '<pre class="ansi2html-content">\n',
-                    '<pre class="ansi2html-content">\n<div style="background-color: {}">\n'.format(background_color),
-                ),
-                # Undo the div that set the background color
-                (
-                    "</pre>\n",
-                    "</div>\n</pre>\n",
-                ),
-            ]:
-                message = message.replace(source, dest)
-
-            if output_filename is not None:
-                with processing_dm.Nested("Writing to '{}'...".format(output_filename)):
-                    output_filename.parent.mkdir(parents=True, exist_ok=True)
-
-                    with output_filename.open("w", encoding="utf-8") as f:
-                        f.write(message)
-
-        with dm.Nested("Sending email...") as email_dm:
-            try:
-                smtp_mailer.SendMessage(
-                    email_recipients,
-                    email_subject.format(now=datetime.now()),
-                    message,
-                    message_format="html",
-                )
-            except Exception as ex:
-                email_dm.WriteError(str(ex))
-                return
+        with tempfile.TemporaryDirectory() as temp_directory:
+            # The HTML document is written to a file, which is read as the message is sent
+            message_filename = output_filename or (Path(temp_directory) / "message.html")
+
+            with dm.Nested(
+                "Processing output...",
+                suffix="\n",
+            ) as processing_dm:
+                title = None
+
+                if output_filename:
+                    title = output_filename.stem
+
+                # The document's styles are known once all of the output has been converted,
+                # so the converted output is spooled to a file and then copied to the document
+                with tempfile.TemporaryFile(
+                    "w+",
+                    encoding="utf-8",
+                    newline="",
+                ) as body_file:
+                    with processing_dm.Nested("Converting output to HTML..."):
+                        converter = Ansi2HTMLConverter(
+                            dark_bg=True,
+                            inline=True,
+                            line_wrap=False,
+                            title=title or "",
+                            preserve_spaces=True,
+                            background_color=background_color,
+                        )
+
+                        if jobs > 1:
+                            with message_sink:
+                                if resolve_redraws:
+                                    content = "".join(RedrawResolver().Resolve(message_sink.Read()))
+                                else:
+                                    content = message_sink.GetValue()
+
+                            body_file.write(converter.convert(content, full=False, jobs=jobs))
+                            del content
+
+                        else:
+                            # Convert the captured output incrementally rather than creating (and
+                            # converting) a single string
+                            with message_sink:
+                                chunks = message_sink.Read()
+
+                                if resolve_redraws:
+                                    chunks = RedrawResolver().Resolve(chunks)
+
+                                for chunk in chunks:
+                                    body_file.write(converter.feed(chunk))
+
+                            body_file.write(converter.finish())
+
+                    with processing_dm.Nested(
+                        "Writing to '{}'...".format(output_filename) if output_filename is not None else "Writing the message...",
+                    ):
+                        document_start, document_end = converter.produce_document_parts()
+
+                        message_filename.parent.mkdir(parents=True, exist_ok=True)
+
+                        body_file.seek(0)
+
+                        with message_filename.open("w", encoding="utf-8") as f:
+                            f.write(document_start)
+                            shutil.copyfileobj(body_file, f, OutputCapture.DEFAULT_READ_CHUNK_SIZE)
+                            f.write(document_end)
+
+            if enqueue:
+                with dm.Nested("Adding email to the outbox...") as email_dm:
+                    try:
+                        outbox = SmtpOutbox()
+
+                        outbox.Enqueue(
+                            smtp_profile_name,
+                            smtp_mailer.CreateStreamingMessage(
+                                email_recipients,
+                                email_subject.format(now=datetime.now()),
+                                message_filename,
+                                message_format="html",
+                            ),
+                        )
+
+                        outbox.StartBackgroundFlush()
+
+                    except Exception as ex:
+                        email_dm.WriteError(str(ex))
+                        return
+
+            else:
+                with dm.Nested("Sending email...") as email_dm:
+                    try:
+                        smtp_mailer.SendMessage(
+                            email_recipients,
+                            email_subject.format(now=datetime.now()),
+                            message_filename,
+                            message_format="html",
+                            deadline_seconds=email_deadline,
+                        )
+                    except Exception as ex:
+                        email_dm.WriteError(str(ex))
+                        return
 
 
 # ----------------------------------------------------------------------